@@ -0,0 +1,175 @@
+from typing import *
+import io
+
+from JlangObjects import *
+
+INT64_MIN: int = -(1 << 63)
+INT64_MAX: int = (1 << 63) - 1
+UINT64_MASK: int = (1 << 64) - 1
+
+# replaces arithmetic with a constant right operand by cheaper instruction sequences. Products become shifts
+# and lea, quotients and remainders by powers of two become shifts and masks, and the other divisors are
+# multiplied by a magic number and shifted, like print divides by 10 with a multiply-high instead of div.
+# Division truncates towards zero like idiv does, the remainder has the sign of the dividend
+class ArithmeticLowering:
+    # lea adds a register scaled by 2, 4 or 8 to itself, which multiplies it by 3, 5 or 9
+    lea_factors: Dict[int, int] = {3: 2, 5: 4, 9: 8}
+
+    @staticmethod
+    def fits_imm32(value: int) -> bool:
+        return -2**31 <= value < 2**31
+
+    # the k of 2^k, None if value isn't a power of two greater than 1
+    @staticmethod
+    def log2(value: int) -> Optional[int]:
+        if value < 2 or value & (value - 1) != 0:
+            return None
+        return value.bit_length() - 1
+
+    # the magic number and shift of a signed division by a divisor that isn't 0, 1, -1 or a power of two,
+    # following Hacker's Delight, figure 10-1: the quotient is the high half of magic * dividend, corrected
+    # by the dividend when the magic number has the other sign, shifted right and rounded towards zero
+    @staticmethod
+    def signed_magic(divisor: int) -> Tuple[int, int]:
+        two63 = 1 << 63
+        abs_divisor = abs(divisor)
+        t = two63 + (1 if divisor < 0 else 0)
+        abs_nc = t - 1 - t % abs_divisor # the largest dividend whose remainder is abs_divisor - 1
+        p = 63
+        q1, r1 = divmod(two63, abs_nc)
+        q2, r2 = divmod(two63, abs_divisor)
+        while True:
+            p += 1
+            q1, r1 = (2 * q1) & UINT64_MASK, (2 * r1) & UINT64_MASK
+            if r1 >= abs_nc:
+                q1, r1 = (q1 + 1) & UINT64_MASK, (r1 - abs_nc) & UINT64_MASK
+            q2, r2 = (2 * q2) & UINT64_MASK, (2 * r2) & UINT64_MASK
+            if r2 >= abs_divisor:
+                q2, r2 = (q2 + 1) & UINT64_MASK, (r2 - abs_divisor) & UINT64_MASK
+            delta = abs_divisor - r2
+            if not (q1 < delta or (q1 == delta and r1 == 0)):
+                break
+        magic = (q2 + 1) & UINT64_MASK
+        if divisor < 0:
+            magic = -magic & UINT64_MASK
+        if magic > INT64_MAX: # as a signed 64 bit immediate
+            magic -= 1 << 64
+        return magic, p - 64
+
+    # whether reg operator constant has a sequence without a second register. Dividing by 0 and by -1 is
+    # left to idiv, so it faults where it would have faulted before
+    @staticmethod
+    def lowers(operator: Operator, constant: int) -> bool:
+        if not INT64_MIN <= constant <= INT64_MAX:
+            return False
+        if operator == Operator.PLUS or operator == Operator.MINUS:
+            return ArithmeticLowering.fits_imm32(constant)
+        elif operator == Operator.MULTIPLY:
+            return ArithmeticLowering.fits_imm32(constant) or ArithmeticLowering.log2(abs(constant)) is not None
+        elif operator == Operator.DIVIDE:
+            return constant != 0 and constant != -1
+        elif operator == Operator.MODULO:
+            if constant == 0 or constant == -1:
+                return False
+            shift = ArithmeticLowering.log2(abs(constant))
+            if shift is not None: # the mask is an immediate
+                return shift <= 31
+            return ArithmeticLowering.fits_imm32(constant)
+        return False
+
+    # the registers the sequence overwrites besides reg
+    @staticmethod
+    def clobbered(operator: Operator, constant: int) -> Tuple[str, ...]:
+        if operator != Operator.DIVIDE and operator != Operator.MODULO or abs(constant) == 1:
+            return ()
+        elif ArithmeticLowering.log2(abs(constant)) is not None:
+            return ("rdx",)
+        return ("rax", "rdx")
+
+    # replace the value in reg with reg operator constant. reg can't be one of the clobbered registers
+    @staticmethod
+    def codegen(sink: io.StringIO, operator: Operator, reg: str, constant: int):
+        assert ArithmeticLowering.lowers(operator, constant), f"{operator.name} by {constant} has no cheaper sequence"
+        assert reg not in ArithmeticLowering.clobbered(operator, constant), f"{reg} is overwritten by {operator.name} by {constant}"
+        if operator == Operator.PLUS:
+            if constant != 0:
+                sink.write(f"add {reg}, {constant}\n")
+        elif operator == Operator.MINUS:
+            if constant != 0:
+                sink.write(f"sub {reg}, {constant}\n")
+        elif operator == Operator.MULTIPLY:
+            ArithmeticLowering.__multiply(sink, reg, constant)
+        elif operator == Operator.DIVIDE:
+            shift = ArithmeticLowering.log2(abs(constant))
+            if shift is not None:
+                ArithmeticLowering.__round_towards_zero(sink, reg, shift, "rdx")
+                sink.write(f"add {reg}, rdx\n")
+                sink.write(f"sar {reg}, {shift}\n")
+                if constant < 0:
+                    sink.write(f"neg {reg}\n")
+            elif constant != 1: # the magic number of a negative divisor gives the negated quotient
+                ArithmeticLowering.__magic_quotient(sink, reg, constant)
+                sink.write(f"mov {reg}, rdx\n")
+        elif operator == Operator.MODULO:
+            shift = ArithmeticLowering.log2(abs(constant))
+            if abs(constant) == 1:
+                sink.write(f"xor {reg}, {reg}\n")
+            elif shift is not None:
+                # the dividend rounded towards zero to a multiple of 2^k is taken away from it
+                ArithmeticLowering.__round_towards_zero(sink, reg, shift, "rdx")
+                sink.write(f"add rdx, {reg}\n")
+                sink.write(f"and rdx, {-(1 << shift)}\n")
+                sink.write(f"sub {reg}, rdx\n")
+            else:
+                ArithmeticLowering.__magic_quotient(sink, reg, constant)
+                sink.write(f"imul rdx, rdx, {constant}\n")
+                sink.write(f"sub {reg}, rdx\n")
+        else:
+            raise ValueError(f"{operator.name} has no cheaper sequence")
+
+    @staticmethod
+    def __multiply(sink: io.StringIO, reg: str, constant: int):
+        factor = abs(constant)
+        shift = 0
+        while factor > 1 and factor % 2 == 0:
+            factor //= 2
+            shift += 1
+        if constant == 0:
+            sink.write(f"xor {reg}, {reg}\n")
+            return
+        elif factor != 1 and factor not in ArithmeticLowering.lea_factors:
+            sink.write(f"imul {reg}, {reg}, {constant}\n")
+            return
+
+        if factor in ArithmeticLowering.lea_factors:
+            sink.write(f"lea {reg}, [{reg} + {reg} * {ArithmeticLowering.lea_factors[factor]}]\n")
+        if shift > 0:
+            sink.write(f"shl {reg}, {shift}\n")
+        if constant < 0:
+            sink.write(f"neg {reg}\n")
+
+    # temp is 2^k - 1 for a negative reg and 0 otherwise, adding it makes the arithmetic shift by k round
+    # towards zero instead of down
+    @staticmethod
+    def __round_towards_zero(sink: io.StringIO, reg: str, shift: int, temp: str):
+        sink.write(f"mov {temp}, {reg}\n")
+        if shift > 1:
+            sink.write(f"sar {temp}, 63\n")
+        sink.write(f"shr {temp}, {64 - shift}\n")
+
+    # the quotient of reg by the divisor ends up in rdx, rax is overwritten
+    @staticmethod
+    def __magic_quotient(sink: io.StringIO, reg: str, divisor: int):
+        magic, shift = ArithmeticLowering.signed_magic(divisor)
+        sink.write(f"mov rax, {magic}\n")
+        sink.write(f"imul {reg}\n") # rdx is the high half of magic * reg
+        if divisor > 0 and magic < 0:
+            sink.write(f"add rdx, {reg}\n")
+        elif divisor < 0 and magic > 0:
+            sink.write(f"sub rdx, {reg}\n")
+        if shift > 0:
+            sink.write(f"sar rdx, {shift}\n")
+        # a negative quotient is rounded down by the shift, adding its sign bit rounds it towards zero
+        sink.write("mov rax, rdx\n")
+        sink.write("shr rax, 63\n")
+        sink.write("add rdx, rax\n")
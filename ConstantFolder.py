@@ -0,0 +1,148 @@
+from typing import *
+
+from JlangObjects import *
+from Statements import *
+
+INT64_MIN: int = -(1 << 63)
+INT64_MAX: int = (1 << 63) - 1
+
+# values wrap around like they do in a 64 bit register
+def wrap_int64(value: int) -> int:
+    return ((value - INT64_MIN) & ((1 << 64) - 1)) + INT64_MIN
+
+# division truncates towards zero like idiv does, the remainder has the sign of the dividend
+def truncated_divmod(LHS: int, RHS: int) -> Tuple[int, int]:
+    quotient = abs(LHS) // abs(RHS)
+    if (LHS < 0) != (RHS < 0):
+        quotient = -quotient
+    return quotient, LHS - RHS * quotient
+
+# evaluates expressions that only depend on literals and constants at compile time and
+# replaces them with literals, so their values are not computed on the stack at runtime
+class ConstantFolder:
+    def __init__(self):
+        self.folded: int = 0 # number of binary expressions replaced by literals
+        self.addressed_constants: Set[str] = set() # constants whose address is taken, only those are kept in memory
+
+    # the value of a literal or a constant, None if it is only known at runtime
+    @staticmethod
+    def value_of(expr: Expression) -> Optional[int]:
+        if isinstance(expr, IntLiteralExpr):
+            return wrap_int64(expr.value)
+        elif isinstance(expr, IdentRefExpr) and expr.ident_kind == IdentType.CONSTANT:
+            assert isinstance(expr.symbol.definition, Constant), f"Expected constant definition for {expr.value}"
+            value = expr.symbol.definition.value
+            if isinstance(value, int): # string constants are labels, their address is only known to the assembler
+                return wrap_int64(value)
+        return None
+
+    # None if the operation would fault at runtime, it is left to do so
+    @staticmethod
+    def apply_operator(operator: Operator, LHS: int, RHS: int) -> Optional[int]:
+        assert len(Operator) == 11, "Too many Operators defined at ConstantFolder.apply_operator"
+        if operator == Operator.PLUS:
+            return wrap_int64(LHS + RHS)
+        elif operator == Operator.MINUS:
+            return wrap_int64(LHS - RHS)
+        elif operator == Operator.MULTIPLY:
+            return wrap_int64(LHS * RHS)
+        elif operator == Operator.DIVIDE or operator == Operator.MODULO:
+            if RHS == 0 or (LHS == INT64_MIN and RHS == -1):
+                return None
+            quotient, remainder = truncated_divmod(LHS, RHS)
+            return quotient if operator == Operator.DIVIDE else remainder
+        elif operator == Operator.EQUAL:
+            return int(LHS == RHS)
+        elif operator == Operator.NOT_EQUAL:
+            return int(LHS != RHS)
+        elif operator == Operator.LESS:
+            return int(LHS < RHS)
+        elif operator == Operator.LESS_EQUAL:
+            return int(LHS <= RHS)
+        elif operator == Operator.GREATER:
+            return int(LHS > RHS)
+        elif operator == Operator.GREATER_EQUAL:
+            return int(LHS >= RHS)
+        else:
+            raise ValueError(f"Unknown operator {operator}")
+
+    # fold the constant subtrees of a binary expression in post-order, with an explicit stack
+    # so long operator chains don't recurse. Operands that are not binary expressions are
+    # appended to pending, so the caller can fold the expressions nested inside of them
+    def fold_expression(self, expr: Expression, pending: Optional[List[Statement]] = None) -> Expression:
+        folded: Dict[int, Expression] = {}
+        stack: List[Tuple[Expression, bool]] = [(expr, False)]
+        while len(stack) > 0:
+            cur_expr, operands_done = stack.pop()
+            if not isinstance(cur_expr, BinaryExpr):
+                folded[id(cur_expr)] = ConstantFolder.__inline_constant(cur_expr)
+                if pending is not None:
+                    pending.append(cur_expr)
+            elif operands_done:
+                cur_expr.value = folded.pop(id(cur_expr.value))
+                cur_expr.right = folded.pop(id(cur_expr.right))
+                folded[id(cur_expr)] = self.__fold_operator(cur_expr)
+            else:
+                stack.append((cur_expr, True))
+                stack.append((cur_expr.right, False))
+                stack.append((cur_expr.value, False))
+        return folded[id(expr)]
+
+    # replace a binary expression over two known values with a literal of the same type,
+    # so casts like pointer(PAGE plus HEADER) keep their type
+    def __fold_operator(self, expr: BinaryExpr) -> Expression:
+        LHS = ConstantFolder.value_of(expr.value)
+        RHS = ConstantFolder.value_of(expr.right)
+        if LHS is None or RHS is None:
+            return expr
+        value = ConstantFolder.apply_operator(expr.token.value, LHS, RHS)
+        if value is None:
+            return expr
+        literal = IntLiteralExpr(expr.token, value)
+        literal.type = expr.type
+        literal.size = expr.size
+        self.folded += 1
+        return literal
+
+    # a reference to a constant is replaced by its value, a literal or the label of a string
+    @staticmethod
+    def __inline_constant(expr: Expression) -> Expression:
+        if not isinstance(expr, IdentRefExpr) or expr.ident_kind != IdentType.CONSTANT:
+            return expr
+        value = expr.symbol.definition.value
+        replacement = IntLiteralExpr(expr.token, value) if isinstance(value, int) else ArrayRefExpr(expr.token, value)
+        replacement.type = expr.type
+        return replacement
+
+    # the compile time value of an expression, an int or the label of a string, None if it is only known at runtime
+    def evaluate(self, expr: Expression) -> Optional[Union[int, str]]:
+        expr = self.fold_expression(expr)
+        value = ConstantFolder.value_of(expr)
+        if value is not None:
+            return value
+        elif isinstance(expr, ArrayRefExpr) and expr.symbol is None:
+            return expr.value
+        elif isinstance(expr, IdentRefExpr) and expr.ident_kind == IdentType.CONSTANT:
+            return expr.symbol.definition.value
+        return None
+
+    # fold every expression in the statements, the statements are changed in place
+    def fold_program(self, statements: List[Statement]):
+        pending: List[Statement] = list(statements)
+        while len(pending) > 0:
+            node = pending.pop()
+            if isinstance(node, AddressOfExpr):
+                if node.value.ident_kind == IdentType.CONSTANT:
+                    self.addressed_constants.add(node.value.value)
+                continue # the identifier stays, its address is taken
+            for name, value in vars(node).items():
+                if isinstance(value, Expression):
+                    setattr(node, name, self.fold_expression(value, pending))
+                elif isinstance(value, Statement):
+                    pending.append(value)
+                elif isinstance(value, list):
+                    for index, item in enumerate(value):
+                        if isinstance(item, Expression):
+                            value[index] = self.fold_expression(item, pending)
+                        elif isinstance(item, Statement):
+                            pending.append(item)
@@ -0,0 +1,65 @@
+from typing import *
+from enum import Enum
+
+from JlangObjects import *
+from Statements import *
+
+# what running a piece of code can do besides computing its value, the effects are ordered from fewest to most
+class Effect(Enum):
+    PURE = 0        # only reads its parameters and locals
+    READ_ONLY = 1   # reads memory or globals as well, it writes nothing that outlives it
+    IMPURE = 2      # stores to memory, sets globals, makes system calls or prints
+
+    def describe(self) -> str:
+        return self.name.lower().replace("_", "-")
+
+# infers the effects of the functions of a program from their bodies. Writing the function's own locals is no
+# effect, a store through any pointer is. A function has the effects of the functions it calls, those are
+# found by raising every function from pure until nothing changes, so recursive functions can be pure as well
+class EffectAnalysis:
+    def __init__(self):
+        self.effects: Dict[str, Effect] = {}
+
+    def analyse_program(self, statements: List[Statement]):
+        functions = [stmt for stmt in statements if isinstance(stmt, FunStmt)]
+        self.effects = {fun.proto.name: Effect.PURE for fun in functions}
+        changed = True
+        while changed:
+            changed = False
+            for fun in functions:
+                effect = self.effect_of(fun.block)
+                if effect != self.effects[fun.proto.name]:
+                    self.effects[fun.proto.name] = effect
+                    changed = True
+
+    # the effect of calling the function, a function that isn't known could do anything
+    def effect_of_call(self, name: str) -> Effect:
+        return self.effects.get(name, Effect.IMPURE)
+
+    # the effects of running the statements, the blocks of if and while included
+    def effect_of(self, statements: List[Statement]) -> Effect:
+        effect = Effect.PURE
+        pending: List[Any] = list(statements)
+        while len(pending) > 0 and effect != Effect.IMPURE:
+            node = pending.pop()
+            effect = Effect(max(effect.value, self.own_effect(node).value))
+            for value in vars(node).values():
+                if isinstance(value, Statement):
+                    pending.append(value)
+                elif isinstance(value, list):
+                    pending.extend(item for item in value if isinstance(item, Statement))
+        return effect
+
+    # the effect of the node without the nodes below it
+    def own_effect(self, node: Statement) -> Effect:
+        if isinstance(node, (StorerStmt, BulkStorerStmt, SyscallExpr, PrintStmt)):
+            return Effect.IMPURE
+        elif isinstance(node, (VarDefStmt, VarSetStmt)) and node.var_type == IdentType.GLOBAL_VARIABLE:
+            return Effect.IMPURE
+        elif isinstance(node, FunCallExpr):
+            return self.effect_of_call(node.target.value)
+        elif isinstance(node, LoaderExpr) or (isinstance(node, VectorExpr) and node.token.value != Intrinsic.BITSCAN):
+            return Effect.READ_ONLY
+        elif isinstance(node, IdentRefExpr) and node.ident_kind == IdentType.GLOBAL_VARIABLE:
+            return Effect.READ_ONLY
+        return Effect.PURE
@@ -1,3 +1,5 @@
+import os
+import hashlib
 from ast import expr
 from pickle import TRUE
 from typing import *
@@ -6,32 +8,133 @@ from pymysql import Binary
 
 from JlangObjects import *
 from Statements import *
-from Tokenizer import Tokenizer
+from Tokenizer import Tokenizer, TokenStream
+from ModuleCache import ModuleCache, CachedModule, hash_file
+from ConstantFolder import ConstantFolder
 
 class ExpressionParser:
-    def __init__(self, tokens: List[Token]):
-        self.tokens = tokens
+    def __init__(self, tokens: Iterable[Token], filename: Optional[str] = None, module_cache: Optional[ModuleCache] = None):
+        self.tokens = TokenStream(tokens)
+        # canonical paths of every file whose tokens have been read, each file is only imported once
+        self.imported_files: Set[str] = set()
+        if filename is not None:
+            self.imported_files.add(os.path.realpath(filename))
+        self.module_cache: Optional[ModuleCache] = module_cache
+        self.import_records: List[Tuple[str, bool]] = [] # every import in order, and whether the file was read
+        self.module_statements: List[Statement] = [] # statements of imported files, in order
         self.global_const_vars: List[str] = []
-        self.index = 0
         self.cur_tok: Optional[Token] = self.__next_token()
         self.prototypes: Dict[str, FunProto] = {}
         self.constants: Dict[str, Constant] = {}
         self.global_vars: Dict[str, VarDefStmt] = {}
-        self.scope_vars: Dict[str, VarDefStmt] = {}
-        self.anonymous_scope_vars: List[VarDefStmt] = [] # variables without a name in the current scope
+        self.folder: ConstantFolder = ConstantFolder()
+        # every name is resolved through the scope chain, the definitions above are kept for emitting them
+        self.global_scope: Scope = Scope()
+        self.scope: Scope = self.global_scope
         self.in_scope: bool = False
 
-    def __insert_tokens(self, tokens: List[Token]):
-        #insert the tokens at the current index
-        self.tokens = self.tokens[:self.index] + tokens + self.tokens[self.index:]
+    # parse an imported file and return its top level statements
+    def __import_file(self, filename: str) -> List[Statement]:
+        path = os.path.realpath(filename)
+        if path in self.imported_files:
+            self.import_records.append((path, False))
+            return []
+        self.imported_files.add(path)
+        self.import_records.append((path, True))
+
+        if self.module_cache is None:
+            return self.__parse_module(filename)
+
+        environment = self.__environment_digest()
+        module = self.module_cache.load(path, environment)
+        if module is not None and self.__is_reusable(module):
+            return self.__apply_module(module)
+
+        source_hash = hash_file(path)
+        records_start = len(self.import_records)
+        string_base = len(self.global_const_vars)
+        prototypes = self.prototypes.copy()
+        constants = self.constants.copy()
+        global_vars = self.global_vars.copy()
+        symbols = self.global_scope.symbols.copy()
+
+        statements = self.__parse_module(filename)
+
+        module = CachedModule(
+            statements,
+            {name: proto for name, proto in self.prototypes.items() if prototypes.get(name) is not proto},
+            {name: const for name, const in self.constants.items() if constants.get(name) is not const},
+            {name: var for name, var in self.global_vars.items() if global_vars.get(name) is not var},
+            [symbol for name, symbol in self.global_scope.symbols.items() if symbols.get(name) is not symbol],
+            self.global_const_vars[string_base:],
+            string_base,
+            self.import_records[records_start:]
+        )
+        module.sources[path] = source_hash
+        for nested_path, was_read in module.imports:
+            if was_read:
+                module.sources[nested_path] = hash_file(nested_path)
+        self.module_cache.store(path, environment, module)
+        return statements
+
+    def __parse_module(self, filename: str) -> List[Statement]:
+        # the statements of an outer file that have not been collected yet stay with it
+        outer_statements = self.module_statements
+        self.module_statements = []
+
+        self.tokens.push(Tokenizer(filename, lazy = True))
+        self.__next_token()
+        statements: List[Statement] = []
+        while True:
+            stmt = self.parse_top_level()
+            statements.extend(self.module_statements)
+            self.module_statements.clear()
+            if stmt is None:
+                break
+            statements.append(stmt)
+        self.tokens.pop()
+
+        self.module_statements = outer_statements
+        return statements
+
+    # digest of everything that can change how an imported file is parsed
+    def __environment_digest(self) -> str:
+        lines: List[str] = []
+        for proto in self.prototypes.values():
+            lines.append(f"function {proto.name} {[arg.type.name for arg in proto.args.values()]} {proto.type.name}")
+        for const in self.constants.values():
+            lines.append(f"constant {const.name} {const.type.name} {const.value!r}")
+        for var in self.global_vars.values():
+            lines.append(f"global {var.name} {var.type.name} {var.size}")
+        return hashlib.sha256("\n".join(sorted(lines)).encode("utf-8")).hexdigest()
+
+    # a cached module can only be used if its imports would read the same files now
+    def __is_reusable(self, module: CachedModule) -> bool:
+        imported_files = set(self.imported_files)
+        for path, was_read in module.imports:
+            if was_read == (path in imported_files):
+                return False
+            imported_files.add(path)
+        return True
+
+    def __apply_module(self, module: CachedModule) -> List[Statement]:
+        module.relocate_strings(len(self.global_const_vars))
+        self.prototypes.update(module.prototypes)
+        self.constants.update(module.constants)
+        self.global_vars.update(module.global_vars)
+        for symbol in module.symbols:
+            self.global_scope.define(symbol)
+        self.global_const_vars.extend(module.strings)
+        for path, was_read in module.imports:
+            if was_read:
+                self.imported_files.add(path)
+        self.import_records.extend(module.imports)
+        return module.statements
+
 #region helper functions
 
     def __next_token(self) -> Optional[Token]:
-        if self.index >= len(self.tokens):
-            self.cur_tok = None
-        else:
-            self.cur_tok = self.tokens[self.index]
-            self.index += 1
+        self.cur_tok = self.tokens.next()
         return self.cur_tok
 
     def __get_precedence(self) -> int:
@@ -39,7 +142,7 @@ class ExpressionParser:
 
         if self.cur_tok is None:
             return -1
-        elif self.cur_tok.type == TokenType.OPERATOR and self.cur_tok.value in BINOP_PRECEDENCE:
+        elif self.cur_tok.type == TokenType.OPERATOR and self.cur_tok.text in BINOP_PRECEDENCE:
             return BINOP_PRECEDENCE[self.cur_tok.text]
         else:
             return 0
@@ -97,84 +200,67 @@ class ExpressionParser:
         assert isinstance(self.cur_tok.value, str), "Expected string value for identifier"
         if self.cur_tok is None:
             return None
-        elif self.cur_tok.value in self.prototypes:
-            type = self.prototypes[self.cur_tok.value].type
-            return IdentRefExpr(self.cur_tok, self.cur_tok.value, IdentType.FUNCTION, type)
-        elif self.cur_tok.value in self.scope_vars:
-            type = self.scope_vars[self.cur_tok.value].type
-            return IdentRefExpr(self.cur_tok, self.cur_tok.value, IdentType.VARIABLE, type)
-        elif self.cur_tok.value in self.global_vars:
-            type = self.global_vars[self.cur_tok.value].type
-            return IdentRefExpr(self.cur_tok, self.cur_tok.value, IdentType.GLOBAL_VARIABLE, type)
-        elif self.cur_tok.value in self.constants:
-            type = self.constants[self.cur_tok.value].type
-            return IdentRefExpr(self.cur_tok, self.cur_tok.value, IdentType.CONSTANT, type)
-        else:
+        symbol = self.scope.lookup(self.cur_tok.value)
+        if symbol is None:
             return None
+        return IdentRefExpr(self.cur_tok, self.cur_tok.value, symbol.kind, symbol.type, symbol)
     
-    # get a mutable reference to the current identifier token
-    def __get_ident_def(self):
+    # get the symbol of the current identifier token if it can be assigned to
+    def __get_ident_def(self) -> Optional[Symbol]:
         assert len(IdentType) == 4, "Too many IdentTypes defined at ExpressionParser.parse_identifier_expression"
-        if self.cur_tok.value in self.prototypes:
-            raise Exception(f"Cannot get mutable identifiers for functions at {self.cur_tok.value} at {format_location(self.cur_tok.location)}")
-        elif self.cur_tok.value in self.scope_vars:
-            return self.scope_vars[self.cur_tok.value]
-        elif self.cur_tok.value in self.global_vars:
-            return self.global_vars[self.cur_tok.value]
-        else:
+        symbol = self.scope.lookup(self.cur_tok.value)
+        if symbol is None or symbol.kind == IdentType.CONSTANT:
             return None
+        elif symbol.kind == IdentType.FUNCTION:
+            raise Exception(f"Cannot get mutable identifiers for functions at {self.cur_tok.value} at {format_location(self.cur_tok.location)}")
+        return symbol
 
-    # return the value if the current token is a constant or a literal
+    # return the value of an expression that is known at compile time
     def __resolve_if_constant(self, expr: Expression) -> Union[int, str]:
-        if isinstance(expr, IntLiteralExpr):
-            return expr.value
-        elif isinstance(expr, ArrayRefExpr):
-            return expr.value
-        elif isinstance(expr, IdentRefExpr) and expr.ident_kind == IdentType.CONSTANT:
-            return self.constants[expr.value].value
-        else:
-            raise ValueError(f"Expected constant or literal expression but got {expr.token}")
+        value = self.folder.evaluate(expr)
+        if value is None:
+            raise ValueError(f"Expected constant expression but got {expr.token}")
+        return value
 #endregion
 
+    # returns the next function on the top level, everything else on the top level
+    # only changes the parser state, so it's consumed in a loop until a function shows up
     def parse_top_level(self) -> Optional[Statement]:
-    # allowed on top level: function, assign
-        if self.cur_tok is None:
-            return None
-        elif self.cur_tok.type == TokenType.EOE: # try again with the next token
-            self.__next_token()
-            return self.parse_top_level()
-        elif self.cur_tok.type == TokenType.KEYWORD:
-            assert len(Keyword) == 14, "Invalid amount of keywords defined at ExpressionParser.parse_top_level"
-            if self.cur_tok.value == Keyword.CONSTANT:
-                self.parse_const_def()
-                return self.parse_top_level()
-            elif self.cur_tok.value == Keyword.FUNCTION:
-                return self.parse_function_statement()
-            elif self.cur_tok.value == Keyword.DEFINE:
-                self.parse_var_def_statement()
-                # we've added it to the global scope, so we can parse the next statement
-                return self.parse_top_level()
-            elif self.cur_tok.value == Keyword.IMPORT:
-                self.__next_token()
-                assert isinstance(self.cur_tok.value, str), "Expected string value for import"
-                self.__insert_tokens(Tokenizer(self.cur_tok.value).tokens)
+    # allowed on top level: function, constant, define, import
+        while self.cur_tok is not None:
+            if self.cur_tok.type == TokenType.EOE: # try again with the next token
                 self.__next_token()
-                return self.parse_top_level()
-
-                
-        raise Exception(f"Unexpected keyword {self.cur_tok.value} on top level {self.cur_tok}")
-
-
+                continue
+            elif self.cur_tok.type == TokenType.KEYWORD:
+                assert len(Keyword) == 14, "Invalid amount of keywords defined at ExpressionParser.parse_top_level"
+                if self.cur_tok.value == Keyword.CONSTANT:
+                    self.parse_const_def()
+                    continue
+                elif self.cur_tok.value == Keyword.FUNCTION:
+                    return self.parse_function_statement()
+                elif self.cur_tok.value == Keyword.DEFINE:
+                    self.parse_var_def_statement()
+                    # we've added it to the global scope, so we can parse the next statement
+                    continue
+                elif self.cur_tok.value == Keyword.IMPORT:
+                    self.__next_token()
+                    assert isinstance(self.cur_tok.value, str), "Expected string value for import"
+                    self.module_statements.extend(self.__import_file(self.cur_tok.value))
+                    self.__next_token()
+                    continue
+
+            raise Exception(f"Unexpected keyword {self.cur_tok.value} on top level {self.cur_tok}")
+        return None
 
     def parse_primary(self) -> Optional[Statement]:
         assert len(TokenType) == 12, "Too many TokenTypes defined at ExpressionParser.parse_primary"
 
         ret_expr: Optional[Union[Expression, Statement]] = None
+        while self.cur_tok is not None and self.cur_tok.type == TokenType.EOE:
+            self.__next_token()
+
         if self.cur_tok is None:
             return None
-        elif self.cur_tok.type == TokenType.EOE:
-            self.__next_token()
-            return self.parse_primary()
         elif self.cur_tok.type == TokenType.KEYWORD:
             ret_expr = self.parse_keyword()
         elif self.cur_tok.type == TokenType.IDENTIFIER:
@@ -210,7 +296,7 @@ class ExpressionParser:
         #    return expr
 
     def parse_intrinsic(self) -> Expression:
-        assert len(Intrinsic) == 11, "Too many Intrinsics defined at ExpressionParser.parse_intrinsic"
+        assert len(Intrinsic) == 16, "Too many Intrinsics defined at ExpressionParser.parse_intrinsic"
         if self.cur_tok.value == Intrinsic.PRINT:
             return self.parse_print_statement()
         elif self.cur_tok.value == Intrinsic.DROP:
@@ -221,6 +307,10 @@ class ExpressionParser:
             return self.parse_loader_expression()
         elif Intrinsic.is_storer(self.cur_tok.value):
             return self.parse_storer_statement()
+        elif Intrinsic.is_bulk_storer(self.cur_tok.value):
+            return self.parse_bulk_storer_statement()
+        elif Intrinsic.is_vector(self.cur_tok.value):
+            return self.parse_vector_expression()
         else:
             raise Exception(f"Unexpected intrinsic {self.cur_tok.value} at {format_location(self.cur_tok.location)}")
         
@@ -291,25 +381,21 @@ class ExpressionParser:
         if self.in_scope:
             raise Exception(f"Function statement at {format_location(self.cur_tok.location)} must be at top level {self.cur_tok}")
         
+        # the parameters are the first variables of the function's scope
+        self.scope = Scope(self.global_scope)
         proto = self.parse_fun_proto_statement()
         self.prototypes[proto.name] = proto
+        self.global_scope.define(Symbol(proto.name, IdentType.FUNCTION, proto.type, 0, proto))
         
         self.in_scope = True
         block = self.__get_block(Keyword.IS, Keyword.DONE)
         self.__next_token() # eat 'done'
         self.in_scope = False 
 
-        scope: Dict[str, VarDefStmt] = {}
-        for var in self.scope_vars.values():
-            scope[var.name] = var
-        for anon_var in self.anonymous_scope_vars:
-            scope[anon_var.name] = anon_var
-
-        fun = FunStmt(proto, block, scope, proto.type)
-
-        self.scope_vars.clear()
-        self.anonymous_scope_vars.clear()
-        return fun
+        frame = self.scope
+        frame.layout_frame()
+        self.scope = self.global_scope
+        return FunStmt(proto, block, frame, proto.type)
 
     # TODO: make it so we don't need to add a eoe token at the end
     def parse_control_statement(self, type: Keyword):
@@ -365,7 +451,7 @@ class ExpressionParser:
             raise Exception(f"Expected identifier after define keyword at {format_location(self.cur_tok.location)}")
 
         ident_name = self.cur_tok.value
-        ident: VarDefStmt = self.__get_ident_def()
+        ident: Optional[Symbol] = self.__get_ident_def()
         self.__next_token() # eat identifier
 
 
@@ -401,35 +487,37 @@ class ExpressionParser:
         if self.in_scope or isparam:
             if ident is not None:
                 assert len(IdentType) == 3, "Too many IdentTypes defined at ExpressionParser.parse_var_def_statement"
-                if ident.var_type == IdentType.FUNCTION:
-                    raise Exception(f"Attempted redefinition of Function {ident.value} at {format_location(self.cur_tok.location)}; already defined at {format_location(ident.token.location)}")
-                elif ident.var_type == IdentType.GLOBAL_VARIABLE:
+                if ident.kind == IdentType.FUNCTION:
+                    raise Exception(f"Attempted redefinition of Function {ident.name} at {format_location(self.cur_tok.location)}; already defined at {format_location(ident.definition.token.location)}")
+                elif ident.kind == IdentType.GLOBAL_VARIABLE:
                     # do not add to the list of global variables, as it is already there
                     # instead, make the global variable inaccessible and return a new parameter variable
                     if isparam:
                         var_def = VarDefStmt(prev_tok, ident_name, IdentType.VARIABLE, ident_var_type, value_size, value)
+                        var_def.symbol = self.scope.define(Symbol(ident_name, IdentType.VARIABLE, ident_var_type, value_size, var_def))
                     else:
                         var_def = VarDefStmt(prev_tok, ident_name, IdentType.GLOBAL_VARIABLE, ident_var_type, value_size, value)
-                elif ident.var_type == IdentType.VARIABLE:
+                        var_def.symbol = ident
+                elif ident.kind == IdentType.VARIABLE:
                     # the variable exists, modify it
                     assert False, "Redefinition of variable in 'define' not allowed"
-                self.scope_vars[ident_name] = var_def
             else:
                 # the variable doesn't exist, define it, then add it to the scope
                 var_def = VarDefStmt(prev_tok, ident_name, IdentType.VARIABLE, ident_var_type, value_size, value)
-                self.scope_vars[ident_name] = var_def
+                var_def.symbol = self.scope.define(Symbol(ident_name, IdentType.VARIABLE, ident_var_type, value_size, var_def))
         else: # global scope
             if ident is not None:
                 assert len(IdentType) == 3, "Too many IdentTypes defined at ExpressionParser.parse_var_def_statement"
-                if ident.var_type == IdentType.FUNCTION:
-                    raise Exception(f"Attempted redefinition of Function {ident.value} at {format_location(self.cur_tok.location)}; already defined at {format_location(ident.token.location)}")
-                elif ident.var_type == IdentType.GLOBAL_VARIABLE:
-                    raise Exception(f"Attempted redefinition of Global variable {ident.value} at {format_location(self.cur_tok.location)}; Already defined at {format_location(ident.token.location)}")
-                elif ident.var_type == IdentType.VARIABLE:
-                    raise Exception(f"Attempted redefinition of Global variable {ident.value} at {format_location(self.cur_tok.location)}; Already defined at {format_location(ident.token.location)}")
+                if ident.kind == IdentType.FUNCTION:
+                    raise Exception(f"Attempted redefinition of Function {ident.name} at {format_location(self.cur_tok.location)}; already defined at {format_location(ident.definition.token.location)}")
+                elif ident.kind == IdentType.GLOBAL_VARIABLE:
+                    raise Exception(f"Attempted redefinition of Global variable {ident.name} at {format_location(self.cur_tok.location)}; Already defined at {format_location(ident.definition.token.location)}")
+                elif ident.kind == IdentType.VARIABLE:
+                    raise Exception(f"Attempted redefinition of Global variable {ident.name} at {format_location(self.cur_tok.location)}; Already defined at {format_location(ident.definition.token.location)}")
             else:
                 # define a new global variable. It is mutable from the global scope
                 var_def = VarDefStmt(prev_tok, ident_name, IdentType.GLOBAL_VARIABLE,ident_var_type, value_size, value)
+                var_def.symbol = self.global_scope.define(Symbol(ident_name, IdentType.GLOBAL_VARIABLE, ident_var_type, value_size, var_def))
                 self.global_vars[ident_name] = var_def
         #self.__next_token() # eat identifier
         #if self.cur_tok.type != TokenType.EOE:
@@ -443,8 +531,8 @@ class ExpressionParser:
         ident = self.__get_ident_def()
         if ident is None:
             raise Exception(f"Invalid Identifier {self.cur_tok.value} at {format_location(self.cur_tok.location)}")
-        if ident.var_type != IdentType.VARIABLE and ident.var_type != IdentType.GLOBAL_VARIABLE:
-            raise Exception(f"Invalid reference to identifier {self.cur_tok.value} of type {ident.ident_kind} at {format_location(self.cur_tok.location)}")
+        if ident.kind != IdentType.VARIABLE and ident.kind != IdentType.GLOBAL_VARIABLE:
+            raise Exception(f"Invalid reference to identifier {self.cur_tok.value} of type {ident.kind} at {format_location(self.cur_tok.location)}")
         self.__next_token() # eat identifier
 
         if self.cur_tok.type != TokenType.KEYWORD and self.cur_tok.value == Keyword.IS:
@@ -454,7 +542,7 @@ class ExpressionParser:
         value = self.parse_statement()
         assert isinstance(value, Expression), f"Expected expression after 'is' at {format_location(self.cur_tok.location)}"
 
-        return VarSetStmt(prev_tok, ident.name, ident.var_type, value)
+        return VarSetStmt(prev_tok, ident.name, ident.kind, value, ident)
 
     def parse_const_def(self):
         assert self.cur_tok is not None, "Unexpected EOF"
@@ -471,11 +559,13 @@ class ExpressionParser:
         assert self.cur_tok.type == TokenType.KEYWORD and self.cur_tok.value == Keyword.IS, f"Expected 'is' after type at {format_location(self.cur_tok.location)}"
         self.__next_token() # eat 'is' keyword
         expr = self.parse_statement()
-        assert isinstance(expr, BinaryExpr) or \
-               isinstance(expr, IntLiteralExpr) or \
-               isinstance(expr, ArrayRefExpr), f"Expected expression after 'is' at {format_location(self.cur_tok.location)}"
-        const_val = self.eval_expression(expr)
-        self.constants[const_name] = Constant(prev_tok, const_name, const_var_type, const_val)
+        assert isinstance(expr, Expression), f"Expected expression after 'is' at {format_location(self.cur_tok.location)}"
+        const_val = self.folder.evaluate(expr)
+        if const_val is None:
+            raise Exception(f"Value of constant {const_name} is not known at compile time at {format_location(prev_tok.location)}")
+        const = Constant(prev_tok, const_name, const_var_type, const_val)
+        self.constants[const_name] = const
+        self.global_scope.define(Symbol(const_name, IdentType.CONSTANT, const_var_type, SIZE_OF_EXPRTYPES[const_var_type], const))
         
         
 
@@ -532,6 +622,20 @@ class ExpressionParser:
 
         return StorerStmt(prev_tok, params[0], params[1])
 
+    # copy(<dst>, <src>, <len>) or fill(<dst>, <value>, <len>)
+    def parse_bulk_storer_statement(self) -> BulkStorerStmt:
+        assert self.cur_tok is not None, "Unexpected EOF"
+        prev_tok = self.cur_tok
+
+        assert isinstance(self.cur_tok.value, Intrinsic), f"Expected bulk storer at {format_location(self.cur_tok.location)}"
+        self.__next_token() # eat the copy or fill keyword
+
+        params = self.__get_call_args()
+        self.__next_token()
+        assert len(params) == 3, f"Expected 3 parameters for {prev_tok.value.name.lower()} at {format_location(prev_tok.location)}"
+
+        return BulkStorerStmt(prev_tok, params[0], params[1], params[2])
+
 
 #endregion
 
@@ -545,7 +649,7 @@ class ExpressionParser:
         self.__next_token()
         assert len(params) == 1, f"Expected 1 parameter for cast at {format_location(prev_tok.location)}"
         if isinstance(params[0], IdentRefExpr):
-            return IdentRefExpr(params[0].token, params[0].value, params[0].ident_kind, prev_tok.value)
+            return IdentRefExpr(params[0].token, params[0].value, params[0].ident_kind, prev_tok.value, params[0].symbol)
         else:
             params[0].type = prev_tok.value
             return params[0]
@@ -581,9 +685,22 @@ class ExpressionParser:
         # we are done
         return LoaderExpr(prev_tok, params[0])
 
+    # match16(<ptr>, <byte>), compare16(<ptr>, <ptr>) or bitscan(<mask>)
+    def parse_vector_expression(self) -> VectorExpr:
+        assert self.cur_tok is not None, "Unexpected EOF"
+        prev_tok = self.cur_tok
+        self.__next_token() # eat the intrinsic keyword
+
+        params = self.__get_call_args()
+        self.__next_token()
+        operand_count = Intrinsic.get_operand_count(prev_tok.value)
+        assert len(params) == operand_count, f"Expected {operand_count} parameters for {prev_tok.value.name.lower()} at {format_location(prev_tok.location)}"
+
+        return VectorExpr(prev_tok, params)
+
 
     def parse_ident(self) -> Statement:
-        next_token = self.tokens[self.index]
+        next_token = self.tokens.peek()
         assert self.cur_tok is not None, "Unexpected EOF"
         ident = self.__get_ident_ref()
         if ident is None:
@@ -626,56 +743,64 @@ class ExpressionParser:
         assert len(params) == 1, f"Expected 1 parameter for allocate at {format_location(prev_token.location)}"
         
         ident_val = self.__resolve_if_constant(params[0])
+        if not isinstance(ident_val, int) or ident_val < 0:
+            raise Exception(f"Expected a non-negative integer size for allocate at {format_location(prev_token.location)}")
         # add it to the scope anonymous variables under a unique name
         array_ref: str = ""
         if self.in_scope:
-            array_ref = f"arr_{len(self.anonymous_scope_vars)}"
-            self.anonymous_scope_vars.append(VarDefStmt(prev_token, array_ref, IdentType.VARIABLE, ExprType.NONE, ident_val))
+            array_ref = f"arr_{len(self.scope.anonymous)}"
+            var_def = VarDefStmt(prev_token, array_ref, IdentType.VARIABLE, ExprType.NONE, ident_val)
+            var_def.symbol = self.scope.define_anonymous(Symbol(array_ref, IdentType.VARIABLE, ExprType.NONE, ident_val, var_def))
+            return ArrayRefExpr(prev_token, array_ref, var_def.symbol)
         else: 
             array_ref = f"glob_arr_{len(self.global_vars)}"
-            self.global_vars[array_ref] = VarDefStmt(prev_token, array_ref, IdentType.GLOBAL_VARIABLE, ExprType.NONE, ident_val)
+            var_def = VarDefStmt(prev_token, array_ref, IdentType.GLOBAL_VARIABLE, ExprType.NONE, ident_val)
+            var_def.symbol = self.global_scope.define(Symbol(array_ref, IdentType.GLOBAL_VARIABLE, ExprType.NONE, ident_val, var_def))
+            self.global_vars[array_ref] = var_def
 
         return ArrayRefExpr(prev_token, array_ref)
 
 
 
+    # operator precedence parsing with an explicit operand and operator stack, so that
+    # arbitrarily long operator chains don't recurse. All operators are left associative
     def parse_binary_expression(self, prec: int, LHS: Expression) -> Expression:
-        if self.cur_tok is None:
-            return LHS
-        while self.cur_tok.type == TokenType.OPERATOR:
+        operands: List[Expression] = [LHS]
+        operators: List[Token] = []
+
+        def reduce():
+            op_tok = operators.pop()
+            RHS = operands.pop()
+            operands[-1] = BinaryExpr(op_tok, operands[-1], RHS)
+
+        while self.cur_tok is not None and self.cur_tok.type == TokenType.OPERATOR:
             tok_prec = self.__get_precedence()
             if tok_prec < prec: # if we're done with the binary expression
-                return LHS
-        
-            # otherwise, parse more binary expressions
+                break
+
+            # everything on the stack that binds at least as tight is complete
+            while len(operators) > 0 and BINOP_PRECEDENCE[operators[-1].text] >= tok_prec:
+                reduce()
+
             op_tok = self.cur_tok
-            prev_tok = self.cur_tok
+            operators.append(op_tok)
             self.__next_token()
 
             RHS = self.parse_primary()
             if RHS is None:
-                #return None
-                raise Exception(f"{format_location(prev_tok.location)}: Expected expression after {prev_tok.text}")
-            
-            next_prec = self.__get_precedence()
-            
-            if tok_prec < next_prec:
-                prev_tok = self.cur_tok
-                assert isinstance(RHS, Expression), "Expected expression after %s" % (prev_tok.text)
-                RHS = self.parse_binary_expression(tok_prec + 1, RHS)
-                if RHS is None:
-                    raise Exception(f"{format_location(prev_tok.location)}: Expected expression after {prev_tok.text}")
-            
-            # merge and continue
-            assert isinstance(RHS, Expression), "Expected expression after %s" % (prev_tok.text)
-            LHS = BinaryExpr(op_tok, LHS, RHS)
-        return LHS
+                raise Exception(f"{format_location(op_tok.location)}: Expected expression after {op_tok.text}")
+            assert isinstance(RHS, Expression), "Expected expression after %s" % (op_tok.text)
+            operands.append(RHS)
+
+        while len(operators) > 0:
+            reduce()
+        return operands[0]
 
     def parse_address_of_expression(self) -> AddressOfExpr:
         assert self.cur_tok is not None, "Unexpected EOF"
         prev_tok = self.cur_tok
 
-        assert self.cur_tok.value == Keyword.ADDRESS_OF, f"Expected address of keyword at {format_location(prev_tok.location)}"
+        assert self.cur_tok.value == Intrinsic.ADDRESS_OF, f"Expected address of keyword at {format_location(prev_tok.location)}"
         self.__next_token()
         params = self.__get_call_args()
         self.__next_token() # eat the ')'
@@ -689,49 +814,14 @@ class ExpressionParser:
         return AddressOfExpr(prev_tok, params[0])
 #endregion
 
-#region const evaluator
-
-    def eval_expression(self, expr: Expression) -> Union[str,int]:
-        if isinstance(expr, IntLiteralExpr):
-            return self.eval_integer_literal_expr(expr)
-        elif isinstance(expr, IdentRefExpr):
-            return self.deref_ident(expr)
-        elif isinstance(expr, ArrayRefExpr):
-            return self.eval_string_literal(expr)
-        elif isinstance(expr, BinaryExpr):
-            return self.eval_binary_expr(expr)
-    
-    def eval_binary_expr(self, expr: BinaryExpr) -> int:
-        LHS = self.eval_expression(expr.value)
-        assert isinstance(LHS, int), "Expected integer literal on LHS of BinaryExpr"
-        RHS = self.eval_expression(expr.right)
-        assert isinstance(RHS, int), "Expected integer literal on RHS of BinaryExpr"
-        return LHS + RHS
-        
-
-    def eval_integer_literal_expr(self, expr: IntLiteralExpr) -> int:
-        return expr.value
-
-    # get the pointer name to the string literal
-    def eval_string_literal(self, literal: ArrayRefExpr) -> str:
-        assert isinstance(literal.value, str), "Expected string literal pointer name to be a string"
-        return literal.value
-
-
-    def deref_ident(self, ident_ref: IdentRefExpr) -> Union[str, int]:
-        ident_ref.print()
-        assert ident_ref.ident_kind == IdentType.CONSTANT, f"Expected constant identifier at {format_location(ident_ref.token.location)}"
-        assert ident_ref.value in self.constants, f"Identifier not defined as constant at {format_location(ident_ref.token.location)}"
-        return self.constants[ident_ref.value].value
-
-#endregion
-
 
     def parse_program(self) -> List[Statement]:
         print("Parsing program")
         AST: List[Statement] = []
         while True:
             expr = self.parse_top_level()
+            AST.extend(self.module_statements)
+            self.module_statements.clear()
             if expr is None:
                 print("Done parsing")
                 return AST
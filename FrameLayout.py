@@ -0,0 +1,118 @@
+from typing import *
+from enum import Enum
+import io
+import re
+
+from JlangObjects import *
+from PeepholeOptimizer import PeepholeOptimizer
+
+class FrameKind(Enum):
+    NONE = 0        # nothing lives on the frame, the saved registers are pushed
+    RED_ZONE = 1    # a leaf function keeps its slots below rsp, rsp is never moved
+    FULL = 2        # rbp points at the frame and rsp is moved below the slots
+
+# decides how much of a stack frame a function needs once its body has been generated, and writes the
+# prologue and epilogue around the body. A body that never mentions rbp needs no frame, a body that neither
+# calls nor pushes can keep its slots in the 128 bytes below rsp the ABI leaves alone. Every return gets
+# its own epilogue and ret instead of jumping to the end of the function. The peephole optimizer rewrites
+# the body first, the pushes and pops it forwards into registers no longer keep a leaf out of the red zone
+class FrameLayout:
+    red_zone_size: int = 128
+    return_jump: str = "jmp .end"
+    optimizer: Optional[PeepholeOptimizer] = None # set when the emitted code is optimized
+
+    # frame_size includes the saved registers, the body is the code after the prologue up to the epilogue
+    def __init__(self, frame_size: int, saved_registers: Dict[str, int], body: str, elide: bool = True):
+        self.frame_size: int = frame_size
+        self.saved_registers: Dict[str, int] = saved_registers
+        # the optimizer sees the body end in a return, after it only the return value and the saved registers are live
+        if FrameLayout.optimizer is not None and body != "":
+            code = FrameLayout.optimizer.optimize(f"{body}.end:\nret\n")
+            body = code[:code.rindex("\n.end:")] + "\n"
+        self.body: str = body
+        self.elide: bool = elide
+
+        instructions = FrameLayout.__instructions(body)
+        self.leaf: bool = all(instr.split()[0] != "call" for instr in instructions)
+        self.uses_frame: bool = any(re.search(r"\brbp\b", instr) is not None for instr in instructions)
+        self.moves_stack: bool = any(FrameLayout.__moves_stack(instr) for instr in instructions)
+
+        if not elide:
+            self.kind: FrameKind = FrameKind.FULL
+        elif not self.uses_frame:
+            self.kind = FrameKind.NONE
+        elif self.leaf and not self.moves_stack and frame_size <= FrameLayout.red_zone_size:
+            self.kind = FrameKind.RED_ZONE
+        else:
+            self.kind = FrameKind.FULL
+
+    def codegen(self, sink: io.StringIO):
+        sink.write(f"; {self.kind.name.lower().replace('_', ' ')} frame\n")
+        self.__prologue(sink)
+        if not self.elide:
+            sink.write(self.body)
+            sink.write(".end:\n")
+            self.__epilogue(sink)
+            return
+
+        # the returns of the body jumped to the end of the function
+        epilogue = io.StringIO()
+        self.__epilogue(epilogue)
+        last = None
+        for line in self.body.splitlines(keepends = True):
+            if line.strip() == FrameLayout.return_jump:
+                sink.write(epilogue.getvalue())
+                last = "ret"
+                continue
+            sink.write(line)
+            instr = line.split(";")[0].strip()
+            if instr != "":
+                last = instr
+        # falling off the end returns too, unless the body already ended with a return
+        if last != "ret":
+            sink.write(epilogue.getvalue())
+
+    def __prologue(self, sink: io.StringIO):
+        if self.kind == FrameKind.NONE:
+            for register in self.saved_registers:
+                sink.write(f"push {register}\n")
+            return
+
+        sink.write("push rbp\n")
+        sink.write("mov rbp, rsp\n")
+        # make space for variables on stack (rbp), the red zone is already there
+        if self.kind == FrameKind.FULL and self.frame_size > 0:
+            sink.write(f"sub rsp, {self.frame_size}\n")
+        # the callee-saved registers that keep local variables
+        for register, offset in self.saved_registers.items():
+            sink.write(f"mov [rbp - {offset}], {register}\n")
+
+    def __epilogue(self, sink: io.StringIO):
+        if self.kind == FrameKind.NONE:
+            for register in reversed(list(self.saved_registers)):
+                sink.write(f"pop {register}\n")
+            sink.write("ret\n")
+            return
+
+        for register, offset in self.saved_registers.items():
+            sink.write(f"mov {register}, [rbp - {offset}]\n")
+        if self.kind == FrameKind.FULL:
+            sink.write("mov rsp, rbp\n")
+        sink.write("pop rbp\n")
+        sink.write("ret\n")
+
+    # the instructions of the code without comments and labels
+    @staticmethod
+    def __instructions(code: str) -> List[str]:
+        instructions = []
+        for line in code.splitlines():
+            instr = line.split(";")[0].strip()
+            if instr != "" and not instr.endswith(":"):
+                instructions.append(instr)
+        return instructions
+
+    # whether the instruction changes rsp, below it the red zone would be overwritten
+    @staticmethod
+    def __moves_stack(instr: str) -> bool:
+        parts = instr.replace(",", " ").split()
+        return parts[0] in ("push", "pop", "call") or (len(parts) > 1 and parts[1] == "rsp")
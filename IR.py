@@ -0,0 +1,190 @@
+from typing import *
+from dataclasses import dataclass, field
+
+from JlangObjects import *
+
+# a three-address code between the AST and the emitted assembly. Every function is a control flow graph
+# of basic blocks, instructions take their operands from virtual registers, variables, immediates and labels
+
+#region Operands
+
+# a temporary, the lowering decides which register or stack slot it lives in
+@dataclass(frozen = True)
+class VReg:
+    number: int
+
+    def __str__(self):
+        return f"%{self.number}"
+
+@dataclass(frozen = True)
+class Imm:
+    value: int
+
+    def __str__(self):
+        return str(self.value)
+
+# the value of a local variable, it lives in a callee-saved register or in its slot on the frame
+class Var:
+    def __init__(self, symbol: Symbol):
+        self.symbol: Symbol = symbol
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Var) and self.symbol is other.symbol
+
+    def __hash__(self) -> int:
+        return id(self.symbol)
+
+    def __str__(self):
+        return f"${self.symbol.name}"
+
+# the value in memory at a label, global variables and constants
+@dataclass(frozen = True)
+class Global:
+    name: str
+
+    def __str__(self):
+        return f"[{self.name}]"
+
+# the address of a label, strings, global variables and functions
+@dataclass(frozen = True)
+class Address:
+    name: str
+
+    def __str__(self):
+        return f"@{self.name}"
+
+Operand = Union[VReg, Imm, Var, Global, Address]
+
+#endregion
+
+#region Instructions
+
+BINARY_OPCODES: Dict[Operator, str] = {
+    Operator.PLUS: "add",
+    Operator.MINUS: "sub",
+    Operator.MULTIPLY: "mul",
+    Operator.DIVIDE: "div",
+    Operator.MODULO: "mod",
+    Operator.EQUAL: "eq",
+    Operator.NOT_EQUAL: "ne",
+    Operator.LESS: "lt",
+    Operator.LESS_EQUAL: "le",
+    Operator.GREATER: "gt",
+    Operator.GREATER_EQUAL: "ge",
+}
+assert len(Operator) == 11, "Too many Operators defined at BINARY_OPCODES"
+
+COMPARISONS: Set[str] = {"eq", "ne", "lt", "le", "gt", "ge"}
+LOAD_OPCODES: Dict[Intrinsic, str] = {
+    Intrinsic.LOAD8: "load8",
+    Intrinsic.LOAD16: "load16",
+    Intrinsic.LOAD32: "load32",
+    Intrinsic.LOAD64: "load64",
+}
+STORE_OPCODES: Dict[Intrinsic, str] = {
+    Intrinsic.STORE8: "store8",
+    Intrinsic.STORE16: "store16",
+    Intrinsic.STORE32: "store32",
+    Intrinsic.STORE64: "store64",
+}
+BULK_STORE_OPCODES: Dict[Intrinsic, str] = {
+    Intrinsic.COPY: "copy",
+    Intrinsic.FILL: "fill",
+}
+VECTOR_OPCODES: Dict[Intrinsic, str] = {
+    Intrinsic.MATCH16: "match16",
+    Intrinsic.COMPARE16: "compare16",
+    Intrinsic.BITSCAN: "bitscan",
+}
+# the size index of AsmInfo.registers and AsmInfo.mem_size_keywords that a load or store works with
+MEMORY_SIZES: Dict[str, int] = {"load8": 0, "load16": 1, "load32": 2, "load64": 3, "store8": 0, "store16": 1, "store32": 2, "store64": 3}
+
+TERMINATORS: Set[str] = {"jmp", "br", "ret"}
+# opcode -> whether it has a destination, how many arguments it takes (None for any number) and how many blocks it jumps to
+OPCODES: Dict[str, Tuple[bool, Optional[int], int]] = {
+    "mov": (True, 1, 0),
+    **{opcode: (True, 2, 0) for opcode in BINARY_OPCODES.values()},
+    **{opcode: (True, 1, 0) for opcode in LOAD_OPCODES.values()},
+    **{opcode: (False, 2, 0) for opcode in STORE_OPCODES.values()},
+    **{opcode: (False, 3, 0) for opcode in BULK_STORE_OPCODES.values()}, # the target, the source or byte and the length
+    **{opcode: (True, Intrinsic.get_operand_count(intrinsic), 0) for intrinsic, opcode in VECTOR_OPCODES.items()},
+    "addr": (True, 1, 0),
+    "call": (True, None, 0),    # the first argument is the function's address, the destination is optional
+    "syscall": (True, None, 0), # the first argument is the call number
+    "print": (False, 1, 0),
+    "jmp": (False, 0, 1),
+    "br": (False, 1, 2),        # jumps to the first block if the argument isn't zero, otherwise to the second one
+    "ret": (False, None, 0),    # takes the return value, if there is one
+}
+
+@dataclass(eq = False)
+class IRInstr:
+    opcode: str
+    dest: Optional[Operand]
+    args: List[Operand]
+    targets: List['IRBlock'] = field(default_factory = list)
+    location: Optional[LocTuple] = None # where the instruction comes from in the source
+
+    def is_terminator(self) -> bool:
+        return self.opcode in TERMINATORS
+
+    # the virtual registers the instruction reads
+    def uses(self) -> List[VReg]:
+        return [arg for arg in self.args if isinstance(arg, VReg)]
+
+    def __str__(self):
+        text = self.opcode
+        if len(self.args) > 0:
+            text += " " + ", ".join(str(arg) for arg in self.args)
+        if len(self.targets) > 0:
+            text += (", " if len(self.args) > 0 else " ") + ", ".join(target.label for target in self.targets)
+        if self.dest is not None:
+            text = f"{self.dest} = {text}"
+        return text
+
+#endregion
+
+#region Functions
+
+@dataclass(eq = False)
+class IRBlock:
+    label: str
+    instrs: List[IRInstr] = field(default_factory = list)
+
+    def terminator(self) -> Optional[IRInstr]:
+        if len(self.instrs) > 0 and self.instrs[-1].is_terminator():
+            return self.instrs[-1]
+        return None
+
+    def successors(self) -> List['IRBlock']:
+        terminator = self.terminator()
+        return [] if terminator is None else terminator.targets
+
+@dataclass(eq = False)
+class IRFunction:
+    name: str
+    params: List[Symbol]
+    frame: Scope
+    blocks: List[IRBlock] = field(default_factory = list) # the first block is the entry
+    vreg_count: int = 0
+
+    def new_vreg(self) -> VReg:
+        self.vreg_count += 1
+        return VReg(self.vreg_count - 1)
+
+    def predecessors(self) -> Dict[int, List[IRBlock]]:
+        predecessors: Dict[int, List[IRBlock]] = {id(block): [] for block in self.blocks}
+        for block in self.blocks:
+            for successor in block.successors():
+                predecessors[id(successor)].append(block)
+        return predecessors
+
+    def dump(self):
+        print(f"function {self.name}({', '.join('$' + param.name for param in self.params)}):")
+        for block in self.blocks:
+            print(f"{block.label}:")
+            for instr in block.instrs:
+                print(f"    {instr}")
+        print()
+
+#endregion
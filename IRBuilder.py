@@ -0,0 +1,213 @@
+from typing import *
+
+from JlangObjects import *
+from Statements import *
+from IR import *
+
+# lowers the functions of the AST into three-address code. Expression trees become chains of instructions
+# on virtual registers, if and while statements become branches between basic blocks
+class IRBuilder:
+    def __init__(self):
+        self.function: Optional[IRFunction] = None
+        self.block: Optional[IRBlock] = None
+        self.address_taken: Set[int] = set() # the variables that can change behind the function's back
+
+    def build_program(self, statements: List[Statement]) -> List[IRFunction]:
+        return [self.build_function(stmt) for stmt in statements if isinstance(stmt, FunStmt)]
+
+    def build_function(self, fun: FunStmt) -> IRFunction:
+        self.function = IRFunction(fun.proto.name, [param.symbol for param in fun.proto.args.values()], fun.frame)
+        self.block = self.__new_block()
+        self.address_taken = IRBuilder.__address_taken(fun)
+
+        self.__statements(fun.block)
+        if self.block.terminator() is None:
+            self.__emit("ret", [], has_dest = False)
+
+        IRBuilder.__remove_unreachable(self.function)
+        return self.function
+
+    # the variables whose address is taken, their values have to be read where the source reads them
+    @staticmethod
+    def __address_taken(fun: FunStmt) -> Set[int]:
+        address_taken: Set[int] = set()
+        pending: List[Any] = list(fun.block)
+        while len(pending) > 0:
+            node = pending.pop()
+            if isinstance(node, AddressOfExpr) and node.value.symbol is not None:
+                address_taken.add(id(node.value.symbol))
+            for value in vars(node).values():
+                if isinstance(value, Statement):
+                    pending.append(value)
+                elif isinstance(value, list):
+                    pending.extend(item for item in value if isinstance(item, Statement))
+        return address_taken
+
+    # the code after a return can't be reached, neither can blocks that are only jumped to from there
+    @staticmethod
+    def __remove_unreachable(function: IRFunction):
+        reachable: Set[int] = set()
+        pending: List[IRBlock] = [function.blocks[0]]
+        while len(pending) > 0:
+            block = pending.pop()
+            if id(block) in reachable:
+                continue
+            reachable.add(id(block))
+            pending.extend(block.successors())
+        function.blocks = [block for block in function.blocks if id(block) in reachable]
+        for index, block in enumerate(function.blocks):
+            block.label = f"L{index}"
+
+    def __new_block(self) -> IRBlock:
+        block = IRBlock(f"L{len(self.function.blocks)}")
+        self.function.blocks.append(block)
+        return block
+
+    # append an instruction to the current block, a terminator closes the block and the code after it starts a new one
+    def __emit(self, opcode: str, args: List[Operand], location: Optional[LocTuple] = None, has_dest: bool = True,
+               targets: List[IRBlock] = [], dest: Optional[Operand] = None) -> Optional[Operand]:
+        if self.block.terminator() is not None:
+            self.block = self.__new_block()
+        if dest is None and has_dest:
+            dest = self.function.new_vreg()
+        self.block.instrs.append(IRInstr(opcode, dest, args, list(targets), location))
+        return dest
+
+    #region Statements
+
+    def __statements(self, statements: List[Statement]):
+        for stmt in statements:
+            self.__statement(stmt)
+
+    def __statement(self, stmt: Statement):
+        location = stmt.token.location
+        if isinstance(stmt, VarDefStmt) or isinstance(stmt, VarSetStmt):
+            if stmt.value is None:
+                return
+            value = self.__expression(stmt.value)
+            if stmt.var_type == IdentType.GLOBAL_VARIABLE:
+                target = Global(stmt.name if isinstance(stmt, VarDefStmt) else stmt.target)
+            elif stmt.var_type == IdentType.VARIABLE:
+                target = Var(stmt.symbol)
+            else:
+                raise ValueError(f"Unexpected identifier type found: {stmt.var_type}")
+            self.__emit("mov", [value], location, dest = target)
+        elif isinstance(stmt, StorerStmt):
+            address = self.__expression(stmt.target)
+            value = self.__expression(stmt.value)
+            self.__emit(STORE_OPCODES[stmt.token.value], [address, value], location, has_dest = False)
+        elif isinstance(stmt, BulkStorerStmt):
+            args = [self.__expression(stmt.target), self.__expression(stmt.value), self.__expression(stmt.length)]
+            self.__emit(BULK_STORE_OPCODES[stmt.token.value], args, location, has_dest = False)
+        elif isinstance(stmt, DropStmt):
+            self.__expression(stmt.expr)
+        elif isinstance(stmt, PrintStmt):
+            self.__emit("print", [self.__expression(stmt.expr)], location, has_dest = False)
+        elif isinstance(stmt, ReturnStmt):
+            args = [] if stmt.value is None else [self.__expression(stmt.value)]
+            self.__emit("ret", args, location, has_dest = False)
+        elif isinstance(stmt, IfStmt):
+            condition = self.__expression(stmt.condition)
+            then_block = IRBlock("")
+            end_block = IRBlock("")
+            self.__emit("br", [condition], location, has_dest = False, targets = [then_block, end_block])
+            self.__start_block(then_block)
+            self.__statements(stmt.block)
+            self.__emit("jmp", [], location, has_dest = False, targets = [end_block])
+            self.__start_block(end_block)
+        elif isinstance(stmt, WhileStmt):
+            condition_block = IRBlock("")
+            body_block = IRBlock("")
+            end_block = IRBlock("")
+            self.__emit("jmp", [], location, has_dest = False, targets = [condition_block])
+            self.__start_block(condition_block)
+            condition = self.__expression(stmt.condition)
+            self.__emit("br", [condition], location, has_dest = False, targets = [body_block, end_block])
+            self.__start_block(body_block)
+            self.__statements(stmt.block)
+            self.__emit("jmp", [], location, has_dest = False, targets = [condition_block])
+            self.__start_block(end_block)
+        elif isinstance(stmt, Expression): # a call whose value is not used
+            self.__expression(stmt)
+        else:
+            raise NotImplementedError(f"IR generation has not been implemented for {type(stmt).__name__}")
+
+    # blocks are created before the jumps to them, they are labeled in the order they are placed
+    def __start_block(self, block: IRBlock):
+        if self.block.terminator() is None:
+            self.__emit("jmp", [], has_dest = False, targets = [block])
+        block.label = f"L{len(self.function.blocks)}"
+        self.function.blocks.append(block)
+        self.block = block
+
+    #endregion
+
+    #region Expressions
+
+    # binary expressions are lowered in post-order with an explicit stack, so long operator chains don't recurse
+    def __expression(self, expr: Expression) -> Operand:
+        values: Dict[int, Operand] = {}
+        stack: List[Tuple[Expression, bool]] = [(expr, False)]
+        while len(stack) > 0:
+            cur_expr, operands_done = stack.pop()
+            if not isinstance(cur_expr, BinaryExpr):
+                values[id(cur_expr)] = self.__operand(cur_expr)
+            elif operands_done:
+                if cur_expr.token.value not in BINARY_OPCODES:
+                    raise ValueError(f"Unknown binary operator {cur_expr.token.value} at {format_location(cur_expr.token.location)}")
+                LHS = values.pop(id(cur_expr.value))
+                RHS = values.pop(id(cur_expr.right))
+                values[id(cur_expr)] = self.__emit(BINARY_OPCODES[cur_expr.token.value], [LHS, RHS], cur_expr.token.location)
+            else:
+                stack.append((cur_expr, True))
+                stack.append((cur_expr.right, False))
+                stack.append((cur_expr.value, False))
+        return values[id(expr)]
+
+    # the operand of an expression that is not a binary expression
+    def __operand(self, expr: Expression) -> Operand:
+        location = expr.token.location
+        if isinstance(expr, IntLiteralExpr):
+            return Imm(expr.value)
+        elif isinstance(expr, ConstantExpr):
+            return Imm(expr.value) if isinstance(expr.value, int) else Address(expr.value)
+        elif isinstance(expr, ArrayRefExpr):
+            if expr.symbol is not None: # a local anonymous variable
+                return self.__emit("addr", [Var(expr.symbol)], location)
+            return Address(expr.value)
+        elif isinstance(expr, IdentRefExpr):
+            if expr.ident_kind == IdentType.VARIABLE:
+                if id(expr.symbol) in self.address_taken: # a call in the rest of the expression may change it
+                    return self.__emit("mov", [Var(expr.symbol)], location)
+                return Var(expr.symbol)
+            elif expr.ident_kind == IdentType.GLOBAL_VARIABLE:
+                return self.__emit("mov", [Global(expr.value)], location)
+            elif expr.ident_kind == IdentType.CONSTANT:
+                raise ValueError(f"Constant {expr.value} at {format_location(expr.token.location)} was not folded into its value")
+            raise ValueError(f"Invalid Identifier found for {expr.value}")
+        elif isinstance(expr, AddressOfExpr):
+            if expr.value.ident_kind == IdentType.VARIABLE:
+                return self.__emit("addr", [Var(expr.value.symbol)], location)
+            elif expr.value.ident_kind == IdentType.GLOBAL_VARIABLE or expr.value.ident_kind == IdentType.CONSTANT:
+                return Address(expr.value.value)
+            raise ValueError(f"Invalid Identifier found for {expr.value.value}")
+        elif isinstance(expr, LoaderExpr):
+            address = self.__expression(expr.value)
+            return self.__emit(LOAD_OPCODES[expr.token.value], [address], location)
+        elif isinstance(expr, VectorExpr):
+            operands = [self.__expression(operand) for operand in expr.value]
+            return self.__emit(VECTOR_OPCODES[expr.token.value], operands, location)
+        elif isinstance(expr, FunCallExpr):
+            # arguments are evaluated last to first, like they are pushed
+            args = [self.__expression(arg) for arg in reversed(expr.value)][::-1]
+            if expr.type == ExprType.NONE:
+                self.__emit("call", [Address(expr.target.value)] + args, location, has_dest = False)
+                return Imm(0)
+            return self.__emit("call", [Address(expr.target.value)] + args, location)
+        elif isinstance(expr, SyscallExpr):
+            args = [self.__expression(arg) for arg in expr.value]
+            number = self.__expression(expr.callnum)
+            return self.__emit("syscall", [number] + args, location)
+        raise NotImplementedError(f"IR generation has not been implemented for {type(expr).__name__}")
+
+    #endregion
@@ -0,0 +1,389 @@
+from typing import *
+import io
+
+from JlangObjects import *
+from IR import *
+from ArithmeticLowering import ArithmeticLowering
+from FrameLayout import FrameLayout
+from Statements import CodegenOptions, BulkStorerStmt, VectorExpr
+
+CONDITION_CODES: Dict[str, str] = {"eq": "e", "ne": "ne", "lt": "l", "le": "le", "gt": "g", "ge": "ge"}
+INVERSE_CONDITION_CODES: Dict[str, str] = {"eq": "ne", "ne": "e", "lt": "ge", "le": "g", "gt": "le", "ge": "l"}
+ARITHMETIC: Dict[str, str] = {"add": "add", "sub": "sub", "mul": "imul"}
+COMMUTATIVE: Set[str] = {"add", "mul"}
+# the operators whose constant right operands get cheaper sequences
+STRENGTH_REDUCED: Dict[str, Operator] = {"mul": Operator.MULTIPLY, "div": Operator.DIVIDE, "mod": Operator.MODULO}
+
+# emits the assembly of a function from its IR. Virtual registers get a scratch register for as long as they
+# are live, the ones that don't fit are spilled to slots below the frame's variables. Single instructions
+# work with rax, rdx and r11, so those never hold a virtual register
+class IRLowering:
+    registers: List[str] = [reg for reg in AsmInfo.scratch_registers if reg != "r11"]
+    scratch: str = "r11"
+
+    def __init__(self, function: IRFunction):
+        self.function: IRFunction = function
+        self.locations: Dict[VReg, str] = {}
+        self.intervals: Dict[VReg, Tuple[int, int]] = {} # the first and last position a virtual register is live at
+        self.spill_slots: int = 0
+        self.fused: Dict[VReg, str] = {} # comparisons that only decide the branch after them, by their opcode
+        self.sink: io.StringIO = io.StringIO()
+
+    def lower(self, sink: io.StringIO):
+        # the body is lowered first, it decides how much of a frame the function needs
+        self.sink = io.StringIO()
+        self.__allocate()
+        self.__find_fused_branches()
+        frame = self.function.frame
+        frame_size = frame.frame_size + 8 * self.spill_slots
+
+        sink.write(f"; Function Definition {self.function.name}\n")
+        sink.write(f"{self.function.name}:\n")
+        # the first arguments are in registers, the rest are above the saved rbp and the return address
+        registers = CodegenOptions.argument_registers(len(self.function.params))
+        for index, param in enumerate(self.function.params):
+            if index < len(registers):
+                self.__move(self.__location(Var(param)), registers[index])
+            else:
+                self.__move(self.__location(Var(param)), f"QWORD [rbp + {16 + 8 * (index - len(registers))}]")
+
+        position = 0
+        blocks = self.function.blocks
+        for block_index, block in enumerate(blocks):
+            next_block = blocks[block_index + 1] if block_index + 1 < len(blocks) else None
+            self.sink.write(f".{block.label}:\n")
+            for instr in block.instrs:
+                location = f"{format_location(instr.location)} " if instr.location is not None else ""
+                self.sink.write(f"; {location}{instr}\n")
+                self.__instr(instr, position, next_block)
+                position += 1
+
+        FrameLayout(frame_size, frame.saved_registers, self.sink.getvalue(), CodegenOptions.elide_frames).codegen(sink)
+        sink.write(f"; End of Function {self.function.name}\n\n")
+
+    #region Register Allocation
+
+    # the virtual registers that are live at the start and end of every block
+    def __liveness(self) -> Tuple[Dict[int, Set[VReg]], Dict[int, Set[VReg]]]:
+        uses: Dict[int, Set[VReg]] = {}
+        defs: Dict[int, Set[VReg]] = {}
+        for block in self.function.blocks:
+            uses[id(block)] = set()
+            defs[id(block)] = set()
+            for instr in block.instrs:
+                uses[id(block)].update(vreg for vreg in instr.uses() if vreg not in defs[id(block)])
+                if isinstance(instr.dest, VReg):
+                    defs[id(block)].add(instr.dest)
+
+        live_in: Dict[int, Set[VReg]] = {id(block): set() for block in self.function.blocks}
+        live_out: Dict[int, Set[VReg]] = {id(block): set() for block in self.function.blocks}
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(self.function.blocks):
+                out = set().union(*[live_in[id(successor)] for successor in block.successors()])
+                new_in = uses[id(block)] | (out - defs[id(block)])
+                if out != live_out[id(block)] or new_in != live_in[id(block)]:
+                    live_out[id(block)] = out
+                    live_in[id(block)] = new_in
+                    changed = True
+        return live_in, live_out
+
+    # linear scan over the live intervals, when the registers run out the interval that ends last is spilled
+    def __allocate(self):
+        live_in, live_out = self.__liveness()
+        position = 0
+        for block in self.function.blocks:
+            start = position
+            for instr in block.instrs:
+                for vreg in instr.uses() + ([instr.dest] if isinstance(instr.dest, VReg) else []):
+                    first, last = self.intervals.get(vreg, (position, position))
+                    self.intervals[vreg] = (min(first, position), max(last, position))
+                position += 1
+            for vreg in live_in[id(block)]:
+                first, last = self.intervals[vreg]
+                self.intervals[vreg] = (min(first, start), last)
+            for vreg in live_out[id(block)]:
+                first, last = self.intervals[vreg]
+                self.intervals[vreg] = (first, max(last, position - 1))
+
+        active: List[VReg] = []
+        free: List[str] = list(IRLowering.registers)
+        for vreg in sorted(self.intervals, key = lambda vreg: self.intervals[vreg][0]):
+            start, end = self.intervals[vreg]
+            # an interval that ends where this one starts is read by the instruction that defines this one,
+            # the instruction may reuse its register
+            for other in [other for other in active if self.intervals[other][1] <= start]:
+                active.remove(other)
+                free.append(self.locations[other])
+            if len(free) > 0:
+                self.locations[vreg] = free.pop(0)
+                active.append(vreg)
+                continue
+            victim = max(active, key = lambda other: self.intervals[other][1])
+            if self.intervals[victim][1] > end:
+                self.locations[vreg] = self.locations[victim]
+                active.remove(victim)
+                active.append(vreg)
+                victim_spilled = victim
+            else:
+                victim_spilled = vreg
+            self.spill_slots += 1
+            self.locations[victim_spilled] = f"QWORD [rbp - {self.function.frame.frame_size + 8 * self.spill_slots}]"
+
+    # the registers that hold values which are still needed after the instruction at the position
+    def __live_across(self, position: int) -> List[str]:
+        return [self.locations[vreg] for vreg, (start, end) in self.intervals.items() \
+                if start < position < end and IRLowering.__is_register(self.locations[vreg])]
+
+    #endregion
+
+    # a comparison right before the branch that is its only use sets the flags the branch jumps on
+    def __find_fused_branches(self):
+        use_counts: Dict[VReg, int] = {}
+        for block in self.function.blocks:
+            for instr in block.instrs:
+                for vreg in instr.uses():
+                    use_counts[vreg] = use_counts.get(vreg, 0) + 1
+        for block in self.function.blocks:
+            if len(block.instrs) < 2:
+                continue
+            comparison, branch = block.instrs[-2], block.instrs[-1]
+            if comparison.opcode in CONDITION_CODES and branch.opcode == "br" and branch.args[0] == comparison.dest \
+               and use_counts[comparison.dest] == 1:
+                self.fused[comparison.dest] = comparison.opcode
+
+    #region Operands
+
+    @staticmethod
+    def __is_register(location: str) -> bool:
+        return location in AsmInfo.registers
+
+    @staticmethod
+    def __is_memory(location: str) -> bool:
+        return location.startswith("QWORD [")
+
+    @staticmethod
+    def __is_imm32(location: str) -> bool:
+        try:
+            return -2**31 <= int(location) < 2**31
+        except ValueError:
+            return False
+
+    def __location(self, operand: Operand) -> str:
+        if isinstance(operand, VReg):
+            return self.locations[operand]
+        elif isinstance(operand, Imm):
+            return str(operand.value)
+        elif isinstance(operand, Var):
+            if operand.symbol.register is not None:
+                return operand.symbol.register
+            return f"QWORD [rbp - {operand.symbol.offset}]"
+        elif isinstance(operand, Global):
+            return f"QWORD [{operand.name}]"
+        elif isinstance(operand, Address):
+            return operand.name
+        raise ValueError(f"Unknown operand {operand}")
+
+    # a location that can be the source of an arithmetic instruction, wide immediates and labels go through reg
+    def __source(self, operand: Operand, reg: str) -> str:
+        location = self.__location(operand)
+        if IRLowering.__is_register(location) or IRLowering.__is_memory(location) or IRLowering.__is_imm32(location):
+            return location
+        self.sink.write(f"mov {reg}, {location}\n")
+        return reg
+
+    # a register that holds the value, reg is loaded with it unless it already is in one
+    def __register(self, operand: Operand, reg: str) -> str:
+        location = self.__location(operand)
+        if IRLowering.__is_register(location):
+            return location
+        self.sink.write(f"mov {reg}, {location}\n")
+        return reg
+
+    def __move(self, target: str, source: str):
+        if target == source:
+            return
+        if IRLowering.__is_memory(target) and not (IRLowering.__is_register(source) or IRLowering.__is_imm32(source)):
+            self.sink.write(f"mov {IRLowering.scratch}, {source}\n")
+            source = IRLowering.scratch
+        self.sink.write(f"mov {target}, {source}\n")
+
+    # moves whose sources may be the targets of the others, a move is done once no other move reads its target.
+    # Registers that read each other in a cycle are broken up by parking one of the values in the scratch register
+    def __parallel_move(self, moves: List[Tuple[str, str]]):
+        pending = [(target, source) for target, source in moves if target != source]
+        while len(pending) > 0:
+            for index, (target, source) in enumerate(pending):
+                if all(other_source != target for other_index, (_, other_source) in enumerate(pending) if other_index != index):
+                    self.__move(target, source)
+                    pending.pop(index)
+                    break
+            else:
+                target, source = pending[0]
+                self.__move(IRLowering.scratch, source)
+                pending[0] = (target, IRLowering.scratch)
+
+    def __push(self, operand: Operand):
+        self.sink.write(f"push {self.__source(operand, 'rax')}\n")
+
+    #endregion
+
+    def __instr(self, instr: IRInstr, position: int, next_block: Optional[IRBlock]):
+        sink = self.sink
+        dest = self.__location(instr.dest) if instr.dest is not None else None
+        if instr.opcode == "mov":
+            self.__move(dest, self.__location(instr.args[0]))
+        elif CodegenOptions.strength_reduction and instr.opcode in STRENGTH_REDUCED and isinstance(instr.args[1], Imm) \
+                and ArithmeticLowering.lowers(STRENGTH_REDUCED[instr.opcode], instr.args[1].value):
+            # rax and rdx never hold a virtual register, the sequences are free to use them
+            target = dest if IRLowering.__is_register(dest) else IRLowering.scratch
+            self.__move(target, self.__location(instr.args[0]))
+            ArithmeticLowering.codegen(sink, STRENGTH_REDUCED[instr.opcode], target, instr.args[1].value)
+            self.__move(dest, target)
+        elif instr.opcode in ARITHMETIC:
+            LHS, RHS = instr.args
+            opcode = ARITHMETIC[instr.opcode]
+            if IRLowering.__is_register(dest) and dest != self.__location(RHS):
+                self.__move(dest, self.__location(LHS))
+                sink.write(f"{opcode} {dest}, {self.__source(RHS, IRLowering.scratch)}\n")
+            elif IRLowering.__is_register(dest) and instr.opcode in COMMUTATIVE:
+                sink.write(f"{opcode} {dest}, {self.__source(LHS, IRLowering.scratch)}\n")
+            else:
+                self.__move("rax", self.__location(LHS))
+                sink.write(f"{opcode} rax, {self.__source(RHS, IRLowering.scratch)}\n")
+                self.__move(dest, "rax")
+        elif instr.opcode == "div" or instr.opcode == "mod":
+            LHS, RHS = instr.args
+            self.__move("rax", self.__location(LHS))
+            sink.write("cqo\n")
+            divisor = self.__location(RHS)
+            if not (IRLowering.__is_register(divisor) or IRLowering.__is_memory(divisor)):
+                divisor = self.__register(RHS, IRLowering.scratch)
+            sink.write(f"idiv {divisor}\n")
+            self.__move(dest, "rax" if instr.opcode == "div" else "rdx")
+        elif instr.opcode in CONDITION_CODES:
+            LHS, RHS = instr.args
+            left = self.__location(LHS)
+            if not (IRLowering.__is_register(left) or IRLowering.__is_memory(left)):
+                left = self.__register(LHS, "rax")
+            right = self.__source(RHS, IRLowering.scratch)
+            if IRLowering.__is_memory(left) and IRLowering.__is_memory(right):
+                right = self.__register(RHS, IRLowering.scratch)
+            sink.write(f"cmp {left}, {right}\n")
+            if instr.dest in self.fused: # the branch jumps on the flags
+                return
+            sink.write(f"set{CONDITION_CODES[instr.opcode]} al\n")
+            if IRLowering.__is_register(dest):
+                sink.write(f"movzx {dest}, al\n")
+            else:
+                sink.write("movzx rax, al\n")
+                self.__move(dest, "rax")
+        elif instr.opcode in ("load8", "load16", "load32", "load64"):
+            address = self.__register(instr.args[0], IRLowering.scratch)
+            target = dest if IRLowering.__is_register(dest) else "rax"
+            size_index = MEMORY_SIZES[instr.opcode]
+            if size_index == 3:
+                sink.write(f"mov {target}, QWORD [{address}]\n")
+            elif size_index == 2: # writing the 32 bit register clears the upper half
+                sink.write(f"mov {AsmInfo.registers[target][2]}, DWORD [{address}]\n")
+            else:
+                sink.write(f"movzx {target}, {AsmInfo.mem_size_keywords[size_index]} [{address}]\n")
+            self.__move(dest, target)
+        elif instr.opcode in ("store8", "store16", "store32", "store64"):
+            address = self.__register(instr.args[0], IRLowering.scratch)
+            value = self.__register(instr.args[1], "rax")
+            size_index = MEMORY_SIZES[instr.opcode]
+            sink.write(f"mov {AsmInfo.mem_size_keywords[size_index]} [{address}], {AsmInfo.registers[value][size_index]}\n")
+        elif instr.opcode in ("copy", "fill"):
+            intrinsic = Intrinsic.COPY if instr.opcode == "copy" else Intrinsic.FILL
+            registers = BulkStorerStmt.operand_registers(intrinsic)
+            # rep changes the registers of its operands, the values that live on in them are kept on the stack
+            saved = [reg for reg in self.__live_across(position) if reg in registers]
+            for reg in saved:
+                sink.write(f"push {reg}\n")
+            self.__parallel_move([(reg, self.__location(arg)) for reg, arg in zip(registers, instr.args)])
+            BulkStorerStmt.codegen_rep(sink, intrinsic)
+            for reg in reversed(saved):
+                sink.write(f"pop {reg}\n")
+        elif instr.opcode in ("match16", "compare16", "bitscan"):
+            intrinsic = {opcode: intrinsic for intrinsic, opcode in VECTOR_OPCODES.items()}[instr.opcode]
+            # the operand registers and rcx are changed, rax and rdx never hold a virtual register
+            saved = [reg for reg in self.__live_across(position) if reg in VectorExpr.operand_registers + ["rcx"]]
+            for reg in saved:
+                sink.write(f"push {reg}\n")
+            self.__parallel_move([(reg, self.__location(arg)) for reg, arg in zip(VectorExpr.operand_registers, instr.args)])
+            VectorExpr.codegen_vector(sink, intrinsic)
+            for reg in reversed(saved):
+                sink.write(f"pop {reg}\n")
+            self.__move(dest, "rax")
+        elif instr.opcode == "addr":
+            target = dest if IRLowering.__is_register(dest) else "rax"
+            sink.write(f"lea {target}, [rbp - {instr.args[0].symbol.offset}]\n")
+            self.__move(dest, target)
+        elif instr.opcode in ("call", "syscall", "print"):
+            # the called code may change any scratch register
+            saved = self.__live_across(position)
+            for reg in saved:
+                sink.write(f"push {reg}\n")
+            if instr.opcode == "call":
+                args = instr.args[1:]
+                registers = CodegenOptions.argument_registers(len(args))
+                stack_args = args[len(registers):]
+                for arg in reversed(stack_args):
+                    self.__push(arg)
+                self.__parallel_move([(reg, self.__location(arg)) for reg, arg in zip(registers, args)])
+                sink.write(f"call {instr.args[0].name}\n")
+                if len(stack_args) > 0:
+                    sink.write(f"add rsp, {8 * len(stack_args)}\n")
+            elif instr.opcode == "syscall":
+                # the arguments may be in each other's registers, they go through the stack
+                args = instr.args[1:]
+                for arg in args:
+                    self.__push(arg)
+                self.__push(instr.args[0])
+                sink.write("pop rax\n")
+                for index in reversed(range(len(args))):
+                    sink.write(f"pop {AsmInfo.get_abi_reg_name(index)}\n")
+                sink.write("syscall\n")
+            else:
+                self.__move("rdi", self.__location(instr.args[0]))
+                sink.write("call print\n")
+            for reg in reversed(saved):
+                sink.write(f"pop {reg}\n")
+            if dest is not None:
+                self.__move(dest, "rax")
+        elif instr.opcode == "jmp":
+            if instr.targets[0] is not next_block:
+                sink.write(f"jmp .{instr.targets[0].label}\n")
+        elif instr.opcode == "br":
+            then_block, else_block = instr.targets
+            condition = instr.args[0]
+            if isinstance(condition, Imm):
+                target = then_block if condition.value != 0 else else_block
+                if target is not next_block:
+                    sink.write(f"jmp .{target.label}\n")
+                return
+            if condition in self.fused:
+                condition_code = CONDITION_CODES[self.fused[condition]]
+                inverse_code = INVERSE_CONDITION_CODES[self.fused[condition]]
+            else:
+                location = self.__location(condition)
+                if not (IRLowering.__is_register(location) or IRLowering.__is_memory(location)):
+                    location = self.__register(condition, "rax")
+                sink.write(f"cmp {location}, 0\n")
+                condition_code, inverse_code = "ne", "e"
+            if then_block is next_block:
+                sink.write(f"j{inverse_code} .{else_block.label}\n")
+            elif else_block is next_block:
+                sink.write(f"j{condition_code} .{then_block.label}\n")
+            else:
+                sink.write(f"j{condition_code} .{then_block.label}\n")
+                sink.write(f"jmp .{else_block.label}\n")
+        elif instr.opcode == "ret":
+            if len(instr.args) > 0:
+                self.__move("rax", self.__location(instr.args[0]))
+            if next_block is not None:
+                sink.write("jmp .end\n")
+        else:
+            raise NotImplementedError(f"Lowering has not been implemented for {instr.opcode}")
@@ -0,0 +1,140 @@
+from typing import *
+
+from JlangObjects import *
+from IR import *
+
+# checks that a function is well formed, so a pass that breaks the IR is caught where it runs
+# and not by the program it miscompiles
+class IRVerifier:
+    def __init__(self, function: IRFunction):
+        self.function: IRFunction = function
+        self.errors: List[str] = []
+
+    def verify(self):
+        self.errors = []
+        if len(self.function.blocks) == 0:
+            self.__error("function has no blocks")
+        else:
+            self.__check_blocks()
+            if len(self.errors) == 0: # the control flow graph has to be sound to follow the registers through it
+                self.__check_vregs()
+        if len(self.errors) > 0:
+            raise Exception(f"Invalid IR in function {self.function.name}:\n    " + "\n    ".join(self.errors))
+
+    def __error(self, message: str, block: Optional[IRBlock] = None, instr: Optional[IRInstr] = None):
+        if instr is not None:
+            message += f" at '{instr}'"
+            if instr.location is not None:
+                message += f" from {format_location(instr.location)}"
+        if block is not None:
+            message = f"{block.label}: {message}"
+        self.errors.append(message)
+
+    def __check_blocks(self):
+        labels: Set[str] = set()
+        blocks: Set[int] = {id(block) for block in self.function.blocks}
+        frame = self.function.frame
+        variables: Set[int] = {id(symbol) for symbol in frame.definitions + frame.anonymous + self.function.params}
+        for block in self.function.blocks:
+            if block.label in labels:
+                self.__error("label is used by more than one block", block)
+            labels.add(block.label)
+            if block.terminator() is None:
+                self.__error("block doesn't end with a terminator", block)
+            for index, instr in enumerate(block.instrs):
+                if instr.is_terminator() and index != len(block.instrs) - 1:
+                    self.__error("terminator in the middle of the block", block, instr)
+                if any(id(target) not in blocks for target in instr.targets):
+                    self.__error("jump to a block outside of the function", block, instr)
+                for operand in instr.args + ([instr.dest] if instr.dest is not None else []):
+                    if isinstance(operand, Var) and id(operand.symbol) not in variables:
+                        self.__error(f"variable {operand} is not on the function's frame", block, instr)
+                self.__check_instr(block, instr)
+
+    # the number and kinds of operands
+    def __check_instr(self, block: IRBlock, instr: IRInstr):
+        if instr.opcode not in OPCODES:
+            self.__error("unknown opcode", block, instr)
+            return
+        has_dest, arg_count, target_count = OPCODES[instr.opcode]
+        if arg_count is not None and len(instr.args) != arg_count:
+            self.__error(f"expected {arg_count} arguments", block, instr)
+        if len(instr.targets) != target_count:
+            self.__error(f"expected {target_count} jump targets", block, instr)
+        if instr.dest is not None and not has_dest:
+            self.__error("instruction doesn't have a destination", block, instr)
+        if instr.dest is None and has_dest and instr.opcode != "call":
+            self.__error("instruction needs a destination", block, instr)
+
+        if instr.opcode == "mov":
+            if not isinstance(instr.dest, (VReg, Var, Global)):
+                self.__error("destination of a move must be a virtual register, variable or global", block, instr)
+        elif instr.dest is not None and not isinstance(instr.dest, VReg):
+            self.__error("destination must be a virtual register", block, instr)
+
+        if instr.opcode == "addr" and not isinstance(instr.args[0], Var):
+            self.__error("only variables have a frame address", block, instr)
+        elif instr.opcode == "call" and (len(instr.args) == 0 or not isinstance(instr.args[0], Address)):
+            self.__error("call needs the address of a function", block, instr)
+        elif instr.opcode == "syscall" and not 1 <= len(instr.args) <= len(Syscall):
+            self.__error(f"syscall takes a call number and up to {len(Syscall) - 1} arguments", block, instr)
+        elif instr.opcode == "ret" and len(instr.args) > 1:
+            self.__error("ret takes at most one value", block, instr)
+
+    # every virtual register is defined once, and its definition comes before all of its uses on every path
+    def __check_vregs(self):
+        definitions: Dict[VReg, Tuple[IRBlock, int]] = {}
+        for block in self.function.blocks:
+            for index, instr in enumerate(block.instrs):
+                if isinstance(instr.dest, VReg):
+                    if instr.dest in definitions:
+                        self.__error(f"{instr.dest} is defined more than once", block, instr)
+                    definitions[instr.dest] = (block, index)
+                    if instr.dest.number >= self.function.vreg_count:
+                        self.__error(f"{instr.dest} was not allocated by the function", block, instr)
+
+        dominators = IRVerifier.dominators(self.function)
+        for block in self.function.blocks:
+            if id(block) not in dominators: # unreachable code can't misuse a register
+                continue
+            for index, instr in enumerate(block.instrs):
+                for vreg in instr.uses():
+                    if vreg not in definitions:
+                        self.__error(f"{vreg} is used but never defined", block, instr)
+                        continue
+                    def_block, def_index = definitions[vreg]
+                    if def_block is block and def_index >= index:
+                        self.__error(f"{vreg} is used before it is defined", block, instr)
+                    elif def_block is not block and id(def_block) not in dominators[id(block)]:
+                        self.__error(f"{vreg} is defined in {def_block.label}, which doesn't dominate the use", block, instr)
+
+    # the blocks that are on every path from the entry to a block, for every reachable block
+    @staticmethod
+    def dominators(function: IRFunction) -> Dict[int, Set[int]]:
+        reachable: List[IRBlock] = []
+        pending: List[IRBlock] = [function.blocks[0]]
+        seen: Set[int] = set()
+        while len(pending) > 0:
+            block = pending.pop()
+            if id(block) in seen:
+                continue
+            seen.add(id(block))
+            reachable.append(block)
+            pending.extend(block.successors())
+
+        predecessors = function.predecessors()
+        entry = function.blocks[0]
+        dominators: Dict[int, Set[int]] = {id(block): set(seen) for block in reachable}
+        dominators[id(entry)] = {id(entry)}
+        changed = True
+        while changed:
+            changed = False
+            for block in reachable:
+                if block is entry:
+                    continue
+                incoming = [dominators[id(pred)] for pred in predecessors[id(block)] if id(pred) in seen]
+                new = set.intersection(*incoming) | {id(block)} if len(incoming) > 0 else {id(block)}
+                if new != dominators[id(block)]:
+                    dominators[id(block)] = new
+                    changed = True
+        return dominators
@@ -0,0 +1,352 @@
+from typing import *
+import copy
+
+from JlangObjects import *
+from Statements import *
+
+# replaces calls of small functions with the body of the function they call. A function whose body is a single
+# return is inlined wherever it is called, its parameters are replaced by the arguments. Other functions are
+# inlined where the call is a statement of its own: the parameters and locals become variables of the caller's
+# frame, under new names. Recursive functions are never inlined
+class Inliner:
+    def __init__(self, threshold: int):
+        self.threshold: int = threshold # the most nodes the body of an inlined function may have
+        self.inlined: List[Tuple[str, str, LocTuple]] = [] # callee, caller and location of every inlined call
+        self.renamed: int = 0 # number of variables moved into a caller's frame, keeps their names unique
+        self.functions: Dict[str, FunStmt] = {}
+        self.recursive: Set[str] = set()
+
+    def inline_program(self, statements: List[Statement]):
+        self.functions = {stmt.proto.name: stmt for stmt in statements if isinstance(stmt, FunStmt)}
+        calls = {name: Inliner.__callees(fun) for name, fun in self.functions.items()}
+        components = Inliner.__components(calls)
+        for component in components:
+            if len(component) > 1 or component[0] in calls[component[0]]:
+                self.recursive.update(component)
+        # callees come before their callers, a function is inlined with the calls in its body inlined already
+        for component in components:
+            for name in component:
+                self.inline_function(self.functions[name])
+
+    def inline_function(self, fun: FunStmt):
+        inlined_before = len(self.inlined)
+        pending: List[List[Statement]] = [fun.block]
+        while len(pending) > 0:
+            block = pending.pop()
+            index = 0
+            while index < len(block):
+                stmt = block[index]
+                self.__inline_expressions(stmt, fun)
+                replacement = self.__inline_statement(stmt, fun)
+                if replacement is not None: # the inlined body is looked at again, for the calls it contains
+                    block[index:index + 1] = replacement
+                    continue
+                if isinstance(stmt, ControlStmt):
+                    pending.append(stmt.block)
+                index += 1
+        if len(self.inlined) > inlined_before and not CodegenOptions.promote_locals:
+            fun.frame.layout_frame() # promoting the locals lays out the frame otherwise
+
+    def print_report(self):
+        print(f"Inliner: {len(self.inlined)} calls inlined")
+        for callee, caller, location in self.inlined:
+            print(f"    {callee} into {caller} at {format_location(location)}")
+
+    #region Call Graph
+
+    # the functions called by fun, in the order they are called
+    @staticmethod
+    def __callees(fun: FunStmt) -> List[str]:
+        callees: List[str] = []
+        pending: List[Any] = list(reversed(fun.block))
+        while len(pending) > 0:
+            node = pending.pop()
+            if isinstance(node, FunCallExpr) and node.target.value not in callees:
+                callees.append(node.target.value)
+            pending.extend(reversed(Inliner.__children(node)))
+        return callees
+
+    # the strongly connected components of the call graph with Tarjan's algorithm, callees before their callers.
+    # The functions of a component call each other
+    @staticmethod
+    def __components(calls: Dict[str, List[str]]) -> List[List[str]]:
+        index: Dict[str, int] = {}
+        low: Dict[str, int] = {}
+        stack: List[str] = []
+        on_stack: Set[str] = set()
+        components: List[List[str]] = []
+        for root in calls:
+            if root in index:
+                continue
+            work: List[Tuple[str, int]] = [(root, 0)]
+            while len(work) > 0:
+                name, edge = work.pop()
+                callees = [callee for callee in calls[name] if callee in calls]
+                if edge == 0:
+                    index[name] = low[name] = len(index)
+                    stack.append(name)
+                    on_stack.add(name)
+                elif callees[edge - 1] in on_stack: # back from the previous callee
+                    low[name] = min(low[name], low[callees[edge - 1]])
+                if edge < len(callees):
+                    work.append((name, edge + 1))
+                    if callees[edge] not in index:
+                        work.append((callees[edge], 0))
+                    continue
+                if low[name] == index[name]:
+                    component: List[str] = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member == name:
+                            break
+                    components.append(component)
+        return components
+
+    #endregion
+
+    #region Tree Walking
+
+    # the statements and expressions directly below node, the blocks of if and while are left out
+    @staticmethod
+    def __children(node: Any) -> List[Statement]:
+        children: List[Statement] = []
+        for name, value in vars(node).items():
+            if name == "block" and isinstance(node, (ControlStmt, FunStmt)):
+                continue
+            if isinstance(value, Statement):
+                children.append(value)
+            elif isinstance(value, list):
+                children.extend(item for item in value if isinstance(item, Statement))
+        return children
+
+    # the number of statements and expressions in the body of a function
+    @staticmethod
+    def __size(fun: FunStmt) -> int:
+        return len(Inliner.__nodes(fun.block))
+
+    # every node of the body of a function, blocks included
+    @staticmethod
+    def __nodes(statements: List[Statement]) -> List[Statement]:
+        nodes: List[Statement] = []
+        pending: List[Statement] = list(statements)
+        while len(pending) > 0:
+            node = pending.pop()
+            nodes.append(node)
+            pending.extend(Inliner.__children(node))
+            if isinstance(node, ControlStmt):
+                pending.extend(node.block)
+        return nodes
+
+    # a copy of the tree of node. The nodes in replacements are replaced by their values instead, and the
+    # variables in symbols are renamed to theirs. The labels of copied if and while statements get the suffix
+    @staticmethod
+    def __clone(node: Statement, replacements: Dict[int, Statement], symbols: Dict[int, Symbol], suffix: str = "") -> Statement:
+        copies: Dict[int, Statement] = {}
+        order: List[Statement] = []
+        pending: List[Statement] = [node]
+        while len(pending) > 0:
+            cur = pending.pop()
+            if id(cur) in replacements:
+                copies[id(cur)] = replacements[id(cur)]
+                continue
+            order.append(cur)
+            pending.extend(Inliner.__children(cur))
+            if isinstance(cur, ControlStmt):
+                pending.extend(cur.block)
+
+        # children are copied before their parents
+        for cur in reversed(order):
+            clone = copy.copy(cur)
+            for name, value in vars(cur).items():
+                if isinstance(value, Statement):
+                    setattr(clone, name, copies[id(value)])
+                elif isinstance(value, list):
+                    setattr(clone, name, [copies[id(item)] if isinstance(item, Statement) else item for item in value])
+            if isinstance(clone, ControlStmt):
+                clone.inline_suffix = cur.inline_suffix + suffix
+            symbol = getattr(cur, "symbol", None)
+            if symbol is not None and id(symbol) in symbols:
+                clone.symbol = symbols[id(symbol)]
+                if isinstance(clone, VarDefStmt):
+                    clone.name = clone.symbol.name
+                    clone.symbol.definition = clone
+                elif isinstance(clone, VarSetStmt):
+                    clone.target = clone.symbol.name
+                elif isinstance(clone, IdentRefExpr):
+                    clone.value = clone.symbol.name
+            copies[id(cur)] = clone
+        return copies[id(node)]
+
+    #endregion
+
+    #region Expression Functions
+
+    # replace the calls in the expressions of stmt, innermost first. The blocks of if and while are done on their own
+    def __inline_expressions(self, stmt: Statement, caller: FunStmt):
+        pending: List[Tuple[Any, bool]] = [(stmt, False)]
+        while len(pending) > 0:
+            node, children_done = pending.pop()
+            if not children_done:
+                pending.append((node, True))
+                pending.extend((child, False) for child in Inliner.__children(node))
+                continue
+            for name, value in vars(node).items():
+                if name == "block" and isinstance(node, (ControlStmt, FunStmt)):
+                    continue
+                if isinstance(value, FunCallExpr):
+                    setattr(node, name, self.__inline_expression(value, caller))
+                elif isinstance(value, list):
+                    for index, item in enumerate(value):
+                        if isinstance(item, FunCallExpr):
+                            value[index] = self.__inline_expression(item, caller)
+
+    # the returned expression of a function whose body is a single return, None if it has other statements
+    def __expression_body(self, name: str) -> Optional[Expression]:
+        fun = self.functions.get(name)
+        if fun is None or name in self.recursive or Inliner.__size(fun) > self.threshold:
+            return None
+        if len(fun.block) != 1 or not isinstance(fun.block[0], ReturnStmt) or fun.block[0].value is None:
+            return None
+        for node in Inliner.__nodes(fun.block):
+            if isinstance(node, CallExpr): # the arguments are only evaluated in order when nothing can change them
+                return None
+            elif isinstance(node, ArrayRefExpr) and node.symbol is not None: # needs the callee's frame
+                return None
+            elif isinstance(node, AddressOfExpr) and node.value.ident_kind == IdentType.VARIABLE:
+                return None
+        return fun.block[0].value
+
+    # the body of the called function with the parameters replaced by the arguments, the call if that would
+    # evaluate the arguments a different number of times or change what they see
+    def __inline_expression(self, call: FunCallExpr, caller: FunStmt) -> Expression:
+        body = self.__expression_body(call.target.value)
+        if body is None:
+            return call
+        callee = self.functions[call.target.value]
+        if len(call.value) != len(callee.proto.args): # the missing parameters are whatever the registers hold
+            return call
+        params = [param.symbol for param in callee.proto.args.values()]
+        uses: Dict[int, List[IdentRefExpr]] = {id(param): [] for param in params}
+        reads_memory = False
+        for node in Inliner.__nodes([body]):
+            if isinstance(node, IdentRefExpr) and node.symbol is not None and id(node.symbol) in uses:
+                uses[id(node.symbol)].append(node)
+            elif isinstance(node, (LoaderExpr, VectorExpr)) or (isinstance(node, IdentRefExpr) and node.ident_kind == IdentType.GLOBAL_VARIABLE):
+                reads_memory = True
+
+        address_taken = Inliner.__address_taken(caller)
+        unstable = 0
+        has_effects = False
+        for param, arg in zip(params, call.value):
+            if Inliner.__is_stable(arg, address_taken):
+                continue
+            # the argument is evaluated exactly once, like before
+            if len(uses[id(param)]) != 1:
+                return call
+            unstable += 1
+            has_effects = has_effects or any(isinstance(node, CallExpr) for node in Inliner.__nodes([arg]))
+        # the arguments used to be evaluated before the body, a call in one of them can't be moved past
+        # other arguments or memory the body reads
+        if has_effects and (unstable > 1 or reads_memory):
+            return call
+
+        replacements: Dict[int, Statement] = {}
+        for param, arg in zip(params, call.value):
+            for use in uses[id(param)]:
+                value = arg if len(uses[id(param)]) == 1 else Inliner.__clone(arg, {}, {})
+                if value is arg:
+                    value = copy.copy(arg) # the cast of the parameter applies to the argument
+                value.type = use.type
+                value.size = use.size
+                replacements[id(use)] = value
+        self.inlined.append((callee.proto.name, caller.proto.name, call.token.location))
+        return Inliner.__clone(body, replacements, {})
+
+    # an argument whose value nothing in the expression can change, it may be read any number of times
+    @staticmethod
+    def __is_stable(arg: Expression, address_taken: Set[int]) -> bool:
+        if isinstance(arg, (IntLiteralExpr, ConstantExpr, AddressOfExpr)):
+            return True
+        elif isinstance(arg, ArrayRefExpr):
+            return True
+        elif isinstance(arg, IdentRefExpr):
+            if arg.ident_kind == IdentType.CONSTANT:
+                return True
+            return arg.ident_kind == IdentType.VARIABLE and id(arg.symbol) not in address_taken
+        return False
+
+    # the variables of fun whose address is taken, calls can change them
+    @staticmethod
+    def __address_taken(fun: FunStmt) -> Set[int]:
+        return {id(node.value.symbol) for node in Inliner.__nodes(fun.block) \
+                if isinstance(node, AddressOfExpr) and node.value.symbol is not None}
+
+    #endregion
+
+    #region Statement Calls
+
+    # the statements that replace a call which is a statement of its own, None if it is left as it is
+    def __inline_statement(self, stmt: Statement, caller: FunStmt) -> Optional[List[Statement]]:
+        if isinstance(stmt, FunCallExpr):
+            call = stmt
+        elif isinstance(stmt, DropStmt) and isinstance(stmt.expr, FunCallExpr):
+            call = stmt.expr
+        elif isinstance(stmt, (VarDefStmt, VarSetStmt, ReturnStmt)) and isinstance(stmt.value, FunCallExpr) \
+             and (not isinstance(stmt, VarDefStmt) or stmt.var_type == IdentType.VARIABLE):
+            call = stmt.value
+        else:
+            return None
+
+        callee = self.functions.get(call.target.value)
+        if callee is None or callee is caller or callee.proto.name in self.recursive or Inliner.__size(callee) > self.threshold:
+            return None
+        elif len(call.value) != len(callee.proto.args):
+            return None
+        # the body has to end where the function returns, there is no jump to the end of it
+        body = callee.block
+        last = body[-1] if len(body) > 0 else None
+        if any(isinstance(node, ReturnStmt) and node is not last for node in Inliner.__nodes(body)):
+            return None
+        result = last.value if isinstance(last, ReturnStmt) else None
+        if result is None and not isinstance(stmt, (FunCallExpr, DropStmt)):
+            return None
+
+        # the parameters and locals get variables of their own in the caller's frame
+        symbols: Dict[int, Symbol] = {}
+        for symbol in callee.frame.definitions:
+            symbols[id(symbol)] = caller.frame.define(self.__rename(callee, symbol))
+        for symbol in callee.frame.anonymous:
+            symbols[id(symbol)] = caller.frame.define_anonymous(self.__rename(callee, symbol))
+
+        # the arguments are evaluated last to first, like they were pushed
+        statements: List[Statement] = []
+        params = list(callee.proto.args.values())
+        for param, arg in reversed(list(zip(params, call.value))):
+            definition = VarDefStmt(call.token, symbols[id(param.symbol)].name, IdentType.VARIABLE, param.type, param.size, arg)
+            definition.symbol = symbols[id(param.symbol)]
+            definition.symbol.definition = definition
+            statements.append(definition)
+        suffix = f"_inline{len(self.inlined)}"
+        for body_stmt in body:
+            if body_stmt is not last or not isinstance(last, ReturnStmt):
+                statements.append(Inliner.__clone(body_stmt, {}, symbols, suffix))
+
+        if result is not None:
+            value = Inliner.__clone(result, {}, symbols)
+            if isinstance(stmt, (FunCallExpr, DropStmt)):
+                statements.append(DropStmt(call.token, value))
+            else:
+                replaced = copy.copy(stmt)
+                replaced.value = value
+                statements.append(replaced)
+        self.inlined.append((callee.proto.name, caller.proto.name, call.token.location))
+        return statements
+
+    # a variable of callee as a variable of the frame it is inlined into
+    def __rename(self, callee: FunStmt, symbol: Symbol) -> Symbol:
+        self.renamed += 1
+        return Symbol(f"{callee.proto.name}.{symbol.name}.{self.renamed}", symbol.kind, symbol.type, symbol.size, symbol.definition)
+
+    #endregion
@@ -2,11 +2,9 @@ from typing import *
 from enum import Enum, auto
 from dataclasses import dataclass
 from unicodedata import name
+from array import array
 
 # tuple for position in file plus it's name
-# this is global
-compiler_current_scope: Dict[str, int] = {}
-
 LocTuple = Tuple[str, int, int]
 def format_location(loc: LocTuple) -> str:
         return f"{loc[0]}:{loc[1]}:{loc[2]}"
@@ -35,6 +33,13 @@ class AsmInfo:
 
     mem_size_keywords: List[str] = ["BYTE", "WORD", "DWORD", "QWORD", "PTR", "FAR"]
 
+    # registers that expressions may be evaluated in, rax and rdx are left out because division needs them
+    scratch_registers: List[str] = ["rcx", "rsi", "rdi", "r8", "r9", "r10", "r11"]
+    # registers that keep local variables, a function saves the ones it uses and restores them before it returns
+    callee_saved_registers: List[str] = ["r12", "r13", "r14", "r15", "rbx"]
+    # registers of the first arguments of a function call like in the System V ABI, the others are on the stack
+    call_arg_registers: List[str] = ["rdi", "rsi", "rdx", "rcx", "r8", "r9"]
+
     __abi_regs: List[str] = [
         registers["rdi"][3],
         registers["rsi"][3],
@@ -110,6 +115,12 @@ assert len(TokenType) == 12, "Too many TokenTypes defined"
 TOKENTYPE_BY_NAME: Dict[str, TokenType] = {
     TokenType.name.lower(): TokenType for TokenType in TokenType
 }
+# the TokenTable stores token types by their enum value
+TOKENTYPE_BY_CODE: List[Optional[TokenType]] = [None] * (len(TokenType) + 1)
+TOKENTYPE_CODES: Dict[TokenType, int] = {}
+for token_type in TokenType:
+    TOKENTYPE_BY_CODE[token_type.value] = token_type
+    TOKENTYPE_CODES[token_type] = token_type.value
 
 class IdentType(Enum):
     VARIABLE = auto()
@@ -179,6 +190,11 @@ class Intrinsic(Enum):
     STORE16 = auto()
     STORE32 = auto()
     STORE64 = auto()
+    COPY = auto()
+    FILL = auto()
+    MATCH16 = auto()
+    COMPARE16 = auto()
+    BITSCAN = auto()
     
     def get_sized_index(val: 'Intrinsic') -> int:
         return {
@@ -198,9 +214,25 @@ class Intrinsic(Enum):
     def is_loader(loader: 'Intrinsic') -> bool:
         return loader in [Intrinsic.LOAD8, Intrinsic.LOAD16, Intrinsic.LOAD32, Intrinsic.LOAD64]
 
-assert len(Intrinsic) == 11, "Too many IntrinsicTypes defined"
+    # copy and fill write a whole range of bytes
+    def is_bulk_storer(storer: 'Intrinsic') -> bool:
+        return storer in [Intrinsic.COPY, Intrinsic.FILL]
+
+    # match16 and compare16 compare 16 bytes at once, bitscan finds the first byte that did or didn't match
+    def is_vector(intrinsic: 'Intrinsic') -> bool:
+        return intrinsic in [Intrinsic.MATCH16, Intrinsic.COMPARE16, Intrinsic.BITSCAN]
+
+    # the number of operands of a vector intrinsic
+    def get_operand_count(intrinsic: 'Intrinsic') -> int:
+        return {
+            Intrinsic.MATCH16: 2,
+            Intrinsic.COMPARE16: 2,
+            Intrinsic.BITSCAN: 1
+        }[intrinsic]
+
+assert len(Intrinsic) == 16, "Too many IntrinsicTypes defined"
 INTRINSIC_BY_NAME: Dict[str, Intrinsic] = {
-    intrinsic.name.lower(): intrinsic for intrinsic in Intrinsic
+    intrinsic.name.lower().replace("_", "-"): intrinsic for intrinsic in Intrinsic
 }
 
 class ExprType(Enum):
@@ -219,12 +251,71 @@ SIZE_OF_EXPRTYPES: Dict[ExprType, int] = {
     ExprType.POINTER: 8
 }
 
-@dataclass
+# struct-of-arrays storage for the tokens of one source file
+# texts and values are interned in a shared pool and referenced by index
+class TokenTable:
+    def __init__(self, filename: str):
+        self.filename: str = filename
+        self.types: array = array('B')
+        self.lines: array = array('I')
+        self.columns: array = array('I')
+        self.texts: array = array('I')
+        self.values: array = array('I')
+        self.pool: List[Optional[Union[int, str, Enum]]] = [None]
+        self.pool_index: Dict[Union[int, str, Enum], int] = {}
+
+    def intern(self, item: Optional[Union[int, str, Enum]]) -> int:
+        if item is None:
+            return 0
+        index = self.pool_index.get(item)
+        if index is None:
+            index = len(self.pool)
+            self.pool.append(item)
+            self.pool_index[item] = index
+        return index
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, index: int) -> 'Token':
+        if index < 0:
+            index += len(self.types)
+        if index < 0 or index >= len(self.types):
+            raise IndexError("token index out of range")
+        return Token(self, index, TOKENTYPE_BY_CODE[self.types[index]], self.pool[self.values[index]])
+
+    def __iter__(self) -> Iterator['Token']:
+        for index in range(len(self.types)):
+            yield self[index]
+
+# a lightweight view of one token in a TokenTable
+# type and value are read by the parser all the time, so the view caches them
 class Token:
-    type: TokenType
-    text: str
-    location: LocTuple
-    value: Optional[Union[int, str, Enum]] = None
+    __slots__ = ("table", "index", "type", "value")
+
+    def __init__(self, table: TokenTable, index: int, type: TokenType, value: Optional[Union[int, str, Enum]]):
+        self.table = table
+        self.index = index
+        self.type = type
+        self.value = value
+
+    @property
+    def text(self) -> Optional[str]:
+        return self.table.pool[self.table.texts[self.index]]
+
+    @property
+    def location(self) -> LocTuple:
+        return (self.table.filename, self.table.lines[self.index], self.table.columns[self.index])
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Token) and self.table is other.table and self.index == other.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.table), self.index))
+
+    # pickle only the position, the table is pickled once for all of its tokens
+    def __reduce__(self):
+        return (TokenTable.__getitem__, (self.table, self.index))
 
     def __str__(self):
         if isinstance(self.value, str):
@@ -233,9 +324,72 @@ class Token:
         else:
             return f"{format_location(self.location)} {self.type.name} {self.text} {self.value}"
 
+    def __repr__(self):
+        return f"Token({self.type}, {self.text!r}, {self.location}, {self.value!r})"
+
 @dataclass
 class Constant:
     token: Token
     name: str
     type: ExprType
-    value: Union[str, int]
\ No newline at end of file
+    value: Union[str, int]
+
+# everything the compiler knows about a name
+@dataclass
+class Symbol:
+    name: str
+    kind: IdentType
+    type: ExprType
+    size: int
+    definition: Any = None          # the statement or constant that introduced the name
+    offset: Optional[int] = None    # distance below rbp, only for variables on a stack frame
+    register: Optional[str] = None  # the register a local variable lives in instead of its stack slot
+
+# scopes are chained hash tables, a name resolves to the innermost scope that defines it
+# a function scope also owns the layout of the function's stack frame
+class Scope:
+    def __init__(self, parent: Optional['Scope'] = None):
+        self.parent: Optional[Scope] = parent
+        self.symbols: Dict[str, Symbol] = {}
+        self.definitions: List[Symbol] = [] # every named symbol in order of definition, shadowed ones included
+        self.anonymous: List[Symbol] = [] # stack allocations without a name
+        self.saved_registers: Dict[str, int] = {} # callee-saved register -> offset of the slot it is saved in
+        self.frame_size: int = 0
+
+    def lookup(self, name: str) -> Optional[Symbol]:
+        scope = self
+        while scope is not None:
+            symbol = scope.symbols.get(name)
+            if symbol is not None:
+                return symbol
+            scope = scope.parent
+        return None
+
+    def define(self, symbol: Symbol) -> Symbol:
+        self.symbols[symbol.name] = symbol
+        self.definitions.append(symbol)
+        return symbol
+
+    def define_anonymous(self, symbol: Symbol) -> Symbol:
+        self.anonymous.append(symbol)
+        return symbol
+
+    # the variables in the order they are laid out on the frame
+    def variables(self) -> List[Symbol]:
+        return [symbol for symbol in self.symbols.values() if symbol.kind == IdentType.VARIABLE] + self.anonymous
+
+    # named variables come first in order of definition, variables that live in a register
+    # don't get a slot. The saved registers come last
+    def layout_frame(self) -> int:
+        self.frame_size = 0
+        for symbol in self.variables():
+            if symbol.register is not None:
+                symbol.offset = None
+                continue
+            # TODO: adjust size to variable type
+            self.frame_size += symbol.size
+            symbol.offset = self.frame_size
+        for register in self.saved_registers:
+            self.frame_size += 8
+            self.saved_registers[register] = self.frame_size
+        return self.frame_size
@@ -0,0 +1,55 @@
+from typing import *
+
+from JlangObjects import *
+from Statements import *
+
+# moves the local variables of functions from their stack slots into callee-saved registers,
+# so reading and writing them doesn't touch memory. A variable whose address is taken needs its
+# slot, when there are more variables than registers the most used ones get the registers
+class LocalPromoter:
+    LOOP_WEIGHT: int = 8 # a use inside a loop counts as this many uses outside of it
+
+    def __init__(self):
+        self.promoted: int = 0 # number of variables that live in registers
+
+    def promote_program(self, statements: List[Statement]):
+        for stmt in statements:
+            if isinstance(stmt, FunStmt):
+                self.promote_function(stmt)
+
+    def promote_function(self, fun: FunStmt):
+        weights, address_taken = LocalPromoter.__count_uses(fun)
+        candidates = [symbol for symbol in fun.frame.symbols.values() if symbol.kind == IdentType.VARIABLE and \
+                      symbol.size == 8 and \
+                      id(symbol) not in address_taken]
+        # sorting is stable, variables that are used equally often are promoted in order of definition
+        candidates.sort(key = lambda symbol: weights.get(id(symbol), 0), reverse = True)
+
+        fun.frame.saved_registers = {}
+        for symbol, register in zip(candidates, AsmInfo.callee_saved_registers):
+            symbol.register = register
+            fun.frame.saved_registers[register] = 0
+            self.promoted += 1
+        fun.frame.layout_frame()
+
+    # how often each variable is used, weighted by the loops it is used in, and the variables whose address is taken
+    @staticmethod
+    def __count_uses(fun: FunStmt) -> Tuple[Dict[int, int], Set[int]]:
+        weights: Dict[int, int] = {}
+        address_taken: Set[int] = set()
+        pending: List[Tuple[Any, int]] = [(stmt, 1) for stmt in fun.block]
+        while len(pending) > 0:
+            node, weight = pending.pop()
+            if isinstance(node, AddressOfExpr):
+                address_taken.add(id(node.value.symbol))
+                continue
+            if isinstance(node, (IdentRefExpr, VarSetStmt, VarDefStmt)) and node.symbol is not None:
+                weights[id(node.symbol)] = weights.get(id(node.symbol), 0) + weight
+            if isinstance(node, WhileStmt):
+                weight *= LocalPromoter.LOOP_WEIGHT
+            for value in vars(node).values():
+                if isinstance(value, Statement):
+                    pending.append((value, weight))
+                elif isinstance(value, list):
+                    pending.extend((item, weight) for item in value if isinstance(item, Statement))
+        return weights, address_taken
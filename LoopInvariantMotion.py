@@ -0,0 +1,185 @@
+from typing import *
+import copy
+
+from JlangObjects import *
+from Statements import *
+from EffectAnalysis import Effect, EffectAnalysis
+
+# moves the expressions of while loops that compute the same value on every iteration in front of the loop,
+# into new variables. Nothing the loop assigns may be read by them, and they may only read memory when the
+# loop writes none. An expression is only moved where it was evaluated anyway: from the condition, which
+# is evaluated before the first iteration, and from the statements the body starts with, up to the first
+# one with an effect or control flow. Those are evaluated before the loop only if its condition holds,
+# the loop is put in an if with a copy of the condition
+class LoopInvariantMotion:
+    def __init__(self, effects: EffectAnalysis):
+        self.effects: EffectAnalysis = effects
+        self.hoisted: List[Tuple[str, LocTuple, LocTuple]] = [] # function, location of the expression and of its loop
+
+    def optimize_program(self, statements: List[Statement]):
+        for stmt in statements:
+            if isinstance(stmt, FunStmt):
+                self.optimize_function(stmt)
+
+    def optimize_function(self, fun: FunStmt):
+        hoisted_before = len(self.hoisted)
+        address_taken = {id(node.value.symbol) for node in LoopInvariantMotion.__nodes(fun.block) \
+                         if isinstance(node, AddressOfExpr) and node.value.symbol is not None}
+        # the blocks of inner loops come after their outer blocks, they are optimized first
+        blocks: List[List[Statement]] = []
+        pending: List[List[Statement]] = [fun.block]
+        while len(pending) > 0:
+            block = pending.pop()
+            blocks.append(block)
+            pending.extend(stmt.block for stmt in block if isinstance(stmt, ControlStmt))
+        for block in reversed(blocks):
+            optimized: List[Statement] = []
+            for stmt in block:
+                if isinstance(stmt, WhileStmt):
+                    optimized.extend(self.__hoist(fun, stmt, address_taken))
+                else:
+                    optimized.append(stmt)
+            block[:] = optimized
+        if len(self.hoisted) > hoisted_before and not CodegenOptions.promote_locals:
+            fun.frame.layout_frame() # promoting the locals lays out the frame otherwise
+
+    def print_report(self):
+        print(f"Loop-invariant code motion: {len(self.hoisted)} expressions hoisted")
+        for function, location, loop in self.hoisted:
+            print(f"    {format_location(location)} out of the loop at {format_location(loop)} in {function}")
+
+    # the statements that replace the loop
+    def __hoist(self, fun: FunStmt, loop: WhileStmt, address_taken: Set[int]) -> List[Statement]:
+        # the condition is copied into the guard and evaluated once more, that has to change nothing
+        if self.effects.effect_of([loop.condition]) == Effect.IMPURE:
+            return [loop]
+
+        assigned: Set[int] = set(address_taken)
+        writes_memory = False
+        for node in LoopInvariantMotion.__nodes([loop.condition] + loop.block):
+            if isinstance(node, (VarDefStmt, VarSetStmt)) and node.var_type == IdentType.VARIABLE:
+                assigned.add(id(node.symbol))
+            elif self.effects.own_effect(node) == Effect.IMPURE and not isinstance(node, PrintStmt):
+                writes_memory = True # printing writes nothing the program reads
+        invariant = self.__invariant_nodes([loop.condition] + loop.block, assigned, writes_memory)
+
+        before = self.__replace_invariants(fun, loop, loop, invariant)
+        guarded: List[Statement] = []
+        for stmt in loop.block:
+            if isinstance(stmt, (ControlStmt, ReturnStmt)) or self.effects.effect_of([stmt]) == Effect.IMPURE:
+                break
+            guarded.extend(self.__replace_invariants(fun, loop, stmt, invariant))
+        if len(guarded) == 0:
+            return before + [loop]
+
+        guard = IfStmt(loop.token, LoopInvariantMotion.__copy_expression(loop.condition), guarded + [loop])
+        guard.inline_suffix = loop.inline_suffix
+        return before + [guard]
+
+    # the ids of the nodes below statements whose value is the same on every iteration of the loop
+    def __invariant_nodes(self, statements: List[Statement], assigned: Set[int], writes_memory: bool) -> Set[int]:
+        order = LoopInvariantMotion.__nodes(statements)
+        invariant: Set[int] = set()
+        # children come after their parents, they are decided first
+        for node in reversed(order):
+            if isinstance(node, (IntLiteralExpr, ConstantExpr, ArrayRefExpr, AddressOfExpr)):
+                invariant.add(id(node)) # an address doesn't change, whatever is stored at it
+                continue
+            elif isinstance(node, IdentRefExpr):
+                if node.ident_kind == IdentType.VARIABLE:
+                    own = id(node.symbol) not in assigned
+                elif node.ident_kind == IdentType.GLOBAL_VARIABLE:
+                    own = not writes_memory
+                else:
+                    own = True
+            elif isinstance(node, LoaderExpr):
+                own = not writes_memory
+            elif isinstance(node, BinaryExpr):
+                own = True
+            elif isinstance(node, FunCallExpr):
+                effect = self.effects.effect_of_call(node.target.value)
+                own = effect == Effect.PURE or (effect == Effect.READ_ONLY and not writes_memory)
+            else:
+                own = False
+            if own and all(id(child) in invariant for child in LoopInvariantMotion.__children(node)):
+                invariant.add(id(node))
+        return invariant
+
+    # replaces the largest invariant expressions below owner with new variables, their definitions are returned
+    def __replace_invariants(self, fun: FunStmt, loop: WhileStmt, owner: Statement, invariant: Set[int]) -> List[Statement]:
+        definitions: List[Statement] = []
+        pending: List[Statement] = [owner]
+        while len(pending) > 0:
+            node = pending.pop()
+            for name, value in vars(node).items():
+                if name == "block" and isinstance(node, ControlStmt):
+                    continue
+                if isinstance(value, Statement):
+                    replacement = self.__replace(fun, loop, value, invariant, definitions)
+                    if replacement is None:
+                        pending.append(value)
+                    else:
+                        setattr(node, name, replacement)
+                elif isinstance(value, list):
+                    for index, item in enumerate(value):
+                        if not isinstance(item, Statement):
+                            continue
+                        replacement = self.__replace(fun, loop, item, invariant, definitions)
+                        if replacement is None:
+                            pending.append(item)
+                        else:
+                            value[index] = replacement
+        return definitions
+
+    # the variable that replaces expr, None if it stays where it is
+    def __replace(self, fun: FunStmt, loop: WhileStmt, expr: Statement, invariant: Set[int], definitions: List[Statement]) -> Optional[IdentRefExpr]:
+        # a single load of a variable or constant is as cheap as the load of the new variable
+        if id(expr) not in invariant or not isinstance(expr, (BinaryExpr, LoaderExpr, FunCallExpr)) or expr.size != 8:
+            return None
+        symbol = fun.frame.define(Symbol(f"licm.{len(self.hoisted)}", IdentType.VARIABLE, expr.type, 8, None))
+        definition = VarDefStmt(expr.token, symbol.name, IdentType.VARIABLE, expr.type, 8, expr)
+        definition.symbol = symbol
+        symbol.definition = definition
+        definitions.append(definition)
+        self.hoisted.append((fun.proto.name, expr.token.location, loop.token.location))
+        return IdentRefExpr(expr.token, symbol.name, IdentType.VARIABLE, expr.type, symbol)
+
+    #region Tree Walking
+
+    # the statements and expressions directly below node, the blocks of if and while are left out
+    @staticmethod
+    def __children(node: Any) -> List[Statement]:
+        children: List[Statement] = []
+        for name, value in vars(node).items():
+            if name == "block" and isinstance(node, ControlStmt):
+                continue
+            if isinstance(value, Statement):
+                children.append(value)
+            elif isinstance(value, list):
+                children.extend(item for item in value if isinstance(item, Statement))
+        return children
+
+    # every node below the statements, blocks included, parents come before their children
+    @staticmethod
+    def __nodes(statements: List[Statement]) -> List[Statement]:
+        nodes: List[Statement] = []
+        pending: List[Statement] = list(reversed(statements))
+        while len(pending) > 0:
+            node = pending.pop()
+            nodes.append(node)
+            pending.extend(LoopInvariantMotion.__children(node))
+            if isinstance(node, ControlStmt):
+                pending.extend(node.block)
+        return nodes
+
+    # a copy of the expression's nodes, the tokens and symbols they refer to are shared
+    @staticmethod
+    def __copy_expression(expr: Expression) -> Expression:
+        memo: Dict[int, Any] = {}
+        for node in LoopInvariantMotion.__nodes([expr]):
+            for value in vars(node).values():
+                if not isinstance(value, (Statement, list)):
+                    memo[id(value)] = value
+        return copy.deepcopy(expr, memo)
+
+    #endregion
@@ -0,0 +1,139 @@
+import os
+import gc
+import glob
+import pickle
+import hashlib
+from typing import *
+from dataclasses import dataclass, field
+
+from JlangObjects import *
+from Statements import *
+
+# the parsed form of a module depends on the compiler itself, so the sources of the
+# compiler are part of every cache key
+def get_compiler_version() -> str:
+    digest = hashlib.sha256()
+    for source in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+        with open(source, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+COMPILER_VERSION: str = get_compiler_version()
+
+def hash_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+# everything the parser state gained from importing one file
+@dataclass
+class CachedModule:
+    statements: List[Statement]
+    prototypes: Dict[str, FunProto]
+    constants: Dict[str, Constant]
+    global_vars: Dict[str, VarDefStmt]
+    symbols: List[Symbol]                                           # global symbols in order of definition
+    strings: List[str]
+    string_base: int                                                # index of the first string in the string pool
+    imports: List[Tuple[str, bool]] = field(default_factory=list)   # every import in order, and whether the file was read
+    sources: Dict[str, str] = field(default_factory=dict)           # canonical path -> content hash of every file read
+
+    # rename the module's string literals when the string pool already holds a different number of strings
+    def relocate_strings(self, string_base: int):
+        if string_base == self.string_base:
+            return
+        names = {f"_anon_str_{self.string_base + i}": f"_anon_str_{string_base + i}" for i in range(len(self.strings))}
+        for const in self.constants.values():
+            if const.value in names:
+                const.value = names[const.value]
+
+        seen: Set[int] = set()
+        nodes: List[Any] = [self.statements, self.prototypes, self.global_vars]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            if isinstance(node, Statement):
+                if id(node) in seen:
+                    continue
+                seen.add(id(node))
+                if isinstance(node, ArrayRefExpr) and node.value in names:
+                    node.value = names[node.value]
+                nodes.extend(vars(node).values())
+            elif isinstance(node, (list, tuple)):
+                nodes.extend(node)
+            elif isinstance(node, dict):
+                nodes.extend(node.values())
+        self.string_base = string_base
+
+class ModuleCache:
+    def __init__(self, dirname: str = "__jlangcache__"):
+        self.dirname = dirname
+
+    def __entry_prefix(self, path: str) -> str:
+        name = os.path.splitext(os.path.basename(path))[0]
+        path_hash = hashlib.sha1(path.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(os.path.dirname(path), self.dirname, f"{name}-{path_hash}")
+
+    def __entry_path(self, path: str, environment: str) -> str:
+        return f"{self.__entry_prefix(path)}-{environment[:16]}.pickle"
+
+    @staticmethod
+    def __is_fresh(entry: Dict[str, Any]) -> bool:
+        if entry.get("version") != COMPILER_VERSION:
+            return False
+        for source, content_hash in entry["module"].sources.items():
+            if not os.path.exists(source) or hash_file(source) != content_hash:
+                return False
+        return True
+
+    @staticmethod
+    def __read(entry_path: str) -> Optional[Dict[str, Any]]:
+        # loading an AST allocates a lot of objects without any cycles among them,
+        # running the cycle collector all the way through would make it slower than parsing
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(entry_path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    @staticmethod
+    def __evict(entry_path: str):
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+
+    # environment is a digest of the parser state the module was imported into
+    def load(self, path: str, environment: str) -> Optional[CachedModule]:
+        entry_path = self.__entry_path(path, environment)
+        if not os.path.exists(entry_path):
+            return None
+        entry = ModuleCache.__read(entry_path)
+        if entry is None or entry.get("environment") != environment or not ModuleCache.__is_fresh(entry):
+            ModuleCache.__evict(entry_path)
+            return None
+        return entry["module"]
+
+    def store(self, path: str, environment: str, module: CachedModule):
+        entry_path = self.__entry_path(path, environment)
+        entry = {"version": COMPILER_VERSION, "environment": environment, "module": module}
+        try:
+            data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        except (RecursionError, pickle.PicklingError):
+            return # too deeply nested to be cached, it is parsed every time instead
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            # drop the entries of this file that were made by another compiler or for other contents
+            for other_path in glob.glob(f"{self.__entry_prefix(path)}-*.pickle"):
+                other = ModuleCache.__read(other_path)
+                if other is None or not ModuleCache.__is_fresh(other):
+                    ModuleCache.__evict(other_path)
+            temp_path = f"{entry_path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, entry_path)
+        except OSError:
+            pass # the cache is an optimization, a read-only location just disables it
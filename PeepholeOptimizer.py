@@ -0,0 +1,518 @@
+from typing import *
+from dataclasses import dataclass
+
+from JlangObjects import *
+
+# the 64 bit register of every register name, and whether writing the name leaves the rest of the register as it was
+FULL_REGISTERS: Dict[str, str] = {}
+PARTIAL_REGISTERS: Set[str] = set()
+for full_name, sized_names in AsmInfo.registers.items():
+    for size_index, sized_name in enumerate(sized_names):
+        FULL_REGISTERS[sized_name] = full_name
+        if size_index < 2: # writing a 32 bit register clears the upper half, 8 and 16 bit writes merge
+            PARTIAL_REGISTERS.add(sized_name)
+
+FLAGS: str = "flags"
+ALL_REGISTERS: FrozenSet[str] = frozenset(list(AsmInfo.registers.keys()) + [FLAGS])
+# registers a called function may read, and the ones it may change
+CALL_READS: FrozenSet[str] = frozenset(["rdi", "rsi", "rdx", "rcx", "r8", "r9", "rsp", "rbp"])
+CALL_WRITES: FrozenSet[str] = frozenset(["rax", "rcx", "rdx", "rsi", "rdi", "r8", "r9", "r10", "r11", "rsp", FLAGS])
+SYSCALL_READS: FrozenSet[str] = frozenset(["rax", "rdi", "rsi", "rdx", "r10", "r8", "r9"])
+SYSCALL_WRITES: FrozenSet[str] = frozenset(["rax", "rcx", "r11"])
+RET_READS: FrozenSet[str] = frozenset(["rax", "rsp", "rbp"] + AsmInfo.callee_saved_registers)
+
+ARITHMETIC: Set[str] = {"add", "sub", "and", "or", "xor", "imul"}
+CONDITIONS: Set[str] = {"e", "ne", "l", "le", "g", "ge", "b", "be", "a", "ae", "z", "nz", "s", "ns"}
+
+def is_register(operand: str) -> bool:
+    return operand in FULL_REGISTERS
+
+def is_memory(operand: str) -> bool:
+    return "[" in operand
+
+def is_immediate(operand: str) -> bool:
+    try:
+        int(operand)
+        return True
+    except ValueError:
+        return False
+
+def fits_imm32(operand: str) -> bool:
+    return is_immediate(operand) and -2**31 <= int(operand) < 2**31
+
+# the registers an operand reads when it is read, for memory operands the ones in the address
+def operand_reads(operand: str) -> Set[str]:
+    if is_register(operand):
+        return {FULL_REGISTERS[operand]}
+    elif is_memory(operand):
+        address = operand[operand.index("[") + 1:operand.index("]")]
+        return {FULL_REGISTERS[part] for part in address.replace("+", " ").replace("-", " ").replace("*", " ").split() if part in FULL_REGISTERS}
+    return set()
+
+# one line of emitted code, the comments in front of it move along with it
+class Instruction:
+    # the same few lines make up most of the code, they are only decoded once
+    __decoded: Dict[str, Tuple[str, List[str], FrozenSet[str], FrozenSet[str], bool]] = {}
+
+    def __init__(self, text: str, comments: List[str]):
+        self.text: str = text
+        self.comments: List[str] = comments
+        decoded = Instruction.__decoded.get(text)
+        if decoded is None:
+            parts = text.strip().split(None, 1)
+            opcode = parts[0]
+            operands = [operand.strip() for operand in parts[1].split(",")] if len(parts) > 1 else []
+            decoded = (opcode, operands) + Instruction.__effects(opcode, operands)
+            Instruction.__decoded[text] = decoded
+        self.opcode: str = decoded[0]
+        self.operands: List[str] = decoded[1] # shared between instructions with the same text, never changed
+        self.reads: FrozenSet[str] = decoded[2]
+        self.writes: FrozenSet[str] = decoded[3]
+        self.known: bool = decoded[4]
+
+    @staticmethod
+    def make(opcode: str, *operands: str) -> 'Instruction':
+        return Instruction(f"{opcode} {', '.join(operands)}" if len(operands) > 0 else opcode, [])
+
+    # reads and writes of registers and flags, and whether the instruction is understood at all
+    # a partial register write reads the register as well, its other bits are kept
+    @staticmethod
+    def __effects(opcode: str, operands: List[str]) -> Tuple[FrozenSet[str], FrozenSet[str], bool]:
+        reads: Set[str] = set()
+        writes: Set[str] = set()
+
+        def write(operand: str):
+            if is_register(operand):
+                writes.add(FULL_REGISTERS[operand])
+                if operand in PARTIAL_REGISTERS:
+                    reads.add(FULL_REGISTERS[operand])
+            else:
+                reads.update(operand_reads(operand))
+
+        if opcode in ("mov", "movzx", "movsx", "movsxd", "lea") and len(operands) == 2:
+            write(operands[0])
+            reads.update(operand_reads(operands[1])) # lea only reads the registers of the address as well
+        elif opcode == "xor" and len(operands) == 2 and operands[0] == operands[1] and is_register(operands[0]):
+            write(operands[0]) # xor with itself doesn't depend on the old value
+            writes.add(FLAGS)
+        elif opcode in ARITHMETIC and len(operands) == 2:
+            reads.update(operand_reads(operands[0]) | operand_reads(operands[1]))
+            write(operands[0])
+            writes.add(FLAGS)
+        elif opcode == "imul" and len(operands) == 3:
+            reads.update(operand_reads(operands[1]))
+            write(operands[0])
+            writes.add(FLAGS)
+        elif opcode in ("cmp", "test") and len(operands) == 2:
+            reads.update(operand_reads(operands[0]) | operand_reads(operands[1]))
+            writes.add(FLAGS)
+        elif opcode in ("shl", "shr", "sar", "sal") and len(operands) == 2:
+            reads.update(operand_reads(operands[0]) | operand_reads(operands[1]))
+            write(operands[0])
+            writes.add(FLAGS)
+        elif opcode in ("neg", "not", "inc", "dec") and len(operands) == 1:
+            reads.update(operand_reads(operands[0]))
+            write(operands[0])
+            if opcode != "not":
+                writes.add(FLAGS)
+        elif opcode.startswith("set") and opcode[3:] in CONDITIONS and len(operands) == 1:
+            reads.add(FLAGS)
+            write(operands[0])
+        elif opcode.startswith("cmov") and opcode[4:] in CONDITIONS and len(operands) == 2:
+            reads.update({FLAGS} | operand_reads(operands[0]) | operand_reads(operands[1]))
+            write(operands[0])
+        elif opcode == "push" and len(operands) == 1:
+            reads.update({"rsp"} | operand_reads(operands[0]))
+            writes.add("rsp")
+        elif opcode == "pop" and len(operands) == 1:
+            reads.add("rsp")
+            writes.add("rsp")
+            write(operands[0])
+        elif opcode == "cqo":
+            reads.add("rax")
+            writes.add("rdx")
+        elif opcode in ("div", "idiv", "mul", "imul") and len(operands) == 1:
+            reads.update({"rax", "rdx"} | operand_reads(operands[0]))
+            writes.update({"rax", "rdx", FLAGS})
+        elif opcode == "call":
+            return CALL_READS, CALL_WRITES, True
+        elif opcode == "syscall":
+            return SYSCALL_READS, SYSCALL_WRITES, True
+        elif opcode == "ret":
+            return RET_READS, frozenset(["rsp"]), True
+        elif opcode == "jmp" and len(operands) == 1 and not is_register(operands[0]) and not is_memory(operands[0]):
+            pass
+        elif opcode.startswith("j") and opcode[1:] in CONDITIONS and len(operands) == 1:
+            reads.add(FLAGS)
+        else:
+            return ALL_REGISTERS, ALL_REGISTERS, False
+        return frozenset(reads), frozenset(writes), True
+
+    # jumps end a block
+    def is_jump(self) -> bool:
+        return self.opcode == "jmp" or (self.opcode.startswith("j") and self.opcode[1:] in CONDITIONS)
+
+    # touches the stack pointer or memory through it, or is not understood
+    def uses_stack(self) -> bool:
+        return not self.known or "rsp" in self.reads or "rsp" in self.writes or self.is_jump() or self.opcode in ("call", "ret", "syscall")
+
+    def writes_memory(self) -> bool:
+        return len(self.operands) > 0 and is_memory(self.operands[0]) and self.opcode not in ("cmp", "test", "push")
+
+    def __str__(self):
+        return self.text
+
+# a straight run of instructions, only the first one has labels in front of it and only the last one jumps
+class BasicBlock:
+    def __init__(self, function: str, header: List[str]):
+        self.function: str = function # the global label the block belongs to
+        self.header: List[str] = header # the labels and comments in front of the first instruction
+        self.instructions: List[Instruction] = []
+        self.successors: List['BasicBlock'] = []
+        self.escapes: bool = False # control may go on to code whose registers are not known
+        self.live_in: FrozenSet[str] = frozenset()
+        self.live_out: FrozenSet[str] = frozenset()
+
+    def ends(self) -> bool:
+        return len(self.instructions) > 0 and (self.instructions[-1].is_jump() or self.instructions[-1].opcode == "ret")
+
+    # the registers that are live in front of block.instructions[index]
+    def live_before(self, index: int) -> Set[str]:
+        live = set(self.live_out)
+        for instr in reversed(self.instructions[index:]):
+            live = (live - instr.writes) | instr.reads
+        return live
+
+# whether none of the registers is read again before it is overwritten, starting at block.instructions[index]
+def is_dead(block: BasicBlock, index: int, registers: Set[str]) -> bool:
+    registers = set(registers)
+    for instr in block.instructions[index:]:
+        if len(registers & instr.reads) > 0:
+            return False
+        registers -= instr.writes
+        if len(registers) == 0 or instr.opcode == "ret": # only the return value is read after a return
+            return True
+    return len(registers & block.live_out) == 0
+
+@dataclass
+class PeepholeRule:
+    name: str
+    # gets a block and the index of the instruction to look at, returns how many instructions
+    # starting at the index are replaced and what they are replaced with, or None if the rule doesn't apply
+    apply: Callable[[BasicBlock, int], Optional[Tuple[int, List[Instruction]]]]
+
+#region rules
+
+FORWARD_WINDOW: int = 16 # how many instructions a pop may be away from its push
+
+# push X; ...; pop Y  ->  mov Y, X, as long as the instructions in between don't get in the way. When they
+# change X and use Y, the value waits in a scratch register they don't touch and that is dead after the pop
+def forward_push_pop(block: BasicBlock, index: int) -> Optional[Tuple[int, List[Instruction]]]:
+    code = block.instructions
+    push = code[index]
+    if push.opcode != "push" or not (is_register(push.operands[0]) or fits_imm32(push.operands[0])):
+        return None
+    source = push.operands[0]
+    source_regs = operand_reads(source)
+    for end in range(index + 1, min(index + FORWARD_WINDOW + 1, len(code))):
+        instr = code[end]
+        if instr.opcode == "pop":
+            break
+        if instr.uses_stack():
+            return None
+    else:
+        return None
+
+    target = code[end].operands[0]
+    if not is_register(target) or target in PARTIAL_REGISTERS:
+        return None
+    middle = code[index + 1:end]
+    middle_writes = set().union(*[instr.writes for instr in middle])
+    middle_reads = set().union(*[instr.reads for instr in middle])
+    target_reg = FULL_REGISTERS[target]
+    if source == target and target_reg not in middle_writes:
+        return end - index + 1, middle
+    elif len(source_regs & middle_writes) == 0:
+        return end - index + 1, middle + [Instruction.make("mov", target, source)]
+    elif target_reg not in middle_writes and target_reg not in middle_reads:
+        return end - index + 1, [Instruction.make("mov", target, source)] + middle
+    for scratch in reversed(AsmInfo.scratch_registers):
+        if scratch not in middle_writes | middle_reads | source_regs and scratch != target_reg and is_dead(block, end + 1, {scratch}):
+            return end - index + 1, [Instruction.make("mov", scratch, source)] + middle + [Instruction.make("mov", target, scratch)]
+    return None
+
+# mov R, imm; ...; op X, R  ->  op X, imm, the mov is removed once R is dead
+def propagate_immediate(block: BasicBlock, index: int) -> Optional[Tuple[int, List[Instruction]]]:
+    code = block.instructions
+    load = code[index]
+    if load.opcode != "mov" or not is_register(load.operands[0]) or load.operands[0] in PARTIAL_REGISTERS \
+       or FULL_REGISTERS[load.operands[0]] != load.operands[0] or not fits_imm32(load.operands[1]):
+        return None
+    reg, value = load.operands
+    for use_index in range(index + 1, min(index + 4, len(code))):
+        use = code[use_index]
+        if reg in use.reads:
+            break
+        if reg in use.writes or use.is_jump():
+            return None
+    else:
+        return None
+
+    replacement: Optional[Instruction] = None
+    if use.opcode == "push" and use.operands[0] == reg:
+        replacement = Instruction.make("push", value)
+    elif len(use.operands) == 2 and use.operands[1] == reg and reg not in operand_reads(use.operands[0]):
+        if use.opcode in ("add", "sub", "cmp", "and", "or", "xor", "test") and is_register(use.operands[0]):
+            replacement = Instruction.make(use.opcode, use.operands[0], value)
+        elif use.opcode in ("add", "sub", "cmp", "and", "or", "xor", "test") and use.operands[0].startswith("["):
+            replacement = Instruction.make(use.opcode, f"QWORD {use.operands[0]}", value)
+        elif use.opcode == "imul" and is_register(use.operands[0]):
+            replacement = Instruction.make("imul", use.operands[0], use.operands[0], value)
+        elif use.opcode == "mov" and is_register(use.operands[0]):
+            replacement = Instruction.make("mov", use.operands[0], value)
+        elif use.opcode == "mov" and is_memory(use.operands[0]) and use.operands[0].startswith("["):
+            replacement = Instruction.make("mov", f"QWORD {use.operands[0]}", value)
+    if replacement is None:
+        return None
+    replacement.comments = use.comments
+    return use_index - index + 1, code[index:use_index] + [replacement]
+
+# mov R, R is gone, mov A, B; mov B, A loses the second move
+# mov R, S; mov T, R  ->  mov T, S when R isn't read afterwards
+def remove_redundant_move(block: BasicBlock, index: int) -> Optional[Tuple[int, List[Instruction]]]:
+    code = block.instructions
+    move = code[index]
+    if move.opcode != "mov" or not is_register(move.operands[0]) or FULL_REGISTERS[move.operands[0]] != move.operands[0]:
+        return None
+    target, source = move.operands
+    if source == target:
+        return 1, []
+    if index + 1 >= len(code):
+        return None
+    follower = code[index + 1]
+    if follower.opcode != "mov" or follower.operands[1] != target:
+        return None
+    if follower.operands[0] == source:
+        return 2, [move]
+    if target in operand_reads(follower.operands[0]) or not is_dead(block, index + 2, {target}):
+        return None
+    if is_memory(follower.operands[0]):
+        if is_memory(source) or not (is_register(source) or fits_imm32(source)):
+            return None
+        if is_immediate(source):
+            if not follower.operands[0].startswith("["):
+                return None
+            return 2, [Instruction.make("mov", f"QWORD {follower.operands[0]}", source)]
+    elif not is_register(follower.operands[0]) or FULL_REGISTERS[follower.operands[0]] != follower.operands[0]:
+        return None
+    return 2, [Instruction.make("mov", follower.operands[0], source)]
+
+# a move, load or xor whose register is overwritten before anything reads it
+def remove_dead_write(block: BasicBlock, index: int) -> Optional[Tuple[int, List[Instruction]]]:
+    code = block.instructions
+    instr = code[index]
+    if instr.opcode not in ("mov", "movzx", "lea", "xor") or not instr.known or instr.writes_memory():
+        return None
+    if instr.opcode == "xor" and instr.operands[0] != instr.operands[1]:
+        return None
+    if not is_register(instr.operands[0]) or instr.operands[0] in PARTIAL_REGISTERS:
+        return None
+    if FULL_REGISTERS[instr.operands[0]] in ("rsp", "rbp"): # the frame outlives the block
+        return None
+    if not is_dead(block, index + 1, set(instr.writes)):
+        return None
+    return 1, []
+
+# add X, 0 and sub X, 0 only change the flags
+def remove_identity_arithmetic(block: BasicBlock, index: int) -> Optional[Tuple[int, List[Instruction]]]:
+    instr = block.instructions[index]
+    if instr.opcode not in ("add", "sub") or instr.operands[1] != "0" or not is_dead(block, index + 1, {FLAGS}):
+        return None
+    return 1, []
+
+# xor C, C; ... mov D, 1; ... cmp A, B; cmovcc C, D  ->  ... cmp A, B; setcc C8; movzx C, C8
+def materialize_condition(block: BasicBlock, index: int) -> Optional[Tuple[int, List[Instruction]]]:
+    code = block.instructions
+    clear = code[index]
+    if clear.opcode != "xor" or clear.operands[0] != clear.operands[1] or not is_register(clear.operands[0]) \
+       or FULL_REGISTERS[clear.operands[0]] != clear.operands[0]:
+        return None
+    reg = clear.operands[0]
+    flags_set = False
+    one_reg: Optional[str] = None
+    for end in range(index + 1, min(index + 8, len(code))):
+        instr = code[end]
+        if instr.opcode.startswith("cmov"):
+            break
+        if not instr.known or reg in instr.reads or reg in instr.writes:
+            return None
+        if FLAGS in instr.reads and not flags_set:
+            return None
+        if FLAGS in instr.writes:
+            flags_set = True
+        if instr.opcode == "mov" and is_register(instr.operands[0]) and instr.operands[1] == "1":
+            one_reg = FULL_REGISTERS[instr.operands[0]]
+        elif one_reg is not None and one_reg in instr.writes:
+            one_reg = None
+    else:
+        return None
+
+    select = code[end]
+    condition = select.opcode[4:]
+    if not flags_set or select.operands[0] != reg or select.operands[1] != one_reg:
+        return None
+    byte_reg = AsmInfo.registers[reg][0]
+    setcc = Instruction.make(f"set{condition}", byte_reg)
+    setcc.comments = select.comments
+    middle = code[index + 1:end]
+    if len(middle) > 0:
+        middle[0].comments = clear.comments + middle[0].comments
+    return end - index + 1, middle + [setcc, Instruction.make("movzx", reg, byte_reg)]
+
+#endregion
+
+# the rules in the order they are tried at every instruction, more rules can be appended
+PEEPHOLE_RULES: List[PeepholeRule] = [
+    PeepholeRule("push/pop forwarding", forward_push_pop),
+    PeepholeRule("immediate propagation", propagate_immediate),
+    PeepholeRule("redundant move elimination", remove_redundant_move),
+    PeepholeRule("dead write removal", remove_dead_write),
+    PeepholeRule("condition materialization", materialize_condition),
+    PeepholeRule("identity arithmetic removal", remove_identity_arithmetic),
+]
+
+# rewrites the emitted code of the functions a few instructions at a time. Labels and jumps split
+# the code into basic blocks, the rules look inside of a block and know which registers are live after it
+class PeepholeOptimizer:
+    MAX_PASSES: int = 8
+
+    def __init__(self, rules: Optional[List[PeepholeRule]] = None):
+        self.rules: List[PeepholeRule] = PEEPHOLE_RULES if rules is None else rules
+        self.fired: Dict[str, int] = {rule.name: 0 for rule in self.rules}
+        self.instructions_before: int = 0
+        self.instructions_after: int = 0
+
+    def optimize(self, code: str) -> str:
+        blocks = PeepholeOptimizer.__split_blocks(code)
+        self.instructions_before += sum(len(block.instructions) for block in blocks)
+        # a block is only looked at again when it changed or fewer registers are live after it
+        pending: Set[int] = {id(block) for block in blocks}
+        for _ in range(PeepholeOptimizer.MAX_PASSES):
+            # removing instructions only makes fewer registers live, the liveness of the last pass stays correct
+            live_outs = [block.live_out for block in blocks]
+            PeepholeOptimizer.__compute_liveness(blocks)
+            pending |= {id(block) for block, live_out in zip(blocks, live_outs) if block.live_out != live_out}
+            changed: Set[int] = set()
+            for block in blocks:
+                if id(block) in pending and self.__optimize_block(block):
+                    changed.add(id(block))
+            if len(changed) == 0:
+                break
+            pending = changed
+        self.instructions_after += sum(len(block.instructions) for block in blocks)
+
+        output: List[str] = []
+        for block in blocks:
+            output.extend(block.header)
+            for instr in block.instructions:
+                output.extend(instr.comments)
+                output.append(instr.text)
+        return "\n".join(output)
+
+    @staticmethod
+    def __split_blocks(code: str) -> List[BasicBlock]:
+        blocks: List[BasicBlock] = [BasicBlock("", [])]
+        labels: Dict[str, BasicBlock] = {}
+        comments: List[str] = []
+        function = ""
+        for line in code.split("\n"):
+            stripped = line.strip()
+            if stripped == "" or stripped.startswith(";"):
+                comments.append(line)
+            elif stripped.endswith(":"):
+                name = stripped[:-1]
+                if not name.startswith("."):
+                    function = name
+                else: # local labels belong to the global label before them
+                    name = function + name
+                if len(blocks[-1].instructions) > 0 or blocks[-1].function != function:
+                    blocks.append(BasicBlock(function, []))
+                blocks[-1].header.extend(comments + [line])
+                comments = []
+                labels[name] = blocks[-1]
+            else:
+                if blocks[-1].ends():
+                    blocks.append(BasicBlock(function, []))
+                blocks[-1].instructions.append(Instruction(line, comments))
+                comments = []
+        blocks.append(BasicBlock(function, comments))
+
+        for index, block in enumerate(blocks):
+            last = block.instructions[-1] if len(block.instructions) > 0 else None
+            if last is not None and last.is_jump():
+                target = last.operands[0]
+                target = block.function + target if target.startswith(".") else target
+                if target in labels and labels[target].function == block.function:
+                    block.successors.append(labels[target])
+                else:
+                    block.escapes = True
+            if last is not None and (last.opcode == "ret" or last.opcode == "jmp"):
+                continue
+            if index + 1 < len(blocks) and blocks[index + 1].function == block.function:
+                block.successors.append(blocks[index + 1])
+            else:
+                block.escapes = True
+        return blocks
+
+    # the registers that are live at the start and end of every block, until nothing changes
+    @staticmethod
+    def __compute_liveness(blocks: List[BasicBlock]):
+        for block in blocks:
+            block.live_in = frozenset()
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(blocks):
+                live_out = set(ALL_REGISTERS) if block.escapes else set()
+                for successor in block.successors:
+                    live_out |= successor.live_in
+                block.live_out = frozenset(live_out)
+                live_in = frozenset(block.live_before(0))
+                if live_in != block.live_in:
+                    block.live_in = live_in
+                    changed = True
+
+    def __optimize_block(self, block: BasicBlock) -> bool:
+        code = block.instructions
+        changed = False
+        index = 0
+        while index < len(code):
+            for rule in self.rules:
+                result = rule.apply(block, index)
+                if result is None:
+                    continue
+                count, replacement = result
+                # keep the comments of the replaced instructions
+                kept = {id(comment) for instr in replacement for comment in instr.comments}
+                comments = [comment for instr in code[index:index + count] for comment in instr.comments if id(comment) not in kept]
+                if len(replacement) > 0:
+                    replacement[0].comments = comments + replacement[0].comments
+                elif index + count < len(code):
+                    code[index + count].comments = comments + code[index + count].comments
+                elif index > 0:
+                    code[index - 1].comments.extend(comments)
+                else:
+                    block.header.extend(comments)
+                code[index:index + count] = replacement
+                self.fired[rule.name] += 1
+                changed = True
+                index = max(0, index - 4) # the instructions before may match now
+                break
+            else:
+                index += 1
+        return changed
+
+    def print_report(self):
+        print(f"Peephole optimizer: {self.instructions_before} -> {self.instructions_after} instructions")
+        for name, count in self.fired.items():
+            print(f"    {name}: {count}")
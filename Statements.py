@@ -1,6 +1,28 @@
 from JlangObjects import *
+from ArithmeticLowering import ArithmeticLowering
+from FrameLayout import FrameLayout
 import io
 
+# set by the driver before any code is generated
+class CodegenOptions:
+    register_expressions: bool = False # evaluate expression trees in registers instead of on the stack
+    promote_locals: bool = True # keep local variables in callee-saved registers instead of their stack slots
+    peephole: bool = True # rewrite the emitted code of functions with the peephole rules
+    strength_reduction: bool = True # arithmetic with a constant operand uses shifts, lea and multiply-high sequences
+    intermediate_code: bool = False # generate functions through the three-address IR instead of from the AST
+    register_arguments: bool = True # pass the first arguments of calls in registers instead of pushing all of them
+    inline_threshold: int = 24 # the most nodes the body of a function may have to be inlined, 0 turns inlining off
+    elide_frames: bool = True # functions only set up as much of a stack frame as their body uses
+    hoist_invariants: bool = True # expressions whose value doesn't change in a while loop are evaluated before it
+    tree_shaking: bool = True # functions, globals and strings that main can't reach are left out of the executable
+
+    # the registers the first arguments of a call with count arguments are passed in
+    @staticmethod
+    def argument_registers(count: int) -> List[str]:
+        if not CodegenOptions.register_arguments:
+            return []
+        return AsmInfo.call_arg_registers[:count]
+
 #region Generic Classes
 
 # Statements don't have a type
@@ -42,6 +64,10 @@ class Expression(Statement):
         else:
             sink.write(f"{self.value}")
 
+    # generate the expression with its value ending up in reg instead of on the stack
+    def codegen_into(self, sink: io.StringIO, reg: str):
+        RegisterAllocator.codegen_operands(sink, [(self, reg)])
+
 #endregion
 
 #region Expressions
@@ -53,11 +79,20 @@ class IntLiteralExpr(Expression):
 
     def codegen(self, sink: io.StringIO):
         sink.write(f"; {format_location(self.token.location)} push int literal {self.value}\n")
-        sink.write(f"push {self.value}\n")
+        if -2**31 <= self.value < 2**31:
+            sink.write(f"push {self.value}\n")
+        else: # push only takes sign extended 32 bit immediates
+            sink.write(f"mov rax, {self.value}\n")
+            sink.write("push rax\n")
+
+    def codegen_load(self, sink: io.StringIO, reg: str):
+        sink.write(f"; {format_location(self.token.location)} load int literal {self.value}\n")
+        sink.write(f"mov {reg}, {self.value}\n")
 
 class ArrayRefExpr(Expression):
-    def __init__(self, token: Token, value: str):
+    def __init__(self, token: Token, value: str, symbol: Optional[Symbol] = None):
         super().__init__(token, value, ExprType.POINTER)
+        self.symbol = symbol # only set for arrays on the stack frame
 
     def print(self, depth: int = 0):
         assert isinstance(self.value, str), "Array literal value must be a string"
@@ -67,13 +102,20 @@ class ArrayRefExpr(Expression):
 
     def codegen(self, sink: io.StringIO):
         sink.write(f"; {format_location(self.token.location)} push array ptr {self.value}\n")
-        if self.value in compiler_current_scope: # this must be a local anonymous variable
-            sink.write(f"lea rax, [rbp - {compiler_current_scope[self.value]}]\n")    
+        if self.symbol is not None: # this must be a local anonymous variable
+            sink.write(f"lea rax, [rbp - {self.symbol.offset}]\n")    
         else:
             assert isinstance(self.value, str), "String literal must be a string"
             sink.write(f"mov rax, {self.value}\n")
         sink.write("push rax\n")
 
+    def codegen_load(self, sink: io.StringIO, reg: str):
+        sink.write(f"; {format_location(self.token.location)} load array ptr {self.value}\n")
+        if self.symbol is not None:
+            sink.write(f"lea {reg}, [rbp - {self.symbol.offset}]\n")
+        else:
+            sink.write(f"mov {reg}, {self.value}\n")
+
 class LoaderExpr(Expression):
     def __init__(self, token: Token, target: Expression):
         super().__init__(token, target,ExprType.INTEGER)
@@ -85,6 +127,11 @@ class LoaderExpr(Expression):
         self.value.print(depth + 4)
     
     def codegen(self, sink: io.StringIO):
+        if CodegenOptions.register_expressions:
+            self.codegen_into(sink, "rax")
+            sink.write("push rax\n")
+            return
+
         loader_type = self.token.value
         assert isinstance(loader_type, Intrinsic), "Expected Loader type to be Intrinsic"
         
@@ -100,11 +147,76 @@ class LoaderExpr(Expression):
         sink.write(f"mov {sized_register}, {sized_keyword}[rdi]\n")
         sink.write(f"push rax\n")
 
+    # the pointer is in reg, it is replaced by the value it points to
+    def codegen_deref(self, sink: io.StringIO, reg: str):
+        sized_index = Intrinsic.get_sized_index(self.token.value)
+        sink.write(f"; {format_location(self.token.location)} Loader {self.token.value}\n")
+        if sized_index == 3:
+            sink.write(f"mov {reg}, QWORD [{reg}]\n")
+        elif sized_index == 2: # writing the 32 bit register clears the upper half
+            sink.write(f"mov {AsmInfo.registers[reg][2]}, DWORD [{reg}]\n")
+        else:
+            sink.write(f"movzx {reg}, {AsmInfo.mem_size_keywords[sized_index]} [{reg}]\n")
+
+# match16(ptr, byte) compares the bytes from ptr to the end of its 16 byte block with the low byte of byte, bit i
+# of the result is set if the byte at ptr + i matched. The block is loaded aligned, it never reaches into the next page.
+# compare16(a, b) sets bit i if the bytes at a + i and b + i are equal, for i below 16, both ranges must be readable.
+# bitscan(mask) is the index of the lowest set bit of mask, 64 if no bit is set
+class VectorExpr(Expression):
+    # the registers the operands go in
+    operand_registers: List[str] = ["rdi", "rsi"]
+
+    def __init__(self, token: Token, operands: List[Expression]):
+        super().__init__(token, operands, ExprType.INTEGER)
+
+    def print(self, depth: int = 0):
+        print(f"{' ' * depth}Vector {self.token.value}")
+        print(f"{' ' * depth}Operands:")
+        for operand in self.value:
+            operand.print(depth + 4)
+
+    def codegen(self, sink: io.StringIO):
+        sink.write(f"; {format_location(self.token.location)} Vector {self.token.value}\n")
+        RegisterAllocator.codegen_operands(sink, list(zip(self.value, VectorExpr.operand_registers)))
+        VectorExpr.codegen_vector(sink, self.token.value)
+        sink.write("push rax\n")
+
+    # the operands are in their registers, the result ends up in rax. rcx, rdx, xmm0 and xmm1 are changed as well
+    @staticmethod
+    def codegen_vector(sink: io.StringIO, intrinsic: Intrinsic):
+        if intrinsic == Intrinsic.MATCH16:
+            # every byte of xmm1 gets the byte to look for
+            sink.write("movd xmm1, esi\n")
+            sink.write("punpcklbw xmm1, xmm1\n")
+            sink.write("punpcklwd xmm1, xmm1\n")
+            sink.write("pshufd xmm1, xmm1, 0\n")
+            sink.write("mov rax, rdi\n")
+            sink.write("and rax, -16\n")
+            sink.write("movdqa xmm0, [rax]\n")
+            sink.write("pcmpeqb xmm0, xmm1\n")
+            sink.write("pmovmskb eax, xmm0\n")
+            # the bytes in front of ptr are shifted out
+            sink.write("mov ecx, edi\n")
+            sink.write("and ecx, 15\n")
+            sink.write("shr eax, cl\n")
+        elif intrinsic == Intrinsic.COMPARE16:
+            sink.write("movdqu xmm0, [rdi]\n")
+            sink.write("movdqu xmm1, [rsi]\n")
+            sink.write("pcmpeqb xmm0, xmm1\n")
+            sink.write("pmovmskb eax, xmm0\n")
+        elif intrinsic == Intrinsic.BITSCAN:
+            sink.write("mov edx, 64\n")
+            sink.write("bsf rax, rdi\n")
+            sink.write("cmovz rax, rdx\n") # bsf leaves its target undefined if there is no set bit
+        else:
+            raise ValueError(f"Unknown vector intrinsic {intrinsic}")
+
 
 class IdentRefExpr(Expression):
-    def __init__(self, token: Token, name: str, ident_kind: IdentType, type: ExprType):
+    def __init__(self, token: Token, name: str, ident_kind: IdentType, type: ExprType, symbol: Optional[Symbol] = None):
         super().__init__(token, name, type)
         self.ident_kind = ident_kind
+        self.symbol = symbol
         
     
     def print(self, depth: int = 0):
@@ -117,16 +229,32 @@ class IdentRefExpr(Expression):
         if self.ident_kind == IdentType.VARIABLE:
             assert isinstance(self.value, str), "Variable name must be a string"
             sink.write(f"; {format_location(self.token.location)} get variable {self.value}\n")
-            sink.write(f"mov rax, [rbp - {compiler_current_scope[self.value]}]\n")
+            if self.symbol.register is not None:
+                sink.write(f"push {self.symbol.register}\n")
+                return
+            sink.write(f"mov rax, [rbp - {self.symbol.offset}]\n")
             sink.write("push rax\n")
         elif self.ident_kind == IdentType.GLOBAL_VARIABLE:
             sink.write(f"; {format_location(self.token.location)} get global variable {self.value}\n")
             sink.write(f"mov rax, QWORD [{self.value}]\n")
             sink.write("push rax\n")
         elif self.ident_kind == IdentType.CONSTANT:
-            sink.write(f"; {format_location(self.token.location)} get constant {self.value}\n")
-            sink.write(f"mov rax, QWORD [{self.value}]\n")
-            sink.write("push rax\n")
+            raise ValueError(f"Constant {self.value} at {format_location(self.token.location)} was not folded into its value")
+        else:
+            raise ValueError(f"Invalid Identifier found for {self.value}")
+
+    def codegen_load(self, sink: io.StringIO, reg: str):
+        if self.ident_kind == IdentType.VARIABLE:
+            sink.write(f"; {format_location(self.token.location)} load variable {self.value}\n")
+            if self.symbol.register is not None:
+                sink.write(f"mov {reg}, {self.symbol.register}\n")
+            else:
+                sink.write(f"mov {reg}, [rbp - {self.symbol.offset}]\n")
+        elif self.ident_kind == IdentType.GLOBAL_VARIABLE:
+            sink.write(f"; {format_location(self.token.location)} load global {self.value}\n")
+            sink.write(f"mov {reg}, QWORD [{self.value}]\n")
+        elif self.ident_kind == IdentType.CONSTANT:
+            raise ValueError(f"Constant {self.value} at {format_location(self.token.location)} was not folded into its value")
         else:
             raise ValueError(f"Invalid Identifier found for {self.value}")
 
@@ -145,7 +273,7 @@ class AddressOfExpr(Expression):
         assert isinstance(self.value, IdentRefExpr), "AddressOf must be an IdentRefExpr"
         sink.write(f"; {format_location(self.token.location)} AddressOf {self.token.value}\n")
         if self.value.ident_kind == IdentType.VARIABLE:
-            sink.write(f"lea rax, [rbp - {compiler_current_scope[self.value.value]}]\n")
+            sink.write(f"lea rax, [rbp - {self.value.symbol.offset}]\n")
         elif self.value.ident_kind == IdentType.GLOBAL_VARIABLE:
             sink.write(f"mov rax, {self.value.value}\n") # value is name
         elif self.value.ident_kind == IdentType.CONSTANT: 
@@ -153,9 +281,47 @@ class AddressOfExpr(Expression):
         else:
             raise ValueError(f"Invalid Identifier found for {self.value.value}")
         sink.write("push rax\n")
+
+    def codegen_load(self, sink: io.StringIO, reg: str):
+        assert isinstance(self.value, IdentRefExpr), "AddressOf must be an IdentRefExpr"
+        sink.write(f"; {format_location(self.token.location)} load AddressOf {self.value.value}\n")
+        if self.value.ident_kind == IdentType.VARIABLE:
+            sink.write(f"lea {reg}, [rbp - {self.value.symbol.offset}]\n")
+        elif self.value.ident_kind == IdentType.GLOBAL_VARIABLE or self.value.ident_kind == IdentType.CONSTANT:
+            sink.write(f"mov {reg}, {self.value.value}\n")
+        else:
+            raise ValueError(f"Invalid Identifier found for {self.value.value}")
    
 
 class BinaryExpr(Expression):
+    # condition code suffixes of the comparison operators, for setcc and jcc
+    condition_codes: Dict[Operator, str] = {
+        Operator.EQUAL: "e",
+        Operator.NOT_EQUAL: "ne",
+        Operator.LESS: "l",
+        Operator.LESS_EQUAL: "le",
+        Operator.GREATER: "g",
+        Operator.GREATER_EQUAL: "ge",
+    }
+    # the condition that holds when the comparison doesn't, for jumping past the code it guards
+    inverse_condition_codes: Dict[Operator, str] = {
+        Operator.EQUAL: "ne",
+        Operator.NOT_EQUAL: "e",
+        Operator.LESS: "ge",
+        Operator.LESS_EQUAL: "g",
+        Operator.GREATER: "le",
+        Operator.GREATER_EQUAL: "l",
+    }
+    # the comparison that gives the same result with the operands swapped
+    swapped_comparisons: Dict[Operator, Operator] = {
+        Operator.EQUAL: Operator.EQUAL,
+        Operator.NOT_EQUAL: Operator.NOT_EQUAL,
+        Operator.LESS: Operator.GREATER,
+        Operator.LESS_EQUAL: Operator.GREATER_EQUAL,
+        Operator.GREATER: Operator.LESS,
+        Operator.GREATER_EQUAL: Operator.LESS_EQUAL,
+    }
+
     def __init__(self, token: Token, left: Expression, right: Expression):
         super().__init__(token, left, ExprType.INTEGER)
         self.right = right
@@ -170,13 +336,56 @@ class BinaryExpr(Expression):
         assert isinstance(self.right, Expression), "Right of Binary Expression must be an Expression"
         self.right.print(depth + 4)
     
+    # operands are generated with an explicit stack in post-order, so long operator chains don't recurse
     def codegen(self, sink: io.StringIO):
-        assert isinstance(self.value, Expression) and isinstance(self.right, Expression), "Binary expressions must have expressions as their left and right values"
-        self.value.codegen(sink)
-        self.right.codegen(sink)
+        if CodegenOptions.register_expressions:
+            self.codegen_into(sink, "rax")
+            sink.write("push rax\n")
+            return
+
+        stack: List[Tuple[Expression, bool]] = [(self, False)]
+        while len(stack) > 0:
+            expr, operands_done = stack.pop()
+            if not isinstance(expr, BinaryExpr):
+                expr.codegen(sink)
+            elif operands_done:
+                expr.codegen_operator(sink)
+            else:
+                assert isinstance(expr.value, Expression) and isinstance(expr.right, Expression), "Binary expressions must have expressions as their left and right values"
+                stack.append((expr, True))
+                immediate = expr.immediate_operand()
+                if immediate is not None: # only the other operand is pushed
+                    stack.append((immediate[0], False))
+                    continue
+                stack.append((expr.right, False))
+                stack.append((expr.value, False))
+
+    # the operand that has to be evaluated and the constant, when the operator has a cheaper sequence
+    # with the other operand as an immediate. Additions and products can take it on either side
+    def immediate_operand(self) -> Optional[Tuple[Expression, int]]:
+        operator = self.token.value
+        if not CodegenOptions.strength_reduction:
+            return None
+        elif isinstance(self.right, IntLiteralExpr) and ArithmeticLowering.lowers(operator, self.right.value):
+            return self.value, self.right.value
+        elif (operator == Operator.PLUS or operator == Operator.MULTIPLY) and isinstance(self.value, IntLiteralExpr) \
+                and not isinstance(self.right, IntLiteralExpr) and ArithmeticLowering.lowers(operator, self.value.value):
+            return self.right, self.value.value
+        return None
+
+    # both operands are on the stack, the left one below the right one
+    def codegen_operator(self, sink: io.StringIO):
         #sink.write(f"; {format_location(self.token.location)}: Binary Expression\n")
         
-        if self.token.value == Operator.PLUS:
+        immediate = self.immediate_operand()
+        if immediate is not None: # only the other operand is on the stack
+            _, constant = immediate
+            reg = "rcx" if len(ArithmeticLowering.clobbered(self.token.value, constant)) > 0 else "rax"
+            sink.write(f"; {format_location(self.token.location)} {self.token.value.name.title()} by {constant}\n")
+            sink.write(f"pop {reg}\n")
+            ArithmeticLowering.codegen(sink, self.token.value, reg, constant)
+            sink.write(f"push {reg}\n")
+        elif self.token.value == Operator.PLUS:
             sink.write(f"; {format_location(self.token.location)} Plus\n")
             sink.write("pop rdi\n")
             sink.write("pop rax\n")
@@ -206,67 +415,141 @@ class BinaryExpr(Expression):
             sink.write("pop rdi\n")
             sink.write("pop rax\n")
             sink.write("cqo\n")
-            sink.write("div rdi\n")
+            sink.write("idiv rdi\n")
             sink.write("push rdx\n")
         elif self.token.value == Operator.EQUAL:
             sink.write(f"; {format_location(self.token.location)} Equal\n")
             sink.write("xor rcx, rcx\n")
-            sink.write("mov rbx, 1\n")
+            sink.write("mov rdx, 1\n")
             sink.write("pop rdi\n")
             sink.write("pop rax\n")
             sink.write("cmp rax, rdi\n")
-            sink.write("cmove rcx, rbx\n")
+            sink.write("cmove rcx, rdx\n")
             sink.write("push rcx\n")
         elif self.token.value == Operator.NOT_EQUAL:
             sink.write(f"; {format_location(self.token.location)} Not Equal\n")
             sink.write("xor rcx, rcx\n")
-            sink.write("mov rbx, 1\n")
+            sink.write("mov rdx, 1\n")
             sink.write("pop rdi\n")
             sink.write("pop rax\n")
             sink.write("cmp rax, rdi\n")
-            sink.write("cmovne rcx, rbx\n")
+            sink.write("cmovne rcx, rdx\n")
             sink.write("push rcx\n")
         elif self.token.value == Operator.LESS:
             sink.write(f"; {format_location(self.token.location)} Less Than\n")
             sink.write("xor rcx, rcx\n")
-            sink.write("mov rbx, 1\n")
+            sink.write("mov rdx, 1\n")
             sink.write("pop rdi\n")
             sink.write("pop rax\n")
             sink.write("cmp rax, rdi\n")
-            sink.write("cmovl rcx, rbx\n")
+            sink.write("cmovl rcx, rdx\n")
             sink.write("push rcx\n")
         elif self.token.value == Operator.LESS_EQUAL:
             sink.write(f"; {format_location(self.token.location)} Less Than or Equal\n")
             sink.write("xor rcx, rcx\n")
-            sink.write("mov rbx, 1\n")
+            sink.write("mov rdx, 1\n")
             sink.write("pop rdi\n")
             sink.write("pop rax\n")
             sink.write("cmp rax, rdi\n")
-            sink.write("cmovle rcx, rbx\n")
+            sink.write("cmovle rcx, rdx\n")
             sink.write("push rcx\n")
         elif self.token.value == Operator.GREATER:
             sink.write(f"; {format_location(self.token.location)} Greater Than\n")
             sink.write("xor rcx, rcx\n")
-            sink.write("mov rbx, 1\n")
+            sink.write("mov rdx, 1\n")
             sink.write("pop rdi\n")
             sink.write("pop rax\n")
             sink.write("cmp rax, rdi\n")
-            sink.write("cmovg rcx, rbx\n")
+            sink.write("cmovg rcx, rdx\n")
             sink.write("push rcx\n")
         elif self.token.value == Operator.GREATER_EQUAL:
             sink.write(f"; {format_location(self.token.location)} Greater Than or Equal\n")
             sink.write("xor rcx, rcx\n")
-            sink.write("mov rbx, 1\n")
+            sink.write("mov rdx, 1\n")
             sink.write("pop rdi\n")
             sink.write("pop rax\n")
             sink.write("cmp rax, rdi\n")
-            sink.write("cmovge rcx, rbx\n")
+            sink.write("cmovge rcx, rdx\n")
             sink.write("push rcx\n")
         elif self.token.type == TokenType.EOE:
             sink.write(f"; {format_location(self.token.location)} End of Expression\n")
         else:
             raise ValueError(f"Unknown binary operator {self.token.value} at {format_location(self.token.location)}")
 
+    def is_comparison(self) -> bool:
+        return self.token.value in BinaryExpr.condition_codes
+
+    # a comparison that decides a branch: jump to label when it is false. The flags of the cmp are
+    # used directly, the comparison's 0 or 1 is never computed
+    def codegen_branch(self, sink: io.StringIO, label: str):
+        assert self.is_comparison(), "Only comparisons can be fused with a branch"
+        sink.write(f"; {format_location(self.token.location)} {self.token.value.name.replace('_', ' ').title()} Branch\n")
+        comparison = self.token.value
+        LHS, RHS = self.value, self.right
+        left = RegisterAllocator.direct_operand(LHS)
+        right = RegisterAllocator.direct_operand(RHS)
+        if left is not None and left not in AsmInfo.registers and (right is None or right in AsmInfo.registers):
+            # an immediate can only be the second operand of cmp
+            LHS, RHS, left, right = RHS, LHS, right, left
+            comparison = BinaryExpr.swapped_comparisons[comparison]
+        if left is not None and left not in AsmInfo.registers:
+            left = None
+        if left is None and right is None:
+            RegisterAllocator.codegen_operands(sink, [(LHS, "rax"), (RHS, "rdi")])
+            left, right = "rax", "rdi"
+        elif left is None:
+            LHS.codegen_into(sink, "rax")
+            left = "rax"
+        elif right is None:
+            RHS.codegen_into(sink, "rdi")
+            right = "rdi"
+        sink.write(f"cmp {left}, {right}\n")
+        sink.write(f"j{BinaryExpr.inverse_condition_codes[comparison]} {label}\n")
+
+    # the left operand is in reg and the right one in right_reg, the result replaces the left operand
+    # busy registers hold values that are still needed
+    def codegen_operator_into(self, sink: io.StringIO, reg: str, right_reg: str, busy: Tuple[str, ...]):
+        assert len(Operator) == 11, "Too many Operators defined at BinaryExpr.codegen_operator_into"
+        sink.write(f"; {format_location(self.token.location)} {self.token.value.name.replace('_', ' ').title()}\n")
+        if self.token.value == Operator.PLUS:
+            sink.write(f"add {reg}, {right_reg}\n")
+        elif self.token.value == Operator.MINUS:
+            sink.write(f"sub {reg}, {right_reg}\n")
+        elif self.token.value == Operator.MULTIPLY:
+            sink.write(f"imul {reg}, {right_reg}\n")
+        elif self.token.value == Operator.DIVIDE or self.token.value == Operator.MODULO:
+            # the dividend and the results are in rax and rdx, keep them if they are in use
+            saved = [saved_reg for saved_reg in ("rax", "rdx") if saved_reg in busy]
+            for saved_reg in saved:
+                sink.write(f"push {saved_reg}\n")
+            sink.write(f"mov rax, {reg}\n")
+            sink.write("cqo\n")
+            if self.token.value == Operator.DIVIDE:
+                sink.write(f"idiv {right_reg}\n")
+                sink.write(f"mov {reg}, rax\n")
+            else:
+                sink.write(f"idiv {right_reg}\n")
+                sink.write(f"mov {reg}, rdx\n")
+            for saved_reg in reversed(saved):
+                sink.write(f"pop {saved_reg}\n")
+        elif self.token.value in BinaryExpr.condition_codes:
+            sink.write(f"cmp {reg}, {right_reg}\n")
+            sink.write(f"set{BinaryExpr.condition_codes[self.token.value]} {AsmInfo.registers[reg][0]}\n")
+            sink.write(f"movzx {reg}, {AsmInfo.registers[reg][0]}\n")
+        else:
+            raise ValueError(f"Unknown binary operator {self.token.value} at {format_location(self.token.location)}")
+
+    # the operand is in reg, it is replaced by the result of the operator with the constant operand
+    def codegen_immediate_into(self, sink: io.StringIO, reg: str, busy: Tuple[str, ...]):
+        _, constant = self.immediate_operand()
+        sink.write(f"; {format_location(self.token.location)} {self.token.value.name.title()} by {constant}\n")
+        saved = [saved_reg for saved_reg in ArithmeticLowering.clobbered(self.token.value, constant) if saved_reg in busy]
+        for saved_reg in saved:
+            sink.write(f"push {saved_reg}\n")
+        ArithmeticLowering.codegen(sink, self.token.value, reg, constant)
+        for saved_reg in reversed(saved):
+            sink.write(f"pop {saved_reg}\n")
+
 class CallExpr(Expression):
     def __init__(self, token: Token, args: List[Expression], target_type: ExprType):
         super().__init__(token, args, target_type)
@@ -295,6 +578,13 @@ class SyscallExpr(CallExpr):
         
     def codegen(self, sink: io.StringIO):
         sink.write(f"; {self.token} System Call\n")
+        if CodegenOptions.register_expressions:
+            operands = [(arg, AsmInfo.get_abi_reg_name(i)) for i, arg in enumerate(self.value)]
+            RegisterAllocator.codegen_operands(sink, operands + [(self.callnum, "rax")])
+            sink.write("syscall\n")
+            sink.write("push rax\n")
+            return
+
         for arg in self.value:
             arg.codegen(sink)
         
@@ -335,8 +625,7 @@ class DropStmt(Statement):
 
     def codegen(self, sink: io.StringIO):
         sink.write("; Drop Statement\n")
-        self.expr.codegen(sink)
-        sink.write("pop rax\n")
+        self.expr.codegen_into(sink, "rax")
 
 #region Variable and Memory Manipulation Statments
 
@@ -347,6 +636,7 @@ class VarDefStmt(Statement):
         self.value = value
         self.var_type = var_type
         self.size = size
+        self.symbol: Optional[Symbol] = None # set once the variable is defined in a scope
     
     def print(self, depth: int = 0):
         print(f"{' ' * depth}VarDefStmt: {self.name}")
@@ -355,30 +645,43 @@ class VarDefStmt(Statement):
             print(f"{' ' * depth}None")
         else:
             self.value.print(depth + 4)
-    
+
+    # the operand of the dq that holds the initial value of a global, None if it is only known at runtime.
+    # Initializers are folded, a value that is known at compile time is a literal, a constant or a label
+    def static_value(self) -> Optional[str]:
+        if isinstance(self.value, (IntLiteralExpr, ConstantExpr)):
+            return str(self.value.value)
+        elif isinstance(self.value, ArrayRefExpr) and self.value.symbol is None:
+            return self.value.value # a string or a global array
+        elif isinstance(self.value, IdentRefExpr) and self.value.ident_kind == IdentType.CONSTANT:
+            return str(self.value.symbol.definition.value)
+        return None
+
     def codegen(self, sink: io.StringIO):
         assert len(IdentType) == 4, "Too many IdentTypes defined"
-        if self.var_type == IdentType.GLOBAL_VARIABLE:  # TODO: evaluate global variables at compile time
+        if self.var_type == IdentType.GLOBAL_VARIABLE: # only the globals that are initialized at runtime get here
             if self.value is not None:
                 sink.write(f"; {format_location(self.token.location)}: Variable Definition\n")
-                self.value.codegen(sink)
-                sink.write(f"pop rax\n")
+                self.value.codegen_into(sink, "rax")
                 sink.write(f"mov [{self.name}], rax\n")
         elif self.var_type == IdentType.VARIABLE:
             if self.value is not None:
                 sink.write(f"; {format_location(self.token.location)}: Variable Definition\n")
-                self.value.codegen(sink)
-                sink.write(f"pop rax\n")
-                sink.write(f"mov [rbp - {compiler_current_scope[self.name]}], rax\n")
+                if self.symbol.register is not None:
+                    self.value.codegen_into(sink, self.symbol.register)
+                    return
+                self.value.codegen_into(sink, "rax")
+                sink.write(f"mov [rbp - {self.symbol.offset}], rax\n")
         else:
             raise ValueError("Unexpected identifier type found")
 
 class VarSetStmt(Statement):
-    def __init__(self, token: Token, target: str, var_type: IdentType, value: Expression):
+    def __init__(self, token: Token, target: str, var_type: IdentType, value: Expression, symbol: Optional[Symbol] = None):
         super().__init__(token, ExprType.NONE)
         self.target = target
         self.value = value
         self.var_type = var_type
+        self.symbol = symbol
     
     def print(self, depth: int = 0):
         print(f"{' ' * depth}Set Variable: {self.target}")
@@ -389,14 +692,15 @@ class VarSetStmt(Statement):
         sink.write(f"; {format_location(self.token.location)} Set Variable {self.target}")
         if self.var_type == IdentType.GLOBAL_VARIABLE:  # TODO: evaluate global variables at compile time
             if self.value is not None:
-                self.value.codegen(sink)
-                sink.write(f"pop rax\n")
+                self.value.codegen_into(sink, "rax")
                 sink.write(f"mov [{self.target}], rax\n")
         elif self.var_type == IdentType.VARIABLE:
             if self.value is not None:
-                self.value.codegen(sink)
-                sink.write(f"pop rax\n")
-                sink.write(f"mov [rbp - {compiler_current_scope[self.target]}], rax\n")
+                if self.symbol.register is not None:
+                    self.value.codegen_into(sink, self.symbol.register)
+                    return
+                self.value.codegen_into(sink, "rax")
+                sink.write(f"mov [rbp - {self.symbol.offset}], rax\n")
         else:
             raise ValueError(f"Unexpected identifier type found: {self.var_type}")
 
@@ -421,12 +725,47 @@ class StorerStmt(Statement):
         sized_register = AsmInfo.registers["rax"][Intrinsic.get_sized_index(storer_type)]
                 
         sink.write(f"; {format_location(self.token.location)} Storer Statement\n")
-        self.target.codegen(sink)
-        self.value.codegen(sink)
-        sink.write("pop rax\n")
-        sink.write("pop rdi\n")
+        RegisterAllocator.codegen_operands(sink, [(self.target, "rdi"), (self.value, "rax")])
         sink.write(f"mov {sized_keyword} [rdi], {sized_register}\n") # for example mov BYTE [rdi], al
-        
+
+# copy(dest, src, length) copies length bytes from src to dest, front to back like a loop of load8 and store8.
+# fill(dest, value, length) stores the low byte of value length times. A length below 1 writes nothing
+class BulkStorerStmt(Statement):
+    def __init__(self, token: Token, target: Expression, value: Expression, length: Expression):
+        super().__init__(token, ExprType.NONE)
+        self.target = target
+        self.value = value # the source pointer of copy, the byte of fill
+        self.length = length
+
+    def print(self, depth: int = 0):
+        print(f"{' ' * depth}Bulk Storer Statement {self.token.value}")
+        print(f"{' ' * depth}Target:")
+        self.target.print(depth + 4)
+        print(f"{' ' * depth}Value:")
+        self.value.print(depth + 4)
+        print(f"{' ' * depth}Length:")
+        self.length.print(depth + 4)
+
+    def codegen(self, sink: io.StringIO):
+        sink.write(f"; {format_location(self.token.location)} Bulk Storer Statement\n")
+        registers = BulkStorerStmt.operand_registers(self.token.value)
+        RegisterAllocator.codegen_operands(sink, list(zip([self.target, self.value, self.length], registers)))
+        BulkStorerStmt.codegen_rep(sink, self.token.value)
+
+    # the registers the target, value and length go in
+    @staticmethod
+    def operand_registers(intrinsic: Intrinsic) -> List[str]:
+        return ["rdi", "rsi" if intrinsic == Intrinsic.COPY else "rax", "rcx"]
+
+    # the operands are in their registers, rep moves a byte and counts rcx down until it is 0. rdi, rsi and rcx
+    # are changed, rdx as well
+    @staticmethod
+    def codegen_rep(sink: io.StringIO, intrinsic: Intrinsic):
+        sink.write("xor rdx, rdx\n")
+        sink.write("test rcx, rcx\n")
+        sink.write("cmovl rcx, rdx\n") # a negative count would be taken as a huge unsigned one
+        sink.write("rep movsb\n" if intrinsic == Intrinsic.COPY else "rep stosb\n")
+
 
 #endregion Variable and Memory Manipulation Statments
 
@@ -467,21 +806,28 @@ class FunCallExpr(CallExpr):
     def codegen(self, sink: io.StringIO):
         sink.write(f"; {format_location(self.token.location)} Function Call\n")
         
-        # push arguments in reverse order
-        
-        for arg in reversed(self.value):
-            arg.codegen(sink)
+        # the arguments are evaluated in reverse order, the ones after the register arguments are pushed
+        registers = CodegenOptions.argument_registers(len(self.value))
+        stack_args = self.value[len(registers):]
+        if CodegenOptions.register_expressions:
+            for arg in reversed(stack_args):
+                arg.codegen(sink)
+            RegisterAllocator.codegen_operands(sink, list(reversed(list(zip(self.value, registers)))))
+        else:
+            for arg in reversed(self.value):
+                arg.codegen(sink)
+            for reg in registers:
+                sink.write(f"pop {reg}\n")
 
-        # tell the function where the stack variables are located
-        sink.write(f"mov rbx, rsp\n")
         sink.write(f"call {self.target.value}\n")
 
         # realign stack
         args_size = 0
-        for arg in self.value:
+        for arg in stack_args:
             args_size += arg.size
 
-        sink.write(f"add rsp, {args_size}\n")
+        if args_size > 0:
+            sink.write(f"add rsp, {args_size}\n")
 
         if self.type != ExprType.NONE:
             sink.write(f"push rax\n")
@@ -498,26 +844,27 @@ class PrintStmt(Statement):
         self.expr.print(depth + 4)
 
     def codegen(self, sink: io.StringIO):
-        self.expr.codegen(sink)
         sink.write(f"; {format_location(self.token.location)} Print \n")
-        sink.write(f"pop rdi\n")
+        self.expr.codegen_into(sink, "rdi")
         sink.write(f"call print\n")
 
 #region Control Flow Statements
 
 class FunStmt(Statement):
-    def __init__(self, proto: FunProto, block: List[Statement], scope: Dict[str, VarDefStmt], type: ExprType):
+    # the frame is the function's scope, its layout has been computed by the parser
+    def __init__(self, proto: FunProto, block: List[Statement], frame: Scope, type: ExprType):
         super().__init__(proto.token, type)
         self.proto: FunProto = proto
         self.block: List[Statement] = block
-        self.scope: Dict[str, VarDefStmt] = scope
+        self.frame: Scope = frame
 
     def print(self, depth: int = 0):
         print(f"{' ' * depth}Function Expression: {self.proto.name}")
         print(f"{' ' * depth}Parameters: ")
-        if len(self.scope) > 0:
-            for var in self.scope.values():
-                var.print(depth + 4)
+        variables = self.frame.variables()
+        if len(variables) > 0:
+            for var in variables:
+                var.definition.print(depth + 4)
         else:
             print(f"{' ' * (depth + 4)}None")
 
@@ -529,49 +876,51 @@ class FunStmt(Statement):
                 expr.print(depth + 4)
     
     def codegen(self, sink: io.StringIO):
-        local_vars_size = 0
-        # arguments have been inserted into the scope already
-        for var in self.scope.values():
-            local_vars_size += var.size
-            # TODO: adjust size to variable type
-            compiler_current_scope[var.name] = local_vars_size
-
         sink.write(f"; Function Definition {self.proto.name}\n")
         sink.write(f"{self.proto.name}:\n")
 
-        sink.write("push rbp\n")
-        sink.write("mov rbp, rsp\n")
-
-        #make space for variables on stack (rbp)
-        if len(self.scope) > 0:
-            sink.write(f"sub rsp, {local_vars_size }\n")
-
-        # arguments are now on stack
+        # the body is generated first, it decides how much of a frame the function needs
+        body = io.StringIO()
+        # the first arguments are in registers, the rest are on the stack
         # the stack grows downwards, meaning that the first argument is at the top of the stack, the second is at the top of the stack minus 8, etc.
-        # rbx contains the callee stack variables
+        # above rbp are the saved rbp and the return address, the arguments follow
         # transfer arguments to local variables
-        for param in self.proto.args.values():
-            sink.write(f"mov rax, [rbx + {compiler_current_scope[param.name] - 8}]\n")
-            sink.write(f"mov [rbp - {compiler_current_scope[param.name]}], rax\n")
+        registers = CodegenOptions.argument_registers(len(self.proto.args))
+        for index, param in enumerate(self.proto.args.values()):
+            if index < len(registers):
+                source = registers[index]
+            else:
+                source = f"[rbp + {16 + 8 * (index - len(registers))}]"
+            if param.symbol.register is not None:
+                body.write(f"mov {param.symbol.register}, {source}\n")
+                continue
+            if index >= len(registers):
+                body.write(f"mov rax, {source}\n")
+                source = "rax"
+            body.write(f"mov [rbp - {param.symbol.offset}], {source}\n")
 
-        
         for stmt in self.block:
-            stmt.codegen(sink)
+            stmt.codegen(body)
 
-        sink.write(f".end:\n")
-        sink.write("mov rsp, rbp\n")
-        sink.write("pop rbp\n")
-        sink.write("ret\n")
+        FrameLayout(self.frame.frame_size, self.frame.saved_registers, body.getvalue(), CodegenOptions.elide_frames).codegen(sink)
         sink.write(f"; End of Function {self.proto.name}\n\n")
 
-        # clear the scope for the next function
-        compiler_current_scope.clear()
-
 class ControlStmt(Statement):
+    inline_suffix: str = "" # tells apart the labels of the copies of the statement that were inlined
+
     def __init__(self, token: Token, condition: Expression, block: List[Statement]):
         super().__init__(token)
         self.condition: Expression = condition
         self.block: List[Statement] = block
+
+    # jump to label when the condition is zero, a comparison jumps on its own flags
+    def codegen_condition(self, sink: io.StringIO, label: str):
+        if isinstance(self.condition, BinaryExpr) and self.condition.is_comparison():
+            self.condition.codegen_branch(sink, label)
+            return
+        self.condition.codegen_into(sink, "rax")
+        sink.write("cmp rax, 0\n")
+        sink.write(f"je {label}\n")
     
     def print(self, depth: int = 0):
         print(f"{' ' * depth}Control Statement: {self.type}")
@@ -588,14 +937,10 @@ class IfStmt(ControlStmt):
     def codegen(self, sink: io.StringIO):
         sink.write(f"; {format_location(self.token.location)} If block\n")
         # use location to name the label
-        label_base = f"l{self.token.location[1]}_c{self.token.location[2]}"
+        label_base = f"l{self.token.location[1]}_c{self.token.location[2]}{self.inline_suffix}"
 
-        self.condition.codegen(sink) # condition
-        
         sink.write(f".if_cmp_{label_base}:\n")
-        sink.write("pop rax\n")
-        sink.write("cmp rax, 0\n")
-        sink.write(f"je .if_block_end_{label_base}\n")
+        self.codegen_condition(sink, f".if_block_end_{label_base}")
         sink.write(f".if_block_{label_base}:\n")
 
         # create sink to capture the code for the if block
@@ -612,13 +957,10 @@ class WhileStmt(ControlStmt):
     def codegen(self, sink: io.StringIO):
         sink.write(f"; {format_location(self.token.location)} While block\n")
         # use location to name the label
-        label_base = f"l{self.token.location[1]}_c{self.token.location[2]}"
+        label_base = f"l{self.token.location[1]}_c{self.token.location[2]}{self.inline_suffix}"
 
         sink.write(f".while_cmp_{label_base}:\n")
-        self.condition.codegen(sink)
-        sink.write("pop rax\n")
-        sink.write("cmp rax, 0\n")
-        sink.write(f"je .while_end_{label_base}\n")
+        self.codegen_condition(sink, f".while_end_{label_base}")
         sink.write(f".while_block_{label_base}:\n")
         for stmt in self.block:
             stmt.codegen(sink)
@@ -642,9 +984,170 @@ class ReturnStmt(Statement):
     def codegen(self, sink: io.StringIO):
         sink.write(f"; {format_location(self.token.location)} Return Statment\n")
         if self.value is not None:
-            self.value.codegen(sink)
-            sink.write("pop rax\n")
+            self.value.codegen_into(sink, "rax")
         sink.write("jmp .end\n")
 #endregion Control-Flow Statements
 
-#endregion Statements
\ No newline at end of file
+#endregion Statements
+
+#region Register Allocation
+
+# generates expression trees into registers in Sethi-Ullman order: of the two operands, the one that
+# needs more registers is evaluated first, so a tree is evaluated with as few registers as possible.
+# Values only go to the stack when the scratch registers run out, or around code of the stack machine
+class RegisterAllocator:
+    # expressions that are loaded into a register with a single instruction
+    leaves: Tuple[type, ...] = (IntLiteralExpr, IdentRefExpr, ArrayRefExpr, AddressOfExpr)
+
+    # the operand of an instruction that reads the expression without any code to evaluate it:
+    # a literal that fits a sign extended 32 bit immediate or a variable that lives in a register
+    @staticmethod
+    def direct_operand(expr: Expression) -> Optional[str]:
+        if isinstance(expr, IntLiteralExpr) and -2**31 <= expr.value < 2**31:
+            return str(expr.value)
+        elif isinstance(expr, IdentRefExpr) and expr.ident_kind == IdentType.VARIABLE and expr.symbol.register is not None:
+            return expr.symbol.register
+        return None
+
+    # evaluate the expressions into their registers in order, the registers of earlier operands keep their values
+    @staticmethod
+    def codegen_operands(sink: io.StringIO, operands: List[Tuple[Expression, str]]):
+        if not CodegenOptions.register_expressions:
+            for expr, _ in operands:
+                expr.codegen(sink)
+            for _, reg in reversed(operands):
+                sink.write(f"pop {reg}\n")
+            return
+
+        busy: Tuple[str, ...] = ()
+        for expr, reg in operands:
+            RegisterAllocator.codegen(sink, expr, reg, busy)
+            busy += (reg,)
+
+    # the number of registers every node of the tree needs, and the nodes whose subtree contains
+    # code of the stack machine, like calls. Those are never reordered with their siblings
+    @staticmethod
+    def __label(expr: Expression) -> Tuple[Dict[int, int], Set[int]]:
+        needs: Dict[int, int] = {}
+        opaque: Set[int] = set()
+        stack: List[Tuple[Expression, bool]] = [(expr, False)]
+        while len(stack) > 0:
+            cur_expr, operands_done = stack.pop()
+            if isinstance(cur_expr, BinaryExpr):
+                if operands_done:
+                    LHS_needs = needs[id(cur_expr.value)]
+                    RHS_needs = needs[id(cur_expr.right)]
+                    needs[id(cur_expr)] = max(LHS_needs, RHS_needs) if LHS_needs != RHS_needs else LHS_needs + 1
+                    immediate = cur_expr.immediate_operand()
+                    if immediate is not None: # the constant doesn't take a register
+                        needs[id(cur_expr)] = needs[id(immediate[0])]
+                    if id(cur_expr.value) in opaque or id(cur_expr.right) in opaque:
+                        opaque.add(id(cur_expr))
+                else:
+                    stack.append((cur_expr, True))
+                    stack.append((cur_expr.right, False))
+                    stack.append((cur_expr.value, False))
+            elif isinstance(cur_expr, LoaderExpr):
+                if operands_done:
+                    needs[id(cur_expr)] = needs[id(cur_expr.value)]
+                    if id(cur_expr.value) in opaque:
+                        opaque.add(id(cur_expr))
+                else:
+                    stack.append((cur_expr, True))
+                    stack.append((cur_expr.value, False))
+            else:
+                needs[id(cur_expr)] = 1
+                if not isinstance(cur_expr, RegisterAllocator.leaves):
+                    opaque.add(id(cur_expr))
+        return needs, opaque
+
+    # generate the tree with its value ending up in reg, busy registers hold values that are still needed
+    # the tree is walked with an explicit task stack, so long operator chains don't recurse
+    @staticmethod
+    def codegen(sink: io.StringIO, expr: Expression, reg: str, busy: Tuple[str, ...] = ()):
+        needs, opaque = RegisterAllocator.__label(expr)
+        free = tuple(free_reg for free_reg in AsmInfo.scratch_registers if free_reg != reg and free_reg not in busy)
+        if reg in AsmInfo.scratch_registers or not isinstance(expr, (BinaryExpr, LoaderExpr)):
+            avail = (reg,) + free
+        else: # operators can't work in rax and rdx, the result is moved there at the end
+            avail = free
+
+        # tasks: ("gen", expr, avail, busy) evaluates expr into avail[0] with the other available registers
+        # ("operator", expr, reg, right_reg, busy), ("immediate", expr, reg, busy), ("deref", expr, reg) and ("write", text)
+        tasks: List[Tuple[Any, ...]] = [("gen", expr, avail, busy)]
+        while len(tasks) > 0:
+            task = tasks.pop()
+            if task[0] == "write":
+                sink.write(task[1])
+            elif task[0] == "operator":
+                task[1].codegen_operator_into(sink, task[2], task[3], task[4])
+            elif task[0] == "immediate":
+                task[1].codegen_immediate_into(sink, task[2], task[3])
+            elif task[0] == "deref":
+                task[1].codegen_deref(sink, task[2])
+            else:
+                _, cur_expr, cur_avail, cur_busy = task
+                if isinstance(cur_expr, RegisterAllocator.leaves):
+                    cur_expr.codegen_load(sink, cur_avail[0])
+                elif isinstance(cur_expr, LoaderExpr):
+                    tasks.append(("deref", cur_expr, cur_avail[0]))
+                    tasks.append(("gen", cur_expr.value, cur_avail, cur_busy))
+                elif isinstance(cur_expr, BinaryExpr):
+                    tasks.extend(reversed(RegisterAllocator.__binary_tasks(cur_expr, cur_avail, cur_busy, needs, opaque)))
+                else:
+                    # the stack machine may use any register, the ones in use are saved around it
+                    for busy_reg in cur_busy:
+                        sink.write(f"push {busy_reg}\n")
+                    cur_expr.codegen(sink)
+                    sink.write(f"pop {cur_avail[0]}\n")
+                    for busy_reg in reversed(cur_busy):
+                        sink.write(f"pop {busy_reg}\n")
+
+        if avail[0] != reg:
+            sink.write(f"mov {reg}, {avail[0]}\n")
+
+    @staticmethod
+    def __binary_tasks(expr: BinaryExpr, avail: Tuple[str, ...], busy: Tuple[str, ...], needs: Dict[int, int], opaque: Set[int]) -> List[Tuple[Any, ...]]:
+        assert len(avail) >= 2, f"Not enough registers for the operands at {format_location(expr.token.location)}"
+        reg, right_reg = avail[0], avail[1]
+        LHS_needs = needs[id(expr.value)]
+        RHS_needs = needs[id(expr.right)]
+        reorderable = id(expr.value) not in opaque and id(expr.right) not in opaque
+        immediate = expr.immediate_operand()
+        if immediate is not None:
+            # the constant is part of the instructions, only the other operand needs a register
+            return [
+                ("gen", immediate[0], avail, busy),
+                ("immediate", expr, reg, busy),
+            ]
+        elif isinstance(expr.right, IdentRefExpr) and expr.right.symbol is not None and expr.right.symbol.register is not None:
+            # a variable that lives in a register is used where it is
+            return [
+                ("gen", expr.value, avail, busy),
+                ("operator", expr, reg, expr.right.symbol.register, busy),
+            ]
+        elif RHS_needs > LHS_needs and LHS_needs < len(avail) and reorderable:
+            # the right operand first, the left one needs fewer registers while it is kept
+            return [
+                ("gen", expr.right, (right_reg, reg) + avail[2:], busy),
+                ("gen", expr.value, (reg,) + avail[2:], busy + (right_reg,)),
+                ("operator", expr, reg, right_reg, busy),
+            ]
+        elif RHS_needs < len(avail):
+            return [
+                ("gen", expr.value, avail, busy),
+                ("gen", expr.right, avail[1:], busy + (reg,)),
+                ("operator", expr, reg, right_reg, busy),
+            ]
+        else:
+            # the right operand needs every register, the left one is spilled in the meantime
+            return [
+                ("gen", expr.value, avail, busy),
+                ("write", f"push {reg}\n"),
+                ("gen", expr.right, avail, busy),
+                ("write", f"mov {right_reg}, {reg}\n"),
+                ("write", f"pop {reg}\n"),
+                ("operator", expr, reg, right_reg, busy),
+            ]
+
+#endregion
@@ -1,28 +1,43 @@
+import re
+from collections import deque
 from typing import *
 from JlangObjects import *
 
-class Tokenizer:
-    @staticmethod
-    def __try_parse_int_literal(s: str) -> Optional[int]:
-        try:
-            return int(s)
-        except ValueError:
-            return None
-    @staticmethod
-    def __get_word_from_string(string: str) -> str:
-        i = 0
-        while i < len(string) and string[i].isalnum() or string[i] == '-' or string[i] == '_':
-            i += 1
-            if i >= len(string):
-                break
-        return string[0:i]
-    @staticmethod
-    def __get_int_text_from_string(string: str) -> str:
-        i = 0
-        while i < len(string) and string[i].isdigit():
-            i += 1
-        return string[0:i]
+# every word-like token is resolved through this one table; earlier categories take
+# precedence over later ones, so a name can never be claimed by two token types
+WORD_TOKENS: Dict[str, Tuple[TokenType, Enum]] = {}
+for token_type, by_name in reversed([
+    (TokenType.KEYWORD, KEYWORDS_BY_NAME),
+    (TokenType.OPERATOR, OPERATOR_BY_NAME),
+    (TokenType.TYPE, EXPRTYPE_BY_NAME),
+    (TokenType.SYSCALL, SYSCALL_BY_NAME),
+    (TokenType.INTRINSIC, INTRINSIC_BY_NAME),
+]):
+    for word, value in by_name.items():
+        WORD_TOKENS[word] = (token_type, value)
+
+# master pattern for the scanner, leading blanks are skipped as part of every match and
+# the groups are tried in order at the current offset. The last group catches everything else,
+# so every offset of the file is consumed exactly once
+TOKEN_PATTERN = re.compile(r"""
+    [^\S\n]*
+    (?:
+    (?P<newline>\n)
+  | (?P<comment>;[^\n]*)
+  | (?P<word>[^\W\d_][\w-]*)
+  | (?P<int>\d+)
+  | (?P<string>"(?:[^"\\\n]|\\.)*")
+  | (?P<delimiter>,)
+  | (?P<paren_start>\()
+  | (?P<paren_end>\))
+  | (?P<invalid>.)
+  | (?P<end>$)
+    )
+""", re.VERBOSE)
+
+ESCAPE_PATTERN = re.compile(r"\\(.)")
 
+class Tokenizer:
     @staticmethod
     def __get_escape_value(char: str) -> str:
         if char == 'n':
@@ -32,85 +47,124 @@ class Tokenizer:
         else:
             assert False, f"\\{char}: Escape sequence for this char is not yet supported"
 
-    def __init__(self, filename):
+    @staticmethod
+    def __unescape(match: re.Match) -> str:
+        return Tokenizer.__get_escape_value(match.group(1))
+
+    # the tokens are stored in a TokenTable, with lazy set the table is only filled while iterating
+    # lazy scanning still keeps every token: the tokens in the AST are views that read their text and location
+    # from the table, so it lives as long as the AST. At about 27 bytes a token that is a small part of what
+    # the AST retains, tests/token_memory.py measures it
+    def __init__(self, filename, lazy: bool = False):
+        assert len(TokenType) == 12 , "Too many TokenTypes defined at Tokenizer init"
+        assert len(Keyword) == 14, "Too many Keywords defined at Tokenizer init"
+        assert len(Operator) == 11, "Too many Manipulators defined at Tokenizer init"
+        assert len(Intrinsic) == 16, "Too many Intrinsics defined at Tokenizer init"
+
         self.filename = filename
-        self.tokens = []
-        self.line = 0
-        self.column = 1
-        with open(filename, 'r') as f:
-            lines = f.readlines()
-            for (line_number, line) in enumerate(lines):
-                self.line += 1
-                assert len(TokenType) == 12 , "Too many TokenTypes defined at Tokenizer init"
-                assert len(Keyword) == 14, "Too many Keywords defined at Tokenizer init"
-                assert len(Operator) == 11, "Too many Manipulators defined at Tokenizer init"
-                assert len(Intrinsic) == 11, "Too many Intrinsics defined at Tokenizer init"
-                
-                char_pos = 0
-                while char_pos < len(line):
-                    while line[char_pos].isspace():
-                        if char_pos + 1 >= len(line):
-                            break
-                        char_pos += 1
-                    self.column = char_pos + 1
-                    if line[char_pos] == '\n':
-                        self.column = 1
-                        break
-
-
-                    word = ""
-                    if line[char_pos].isalpha():
-                        word = Tokenizer.__get_word_from_string(line[char_pos:])
-                        char_pos += len(word)
-                        if word in KEYWORDS_BY_NAME:
-                            self.tokens.append(Token(TokenType.KEYWORD, word, (self.filename, self.line, self.column), KEYWORDS_BY_NAME[word]))
-                        elif word in OPERATOR_BY_NAME:
-                            self.tokens.append(Token(TokenType.OPERATOR, word, (self.filename, self.line, self.column), OPERATOR_BY_NAME[word]))
-                        elif word in EXPRTYPE_BY_NAME:
-                            self.tokens.append(Token(TokenType.TYPE, word, (self.filename, self.line, self.column), EXPRTYPE_BY_NAME[word]))
-                        elif word in SYSCALL_BY_NAME:
-                            self.tokens.append(Token(TokenType.SYSCALL, word, (self.filename, self.line, self.column), SYSCALL_BY_NAME[word]))
-                        elif word in INTRINSIC_BY_NAME:
-                            self.tokens.append(Token(TokenType.INTRINSIC, word, (self.filename, self.line, self.column), INTRINSIC_BY_NAME[word]))
-                        else:
-                            if '-' in word:
-                                raise Exception("Invalid identifier: " + word)
-
-                            self.tokens.append(Token(TokenType.IDENTIFIER, word, (self.filename, self.line, self.column), word))  
-                    elif line[char_pos].isdigit():
-                        word = Tokenizer.__get_int_text_from_string(line[char_pos:])
-                        char_pos += len(word)
-                        if Tokenizer.__try_parse_int_literal(word) is not None:
-                            self.tokens.append(Token(TokenType.INT_LITERAL, word, (self.filename, self.line, self.column), int(word)))
-                        else:
-                            raise ValueError(f"Invalid integer literal at {self.filename}:{self.line}:{self.column}")
-                    elif line[char_pos] == '"':
-                        char_pos += 1
-                        while line[char_pos] != '"':
-                            if line[char_pos] == '\\':
-                                char_pos += 1
-                                word += Tokenizer.__get_escape_value(line[char_pos])
-                            else:
-                                word += line[char_pos]
-                            char_pos += 1
-                        char_pos += 1
-                        self.tokens.append(Token(TokenType.STRING_LITERAL, word, (self.filename, self.line, self.column), word))
-                    elif line[char_pos] == ',': # end of expression
-                        self.tokens.append(Token(TokenType.ARG_DELIMITER, None, (self.filename, self.line, self.column)))
-                        char_pos += 1
-                    elif line[char_pos] == ';': # this is a comment
-                        break
-                    elif line[char_pos] == '(': # paren block start
-                        char_pos += 1
-                        self.tokens.append(Token(TokenType.PAREN_BLOCK_START, '(', (self.filename, self.line, self.column)))
-                    elif line[char_pos] == ')': # paren block end
-                        char_pos += 1
-                        self.tokens.append(Token(TokenType.PAREN_BLOCK_END, ')', (self.filename, self.line, self.column)))
-                    else:
-                        raise ValueError(f"Invalid starting character {line[char_pos]} for token at {self.filename}:{self.line}:{self.column}")
-
-                    if line_number != len(lines):
-                        self.column = char_pos + 1
-                    else:
-                        self.tokens.append(Token(TokenType.EOE, None, (self.filename, self.line, self.column)))
-                        self.column = char_pos + 1
+        self.lazy = lazy
+        self.tokens: TokenTable = TokenTable(filename)
+        if not lazy:
+            for _ in self.scan():
+                pass
+
+    def __iter__(self) -> Iterator[Token]:
+        if self.lazy:
+            return self.scan()
+        return iter(self.tokens)
+
+    # scan the file into the token table, yielding every new token
+    def scan(self) -> Iterator[Token]:
+        with open(self.filename, 'r') as f:
+            text = f.read()
+
+        table = self.tokens
+        intern = table.intern
+        append_type = table.types.append
+        append_line = table.lines.append
+        append_column = table.columns.append
+        append_text = table.texts.append
+        append_value = table.values.append
+        # every distinct lexeme is resolved once, the entry holds what goes into the table columns
+        # (type code, text index, value index) and what goes into the view (type, value)
+        lexemes: Dict[Tuple[str, str], Tuple[int, int, int, TokenType, Optional[Union[int, str, Enum]]]] = {}
+
+        index = len(table)
+        line = 1
+        line_start = 0
+        for match in TOKEN_PATTERN.finditer(text):
+            kind = match.lastgroup
+            if kind == "comment" or kind == "end":
+                continue
+            elif kind == "newline":
+                line += 1
+                line_start = match.end()
+                continue
+
+            word = match.group(kind)
+            column = match.start(kind) - line_start + 1
+            entry = lexemes.get((kind, word))
+            if entry is None:
+                token_text: Optional[str] = word
+                if kind == "word":
+                    token_type, value = WORD_TOKENS.get(word, (TokenType.IDENTIFIER, word))
+                    if token_type == TokenType.IDENTIFIER and '-' in word:
+                        raise Exception("Invalid identifier: " + word)
+                elif kind == "int":
+                    token_type, value = TokenType.INT_LITERAL, int(word)
+                elif kind == "string":
+                    token_text = word[1:-1]
+                    if '\\' in token_text:
+                        token_text = ESCAPE_PATTERN.sub(Tokenizer.__unescape, token_text)
+                    token_type, value = TokenType.STRING_LITERAL, token_text
+                elif kind == "delimiter": # end of expression
+                    token_type, token_text, value = TokenType.ARG_DELIMITER, None, None
+                elif kind == "paren_start": # paren block start
+                    token_type, value = TokenType.PAREN_BLOCK_START, None
+                elif kind == "paren_end": # paren block end
+                    token_type, value = TokenType.PAREN_BLOCK_END, None
+                else:
+                    raise ValueError(f"Invalid starting character {word} for token at {self.filename}:{line}:{column}")
+                text_index = intern(token_text)
+                value_index = text_index if value is token_text else intern(value)
+                entry = (TOKENTYPE_CODES[token_type], text_index, value_index, token_type, value)
+                lexemes[(kind, word)] = entry
+
+            append_type(entry[0])
+            append_line(line)
+            append_column(column)
+            append_text(entry[1])
+            append_value(entry[2])
+            yield Token(table, index, entry[3], entry[4])
+            index += 1
+
+# the parser's view of the token source: tokens are pulled on demand and only
+# the ones that have been peeked at are buffered
+# imported files are pushed onto an include stack, the stream then ends with the imported file
+# until it is popped again and reading continues where the importing file left off
+class TokenStream:
+    def __init__(self, source: Iterable[Token]):
+        self.source: Iterator[Token] = iter(source)
+        self.lookahead: Deque[Token] = deque()
+        self.includes: List[Tuple[Iterator[Token], Deque[Token]]] = []
+
+    def next(self) -> Optional[Token]:
+        if self.lookahead:
+            return self.lookahead.popleft()
+        return next(self.source, None)
+
+    def peek(self, offset: int = 0) -> Optional[Token]:
+        while len(self.lookahead) <= offset:
+            token = next(self.source, None)
+            if token is None:
+                return None
+            self.lookahead.append(token)
+        return self.lookahead[offset]
+
+    def push(self, source: Iterable[Token]):
+        self.includes.append((self.source, self.lookahead))
+        self.source = iter(source)
+        self.lookahead = deque()
+
+    def pop(self):
+        self.source, self.lookahead = self.includes.pop()
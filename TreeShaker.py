@@ -0,0 +1,76 @@
+from typing import *
+
+from JlangObjects import *
+from Statements import *
+from EffectAnalysis import Effect, EffectAnalysis
+
+# removes the functions, globals, constants and strings that the program can't reach from main, so they are not
+# assembled into every executable that imports them. Names are reached through calls, references to globals and
+# constants, and the labels of strings and arrays. A global whose initializer has effects is kept with what it
+# reaches, its initializer runs before main whether the global is used or not
+class TreeShaker:
+    def __init__(self, effects: EffectAnalysis):
+        self.effects: EffectAnalysis = effects
+        self.reachable: Set[str] = set()
+        self.removed: List[Tuple[str, str, Optional[LocTuple]]] = [] # kind, name and location of what was removed
+
+    # the statements, globals and the constants that are kept in memory are changed in place. Strings are
+    # referred to by their index, the removed ones are set to None
+    def shake_program(self, statements: List[Statement], global_vars: Dict[str, VarDefStmt], constants: Dict[str, Constant], strings: List[Optional[str]]):
+        functions = {stmt.proto.name: stmt for stmt in statements if isinstance(stmt, FunStmt)}
+        pending = ["main"] + [name for name, var in global_vars.items() \
+                              if var.value is not None and self.effects.effect_of([var.value]) == Effect.IMPURE]
+        while len(pending) > 0:
+            name = pending.pop()
+            if name in self.reachable:
+                continue
+            self.reachable.add(name)
+            if name in functions:
+                pending.extend(TreeShaker.__references(functions[name]))
+            elif name in global_vars and global_vars[name].value is not None:
+                pending.extend(TreeShaker.__references(global_vars[name].value))
+            elif name in constants and isinstance(constants[name].value, str):
+                pending.append(constants[name].value) # the label of a string
+
+        for name, fun in functions.items():
+            if name not in self.reachable:
+                self.removed.append(("function", name, fun.proto.token.location))
+        statements[:] = [stmt for stmt in statements if not isinstance(stmt, FunStmt) or stmt.proto.name in self.reachable]
+        for name in [name for name in global_vars if name not in self.reachable]:
+            self.removed.append(("global", name, global_vars.pop(name).token.location))
+        for name in [name for name in constants if name not in self.reachable]:
+            self.removed.append(("constant", name, constants.pop(name).token.location))
+        for index, string in enumerate(strings):
+            if string is not None and f"_anon_str_{index}" not in self.reachable:
+                self.removed.append(("string", f"_anon_str_{index}", None))
+                strings[index] = None
+
+    def print_report(self):
+        counts = {kind: sum(1 for removed_kind, _, _ in self.removed if removed_kind == kind) for kind in ("function", "global", "constant", "string")}
+        print(f"Tree shaking: {counts['function']} functions, {counts['global']} globals, {counts['constant']} constants and {counts['string']} strings removed")
+        for kind, name, location in self.removed:
+            print(f"    {kind} {name}" + (f" at {format_location(location)}" if location is not None else ""))
+
+    # the names of the functions, globals, constants and labels used below node
+    @staticmethod
+    def __references(node: Statement) -> List[str]:
+        references: List[str] = []
+        pending: List[Statement] = [node]
+        while len(pending) > 0:
+            cur = pending.pop()
+            if isinstance(cur, FunCallExpr):
+                references.append(cur.target.value)
+            elif isinstance(cur, IdentRefExpr) and cur.ident_kind in (IdentType.GLOBAL_VARIABLE, IdentType.CONSTANT):
+                references.append(cur.value)
+            elif isinstance(cur, VarSetStmt) and cur.var_type == IdentType.GLOBAL_VARIABLE:
+                references.append(cur.target)
+            elif isinstance(cur, ArrayRefExpr) and cur.symbol is None:
+                references.append(cur.value)
+            elif isinstance(cur, ConstantExpr) and isinstance(cur.value, str):
+                references.append(cur.value)
+            for value in vars(cur).values():
+                if isinstance(value, Statement):
+                    pending.append(value)
+                elif isinstance(value, list):
+                    pending.extend(item for item in value if isinstance(item, Statement))
+        return references
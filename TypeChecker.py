@@ -143,6 +143,8 @@ class TypeChecker:
              isinstance(stmt, PrintStmt)  or \
              isinstance(stmt, LoaderExpr) or \
              isinstance(stmt, StorerStmt) or \
+             isinstance(stmt, BulkStorerStmt) or \
+             isinstance(stmt, VectorExpr) or \
              isinstance(stmt, AddressOfExpr):
             self.parse_intrinsic_types(stmt)
         elif isinstance(stmt, FunStmt):
@@ -167,11 +169,33 @@ class TypeChecker:
             # can't check the value type, it can be any type
             self.parse_expression_types(stmt.value)
             self.cur_branch.pop()
+        elif isinstance(stmt, BulkStorerStmt):
+            self.parse_expression_types(stmt.target)
+            self._check_type_mismatch(stmt.token, ExprType.POINTER, stmt.target.type)
+            self.cur_branch.pop()
+            self.parse_expression_types(stmt.value)
+            if stmt.token.value == Intrinsic.COPY:
+                self._check_type_mismatch(stmt.token, ExprType.POINTER, stmt.value.type)
+            self.cur_branch.pop()
+            self.parse_expression_types(stmt.length)
+            self._check_type_mismatch(stmt.token, ExprType.INTEGER, stmt.length.type)
+            self.cur_branch.pop()
         elif isinstance(stmt, LoaderExpr):
             self.parse_expression_types(stmt.value)
             self._check_type_mismatch(stmt.token, ExprType.POINTER, stmt.value.type)
             self.cur_branch.pop()
             self.cur_branch.append(StackEntry(stmt.token, ExprType.INTEGER))
+        elif isinstance(stmt, VectorExpr):
+            operand_types = {
+                Intrinsic.MATCH16: [ExprType.POINTER, ExprType.INTEGER],
+                Intrinsic.COMPARE16: [ExprType.POINTER, ExprType.POINTER],
+                Intrinsic.BITSCAN: [ExprType.INTEGER]
+            }[stmt.token.value]
+            for operand, operand_type in zip(stmt.value, operand_types):
+                self.parse_expression_types(operand)
+                self._check_type_mismatch(stmt.token, operand_type, operand.type)
+                self.cur_branch.pop()
+            self.cur_branch.append(StackEntry(stmt.token, ExprType.INTEGER))
         elif isinstance(stmt, AddressOfExpr):
             self.parse_expression_types(stmt.value)
             # can't type check the value, it is an identifier and could be any type
@@ -196,13 +220,22 @@ class TypeChecker:
             self.cur_branch.append(StackEntry(expr.token, expr.type))
 
     # do not push a context here, it's not a block
+    # operands are checked with an explicit stack in post-order, so long operator chains don't recurse
     def parse_binary_expr_types(self, expr: BinaryExpr):
-        self.parse_expression_types(expr.value)
-        self.parse_expression_types(expr.right)
-        LHS_type = self.cur_branch.pop()
-        RHS_type = self.cur_branch.pop()
-        self._check_type_mismatch(expr.token, LHS_type.type, LHS_type.type)
-        self.cur_branch.append(StackEntry(expr.token, expr.type))
+        stack: List[Tuple[Expression, bool]] = [(expr, False)]
+        while len(stack) > 0:
+            cur_expr, operands_done = stack.pop()
+            if not isinstance(cur_expr, BinaryExpr):
+                self.parse_expression_types(cur_expr)
+            elif operands_done:
+                LHS_type = self.cur_branch.pop()
+                RHS_type = self.cur_branch.pop()
+                self._check_type_mismatch(cur_expr.token, LHS_type.type, LHS_type.type)
+                self.cur_branch.append(StackEntry(cur_expr.token, cur_expr.type))
+            else:
+                stack.append((cur_expr, True))
+                stack.append((cur_expr.right, False))
+                stack.append((cur_expr.value, False))
     
     def parse_function_types(self, stmt: FunStmt):
         self._parse_block(stmt.block)
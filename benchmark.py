@@ -0,0 +1,77 @@
+import os
+import sys
+import glob
+import time
+import shutil
+import tempfile
+import subprocess
+from typing import *
+
+# compiles programs once per set of compiler flags and compares how long the executables run
+# usage: benchmark.py [--runs <n>] [--flags "<flags>"]... [files...]
+# the first set of flags is the baseline, without --flags the stack machine is compared to --regalloc
+
+COMPILER: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jlang.py")
+
+# returns the path of the executable, None if the program doesn't compile
+def compile_program(filename: str, flags: List[str], output_dir: str, tag: int) -> Optional[str]:
+    result = subprocess.run([sys.executable, COMPILER, filename, "--no-cache"] + flags, capture_output = True, text = True)
+    executable = filename.replace(".j", ".exe")
+    if result.returncode != 0 or "Generated executable" not in result.stdout:
+        return None
+    target = os.path.join(output_dir, f"{os.path.basename(executable)}.{tag}")
+    shutil.move(executable, target)
+    for artifact in (filename.replace(".j", ".asm"), filename.replace(".j", ".o")):
+        if os.path.exists(artifact):
+            os.remove(artifact)
+    return target
+
+# best wall clock time of the runs of each executable, and their output
+# the executables take turns, so a slow phase of the machine doesn't hit only one of them
+def run_programs(executables: List[str], runs: int) -> Tuple[List[float], List[bytes]]:
+    best = [float("inf")] * len(executables)
+    outputs = [b""] * len(executables)
+    for _ in range(runs):
+        for index, executable in enumerate(executables):
+            start = time.perf_counter()
+            result = subprocess.run([executable], capture_output = True)
+            best[index] = min(best[index], time.perf_counter() - start)
+            outputs[index] = result.stdout + f"[exit {result.returncode}]".encode()
+    return best, outputs
+
+def main():
+    args = sys.argv[1:]
+    runs = 5
+    configurations: List[List[str]] = []
+    files: List[str] = []
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg == "--runs":
+            runs = int(args.pop(0))
+        elif arg == "--flags":
+            configurations.append(args.pop(0).split())
+        else:
+            files.append(arg)
+    if len(configurations) == 0:
+        configurations = [[], ["--regalloc"]]
+    if len(files) == 0:
+        files = sorted(glob.glob(os.path.join("tests", "*.j")))
+
+    names = [" ".join(flags) if len(flags) > 0 else "(default)" for flags in configurations]
+    widths = [max(16, len(name) + 2) for name in names]
+    print(f"{'program':<28}" + "".join(f"{name:>{width}}" for name, width in zip(names, widths)) + "  speedup")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for filename in files:
+            executables = [compile_program(filename, flags, output_dir, tag) for tag, flags in enumerate(configurations)]
+            if None in executables:
+                print(f"{filename:<28} failed to compile")
+                continue
+            times, outputs = run_programs(executables, runs)
+            row = f"{filename:<28}" + "".join(f"{best * 1000:>{width - 3}.2f} ms" for best, width in zip(times, widths))
+            row += "  " + " ".join(f"{times[0] / best:.2f}x" for best in times[1:])
+            if any(output != outputs[0] for output in outputs):
+                row += "  OUTPUT DIFFERS"
+            print(row)
+
+if __name__ == "__main__":
+    main()
@@ -6,42 +6,99 @@ from enum import Enum, auto
 
 
 from ExpressionParser import ExpressionParser
+from ModuleCache import ModuleCache
+from ConstantFolder import ConstantFolder
+from LocalPromoter import LocalPromoter
+from Inliner import Inliner
+from EffectAnalysis import EffectAnalysis
+from LoopInvariantMotion import LoopInvariantMotion
+from TreeShaker import TreeShaker
+from PeepholeOptimizer import PeepholeOptimizer
+from FrameLayout import FrameLayout
+from IRBuilder import IRBuilder
+from IRVerifier import IRVerifier
+from IRLowering import IRLowering
 from JlangObjects import *
+from Statements import CodegenOptions, FunStmt
+from IR import IRFunction
 from Tokenizer import Tokenizer
 from TypeChecker import TypeChecker
 
 class Program:
-    def __init__(self, filename: str, dump_ast: bool = False, dump_tokens: bool = False, dump_functions: bool = False, dump_globals: bool = False):
+    def __init__(self, filename: str, dump_ast: bool = False, dump_tokens: bool = False, dump_functions: bool = False, dump_globals: bool = False, use_cache: bool = True, dump_ir: bool = False):
         self.filename: str = filename
         self.output_name: str = filename.replace(".j", ".asm")
-        self.tokens: List[Token] = Tokenizer(filename).tokens
-        self.parser: ExpressionParser = ExpressionParser(self.tokens)
+        tokens: Iterable[Token] = Tokenizer(filename, lazy = True)
+        if dump_tokens:
+            tokens = Program.tee_tokens(tokens)
+        self.parser: ExpressionParser = ExpressionParser(tokens, filename, ModuleCache() if use_cache else None)
         self.dump_ast: bool = dump_ast
         self.dump_tokens: bool = dump_tokens
         self.dump_functions: bool = dump_functions
         self.dump_globals: bool = dump_globals
+        self.dump_ir: bool = dump_ir
 
-    def generate_program(self):
-        if self.dump_tokens:
-            print("--------------------------------")
-            print("Tokens:\n")
-            for token in self.parser.tokens:
-                print(token)
-        
+    # print the tokens as the parser pulls them from the stream
+    @staticmethod
+    def tee_tokens(tokens: Iterable[Token]) -> Iterator[Token]:
+        print("--------------------------------")
+        print("Tokens:\n")
+        for token in tokens:
+            print(token)
+            yield token
 
+    def generate_program(self):
         AST = self.parser.parse_program()
         if AST is None:
             raise Exception("Failed to parse program")
-        
+
+        # values that are known at compile time are not computed at runtime
+        folder = ConstantFolder()
+        folder.fold_program(AST)
+        folder.fold_program(list(self.parser.global_vars.values()))
+
         checker = TypeChecker(AST.copy(), self.parser.prototypes.copy())
         checker.parse_program()
         checker.print_state()
 
+        # calls of small functions are replaced by their bodies, the calls have been type checked
+        if CodegenOptions.inline_threshold > 0:
+            inliner = Inliner(CodegenOptions.inline_threshold)
+            inliner.inline_program(AST)
+            inliner.print_report()
+            folder.fold_program(AST) # arguments that are known at compile time may fold with the body
+
+        # which functions store, print or make system calls, and which only read memory
+        effects = EffectAnalysis()
+        effects.analyse_program(AST)
+        if CodegenOptions.hoist_invariants:
+            motion = LoopInvariantMotion(effects)
+            motion.optimize_program(AST)
+            motion.print_report()
+
+        if CodegenOptions.promote_locals:
+            LocalPromoter().promote_program(AST)
+
+        # the uses of constants are immediates, only the constants whose address is taken are kept in memory
+        memory_constants = {name: const for name, const in self.parser.constants.items() if name in folder.addressed_constants}
+
+        if CodegenOptions.tree_shaking:
+            shaker = TreeShaker(effects)
+            shaker.shake_program(AST, self.parser.global_vars, memory_constants, self.parser.global_const_vars)
+            shaker.print_report()
+
+        # globals whose initial value is known at compile time are assembled into .data, the others are set by code
+        # that runs before main. Names are only known after their definition, so the code that sets a global,
+        # and the functions it calls, only see globals that are set before it either way
+        initialized = [var for var in self.parser.global_vars.values() if var.value is not None]
+        static_globals: Dict[str, str] = {var.name: var.static_value() for var in initialized if var.static_value() is not None}
+        print(f"Global initialization: {len(static_globals)} of {len(initialized)} globals initialized at compile time")
+
         if self.dump_functions:
             print("--------------------------------")
             print("Function table:\n")
             for proto in self.parser.prototypes.values():
-                print(proto.name)
+                print(f"{proto.name}: {effects.effect_of_call(proto.name).describe()}")
 
         if self.dump_globals:
             print("--------------------------------")
@@ -56,6 +113,18 @@ class Program:
                 expr.print(0)
 
 
+        ir_functions: Dict[str, IRFunction] = {}
+        if CodegenOptions.intermediate_code or self.dump_ir:
+            for function in IRBuilder().build_program(AST):
+                IRVerifier(function).verify()
+                ir_functions[function.name] = function
+
+        if self.dump_ir:
+            print("--------------------------------")
+            print("Intermediate code:\n")
+            for function in ir_functions.values():
+                function.dump()
+
         if "main" not in self.parser.prototypes:
             raise Exception("No main function found")
 
@@ -96,15 +165,24 @@ class Program:
             out.write("    add     rsp, 40\n")
             out.write("    ret\n")
 
+            # the peephole optimizer rewrites the body of every function before its frame is laid out
+            optimizer = PeepholeOptimizer() if CodegenOptions.peephole else None
+            FrameLayout.optimizer = optimizer
             for expr in AST:
-                expr.codegen(out)
+                if CodegenOptions.intermediate_code and isinstance(expr, FunStmt):
+                    IRLowering(ir_functions[expr.proto.name]).lower(out)
+                else:
+                    expr.codegen(out)
+            if optimizer is not None:
+                optimizer.print_report()
 
             out.write("\n\nglobal _start\n")
             out.write("_start:\n")
 
             out.write("\n\nglob_var_defs:\n")
             for var in self.parser.global_vars.values():
-                var.codegen(out)
+                if var.name not in static_globals:
+                    var.codegen(out)
 
             out.write("\ncall main\n")
             out.write("push rax\n")
@@ -115,18 +193,23 @@ class Program:
             out.write("pop rdi\n")
             out.write("syscall\n")
 
-            if len(self.parser.global_const_vars) > 0:
+            if len(self.parser.global_const_vars) > 0 or len(memory_constants) > 0 or len(static_globals) > 0:
                 out.write("\n\nsegment .data\n")
                 for index, s in enumerate(self.parser.global_const_vars):
+                    if s is None: # removed by tree shaking
+                        continue
                     out.write("_anon_str_%d: db %s,0\n" % (index, ','.join(map(str, list(map(ord, s))))))
             
-            if len(self.parser.constants) > 0:
-                for const in self.parser.constants.values():
-                    out.write(f"{const.name}: dq {const.value}\n")
+            for const in memory_constants.values():
+                out.write(f"{const.name}: dq {const.value}\n")
 
-            if len(self.parser.global_vars) > 0:
+            for name, value in static_globals.items():
+                out.write(f"{name}: dq {value}\n")
+
+            runtime_globals = [var for var in self.parser.global_vars.values() if var.name not in static_globals]
+            if len(runtime_globals) > 0:
                 out.write("\n\nsegment .bss\n")
-                for var in self.parser.global_vars.values():
+                for var in runtime_globals:
                     out.write(f"{var.name}: resb {var.size}\n")
 
 
@@ -151,15 +234,41 @@ class Program:
 
 def main():
     if len(sys.argv) < 2:
-        print("Usage: jlang.py <filename> [--dump-ast] [--dump-tokens] [--dump-functions] [--dump-globals]")
+        print("Usage: jlang.py <filename> [--dump-ast] [--dump-tokens] [--dump-functions] [--dump-globals] [--no-cache] [--regalloc] [--no-promote] [--no-peephole] [--no-strength-reduction] [--stack-args] [--no-inline] [--inline-threshold <n>] [--no-frame-elision] [--no-licm] [--no-tree-shaking] [--ir] [--dump-ir]")
         return
 
+    # expressions are evaluated in registers instead of on the stack
+    CodegenOptions.register_expressions = "--regalloc" in sys.argv
+    # local variables are kept in their stack slots
+    CodegenOptions.promote_locals = "--no-promote" not in sys.argv
+    # the emitted code is written as it was generated
+    CodegenOptions.peephole = "--no-peephole" not in sys.argv
+    # arithmetic with constants uses the generic multiply and divide instructions
+    CodegenOptions.strength_reduction = "--no-strength-reduction" not in sys.argv
+    # every argument of a call is pushed, like before arguments were passed in registers
+    CodegenOptions.register_arguments = "--stack-args" not in sys.argv
+    # calls are inlined up to this size of the called function's body
+    if "--inline-threshold" in sys.argv:
+        CodegenOptions.inline_threshold = int(sys.argv[sys.argv.index("--inline-threshold") + 1])
+    if "--no-inline" in sys.argv:
+        CodegenOptions.inline_threshold = 0
+    # every function sets up rbp and a frame, and returns through its end
+    CodegenOptions.elide_frames = "--no-frame-elision" not in sys.argv
+    # expressions that are the same on every iteration of a loop are evaluated on every iteration
+    CodegenOptions.hoist_invariants = "--no-licm" not in sys.argv
+    # every function, global and string is emitted, even if main can't reach it
+    CodegenOptions.tree_shaking = "--no-tree-shaking" not in sys.argv
+    # functions are lowered to three-address code before they are emitted
+    CodegenOptions.intermediate_code = "--ir" in sys.argv
+
     program = Program( \
         sys.argv[1], \
         "--dump-ast" in sys.argv, \
         "--dump-tokens" in sys.argv, \
         "--dump-functions" in sys.argv, \
-        "--dump-globals" in sys.argv \
+        "--dump-globals" in sys.argv, \
+        "--no-cache" not in sys.argv, \
+        "--dump-ir" in sys.argv \
     )   
     program.generate_program()
 
@@ -0,0 +1,94 @@
+import io
+import os
+import sys
+import time
+import inspect
+import tempfile
+import contextlib
+from typing import *
+
+# parses programs with 1k, 10k and 100k top level definitions and checks that the parse time grows linearly
+# and that the depth of the Python stack doesn't grow at all. The top level and the skipping of EOE tokens
+# are loops, a parser that recurses once per definition fails here with a RecursionError
+# usage: parse_scaling.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Tokenizer import Tokenizer
+from ExpressionParser import ExpressionParser
+
+SIZES: List[int] = [1000, 10000, 100000]
+STACK_ALLOWANCE: int = 200      # frames the parser may use above the caller, far below one frame per definition
+TIME_TOLERANCE: float = 2.5     # how much slower than linear a tenfold larger program may parse
+
+# alternating global variables and constants, each one referring to the one before it, followed by main
+def generate_source(definitions: int) -> str:
+    lines = ["define value_0 as integer is 1"]
+    for index in range(1, definitions):
+        if index % 2 == 0:
+            lines.append(f"define value_{index} as integer is value_{index - 1} plus {index}")
+        else:
+            lines.append(f"constant value_{index} as integer is {index}")
+    lines.append("function main() yields integer is")
+    lines.append(f"    return value_{definitions - 1 - (definitions - 1) % 2}")
+    lines.append("done")
+    return "\n".join(lines) + "\n"
+
+def parse_file(filename: str) -> ExpressionParser:
+    parser = ExpressionParser(Tokenizer(filename, lazy = True), filename)
+    with contextlib.redirect_stdout(io.StringIO()):
+        parser.parse_program()
+    return parser
+
+# the deepest the Python stack gets while parsing, counted from the caller
+def stack_depth(filename: str) -> int:
+    depth = 0
+    deepest = 0
+    def probe(frame, event, arg):
+        nonlocal depth, deepest
+        if event == "call":
+            depth += 1
+            deepest = max(deepest, depth)
+        elif event == "return":
+            depth -= 1
+    sys.setprofile(probe)
+    try:
+        parse_file(filename)
+    finally:
+        sys.setprofile(None)
+    return deepest
+
+# parse time in seconds, under a recursion limit that a parser recursing once per definition can't stay below
+def parse_time(filename: str) -> float:
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(len(inspect.stack(0)) + STACK_ALLOWANCE)
+    try:
+        start = time.perf_counter()
+        parser = parse_file(filename)
+        elapsed = time.perf_counter() - start
+    finally:
+        sys.setrecursionlimit(limit)
+    assert "main" in parser.prototypes, f"main was not parsed from {filename}"
+    return elapsed
+
+def main():
+    times: List[float] = []
+    depths: List[int] = []
+    with tempfile.TemporaryDirectory() as directory:
+        for definitions in SIZES:
+            filename = os.path.join(directory, f"scaling_{definitions}.j")
+            with open(filename, "w") as f:
+                f.write(generate_source(definitions))
+            times.append(parse_time(filename))
+            depths.append(stack_depth(filename))
+            print(f"{definitions:>8} definitions: {times[-1]:.2f} s, stack depth {depths[-1]}")
+
+    assert len(set(depths)) == 1, f"the stack depth grows with the number of definitions: {depths}"
+    for (smaller, small_time), (larger, large_time) in zip(zip(SIZES, times), zip(SIZES[1:], times[1:])):
+        ratio = large_time / small_time
+        limit = larger / smaller * TIME_TOLERANCE
+        assert ratio <= limit, f"parsing {larger} definitions took {ratio:.1f}x as long as {smaller}, more than {limit:.1f}x"
+    print("Parse time is linear and the stack depth is constant")
+
+if __name__ == "__main__":
+    main()
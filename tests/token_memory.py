@@ -0,0 +1,105 @@
+import io
+import os
+import sys
+import tempfile
+import contextlib
+import tracemalloc
+from dataclasses import dataclass
+from typing import *
+
+# measures the memory the tokens of a program take: the TokenTable against the Token dataclass it replaced,
+# which kept the text, a location tuple and the value in every token, and how much of what a lazy parse
+# retains is the table. Lazy scanning still appends every token to the table, the tokens in the AST are
+# views that read their text and location from it, so the table lives as long as the AST does
+# usage: token_memory.py [functions]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from JlangObjects import *
+from Tokenizer import Tokenizer
+from ExpressionParser import ExpressionParser
+from Statements import Statement
+
+FUNCTIONS: int = 2000
+MIN_SAVING: float = 3.0         # how many times smaller the table has to be than the old tokens
+MAX_TABLE_SHARE: float = 0.25   # how much of the memory a lazy parse retains may be the table
+
+# the token before the TokenTable, every token was a separate object
+@dataclass
+class OldToken:
+    type: TokenType
+    text: str
+    location: LocTuple
+    value: Optional[Union[int, str, Enum]] = None
+
+# functions with loops, strings and calls, so that every kind of token shows up
+def generate_source(functions: int) -> str:
+    lines = []
+    for index in range(functions):
+        lines.append(f"function work_{index}(text as pointer, count as integer) yields integer is")
+        lines.append(f"    define total as integer is {index}")
+        lines.append("    define i as integer is 0")
+        lines.append("    while i less count do")
+        lines.append(f"        total is total multiply 31 plus load8(text) plus i modulo {index + 7}")
+        lines.append("        i is i plus 1")
+        lines.append("    done")
+        lines.append(f'    print(total plus load8("work {index}\\n"))')
+        lines.append("    return total")
+        lines.append("done")
+    lines.append("function main() yields integer is")
+    lines.append('    return work_0("text", 3)')
+    lines.append("done")
+    return "\n".join(lines) + "\n"
+
+# the memory the value returned by build holds on to once it returned
+def retained(build: Callable[[], Any]) -> Tuple[Any, int]:
+    tracemalloc.start()
+    try:
+        result = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+# the old tokenizer sliced a new text out of the line for every token, the interned texts are copied the same way
+def old_tokens(table: TokenTable) -> List[OldToken]:
+    return [OldToken(token.type, None if token.text is None else (token.text + " ")[:-1], token.location, token.value) for token in table]
+
+def table_size(table: TokenTable) -> int:
+    size = sum(len(column) * column.itemsize for column in (table.types, table.lines, table.columns, table.texts, table.values))
+    size += sys.getsizeof(table.pool) + sys.getsizeof(table.pool_index)
+    return size + sum(sys.getsizeof(item) for item in table.pool if isinstance(item, str))
+
+# the parser and the AST, and the table the tokens in the AST point into
+def parse(filename: str) -> Tuple[ExpressionParser, List[Statement], TokenTable]:
+    tokenizer = Tokenizer(filename, lazy = True)
+    parser = ExpressionParser(tokenizer, filename)
+    with contextlib.redirect_stdout(io.StringIO()):
+        AST = parser.parse_program()
+    return parser, AST, tokenizer.tokens
+
+def main():
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else FUNCTIONS
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "token_memory.j")
+        with open(filename, "w") as f:
+            f.write(generate_source(functions))
+
+        tokenizer, table_bytes = retained(lambda: Tokenizer(filename))
+        count = len(tokenizer.tokens)
+        tokens, old_bytes = retained(lambda: old_tokens(tokenizer.tokens))
+        print(f"{count} tokens")
+        print(f"    TokenTable:    {table_bytes / 2**20:6.1f} MiB, {table_bytes / count:5.1f} B/token")
+        print(f"    old Token:     {old_bytes / 2**20:6.1f} MiB, {old_bytes / count:5.1f} B/token")
+        del tokens, tokenizer
+
+        (parser, AST, table), parse_bytes = retained(lambda: parse(filename))
+        share = table_size(table)
+        print(f"    lazy parse:    {parse_bytes / 2**20:6.1f} MiB retained, {share / 2**20:.1f} MiB of it the table ({share / parse_bytes:.0%})")
+
+    assert old_bytes >= table_bytes * MIN_SAVING, f"the table takes {table_bytes} bytes, the old tokens only {old_bytes}"
+    assert share <= parse_bytes * MAX_TABLE_SHARE, f"the table is {share / parse_bytes:.0%} of what a lazy parse retains"
+    print("The TokenTable is a small part of what the AST retains")
+
+if __name__ == "__main__":
+    main()
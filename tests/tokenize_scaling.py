@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import tempfile
+from typing import *
+
+# tokenizes sources that grow along one line and sources that grow in number of lines, and checks that the
+# time grows linearly with the number of tokens either way. The tokenizer runs one pattern over the whole
+# file, a tokenizer that slices the rest of the line for every token is quadratic in the length of a line
+# usage: tokenize_scaling.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Tokenizer import Tokenizer
+
+LINE_SIZES: List[int] = [50000, 100000, 200000]     # terms on a single line
+FILE_SIZES: List[int] = [5000, 10000, 20000]        # lines of 20 terms
+TIME_TOLERANCE: float = 1.5     # how much slower than linear a twice as large source may tokenize
+RUNS: int = 3
+
+# a chain of terms with every kind of token that shows up inside of expressions
+def generate_terms(count: int, offset: int = 0) -> str:
+    terms = []
+    for index in range(offset, offset + count):
+        if index % 4 == 0:
+            terms.append(f"value_{index % 97}")
+        elif index % 4 == 1:
+            terms.append(str(index))
+        elif index % 4 == 2:
+            terms.append("load8(text)")
+        else:
+            terms.append(f'strlen("term {index % 13}\\n")')
+    return " plus ".join(terms)
+
+def generate_line(terms: int) -> str:
+    return f"define total as integer is {generate_terms(terms)}\n"
+
+def generate_lines(lines: int) -> str:
+    return "".join(f"define total_{line} as integer is {generate_terms(20, line)} ; line {line}\n" for line in range(lines))
+
+# best time of a few runs, and the number of tokens
+def tokenize_time(filename: str) -> Tuple[float, int]:
+    best = float("inf")
+    count = 0
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        tokenizer = Tokenizer(filename)
+        best = min(best, time.perf_counter() - start)
+        count = len(tokenizer.tokens)
+    return best, count
+
+def check_scaling(name: str, sizes: List[int], generate: Callable[[int], str], directory: str):
+    times: List[float] = []
+    counts: List[int] = []
+    for size in sizes:
+        filename = os.path.join(directory, f"{name}_{size}.j")
+        with open(filename, "w") as f:
+            f.write(generate(size))
+        elapsed, count = tokenize_time(filename)
+        times.append(elapsed)
+        counts.append(count)
+        print(f"{name:>6} {size:>8}: {count:>9} tokens, {elapsed * 1000:8.1f} ms, {count / elapsed / 1000:6.0f}k tokens/s")
+
+    for (small_count, small_time), (large_count, large_time) in zip(zip(counts, times), zip(counts[1:], times[1:])):
+        ratio = large_time / small_time
+        limit = large_count / small_count * TIME_TOLERANCE
+        assert ratio <= limit, f"{name}: {large_count} tokens took {ratio:.1f}x as long as {small_count}, more than {limit:.1f}x"
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        check_scaling("line", LINE_SIZES, generate_line, directory)
+        check_scaling("lines", FILE_SIZES, generate_lines, directory)
+    print("Tokenize time is linear in the length of a line and in the number of lines")
+
+if __name__ == "__main__":
+    main()